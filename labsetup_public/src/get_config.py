@@ -2,9 +2,21 @@ import logging
 import argparse
 import sys
 import logging
+import os
 from os import listdir
 from os.path import isfile, join
 import yaml
+try:
+  import cPickle as pickle
+except ImportError:
+  import pickle
+
+# the C implementation of the loader (libyaml) is much faster, same behavior as FullLoader
+Loader = getattr(yaml, "CFullLoader", yaml.FullLoader)
+
+# parsed and augmented configuration, invalidated if a config file changes (one per python version)
+SNAPSHOT_FILENAME = ".lab_config_py%i.pickle" % sys.version_info[0]
+SNAPSHOT_VERSION = 1
 
 from get_logger import setup_logging
 log = logging.getLogger(__name__)
@@ -43,7 +55,7 @@ def read_config_files(config_files):
     with open(config_file) as file:
       # The FullLoader parameter handles the conversion from YAML
       # scalar values to Python the dictionary format
-      config_entries = yaml.load(file, Loader=yaml.FullLoader)
+      config_entries = yaml.load(file, Loader=Loader)
       
       for (t,v) in config_entries.items():
         
@@ -76,6 +88,83 @@ def augment_lab_config(lab_config):
   
   return lab_config
 
+def port_name(port):
+  """returns the name of a port: 1 -> "1/-", "1/0" -> "1/0"
+  """
+  port = str(port)
+  return port if "/" in port else "%s/-" % port
+
+
+def index_lab_config(lab_config):
+  """adds lookup tables to the configuration (lab_config["index"]):
+  - device_type: device -> type
+  - phys_to_internal: device -> port name -> internal port number
+  - internal_to_phys: device -> internal port number -> port name
+  - pipe: device -> port name -> pipe
+  - peer: device -> port name -> (device, port name) at the other end of the cable
+
+  Args:
+      lab_config (dict): augmented configuration
+
+  Returns:
+      dict: lab_config
+  """
+  index = {"device_type": {}, "phys_to_internal": {}, "internal_to_phys": {}, "pipe": {}, "peer": {}}
+  for (device, d) in lab_config["devices"].items():
+    index["device_type"][device] = d.get("type")
+    for key in ["phys_to_internal", "internal_to_phys", "pipe", "peer"]:
+      index[key][device] = {}
+    for (name, port) in (d.get("ports") or {}).items():
+      if "internal" in port:
+        index["phys_to_internal"][device][name] = port["internal"]
+        index["internal_to_phys"][device][port["internal"]] = name
+      if "pipe" in port:
+        index["pipe"][device][name] = port["pipe"]
+      if "connected_to" in port:
+        index["peer"][device][name] = (port["connected_to"]["device"], port["connected_to"]["port"])
+  lab_config["index"] = index
+  return lab_config
+
+
+def internal_port(lab_config, device, port):
+  """returns the internal port number of a port (int or name, see port_name) of a device
+  """
+  return lab_config["index"]["phys_to_internal"][device][port_name(port)]
+
+
+def config_files_key(config_files):
+  """returns the name, modification time and size of the config files (key of the snapshot)
+  """
+  return sorted([(os.path.basename(f), os.path.getmtime(f), os.path.getsize(f)) for f in config_files])
+
+
+def read_snapshot(folder, key):
+  filepath = join(folder, SNAPSHOT_FILENAME)
+  if not isfile(filepath):
+    return None
+  try:
+    with open(filepath, "rb") as file:
+      snapshot = pickle.load(file)
+  except Exception as e:
+    log.debug("cannot read snapshot {}: {}".format(filepath, e))
+    return None
+  if snapshot.get("version") != SNAPSHOT_VERSION or snapshot.get("files") != key:
+    log.debug("snapshot {} is outdated".format(filepath))
+    return None
+  return snapshot["lab_config"]
+
+
+def write_snapshot(folder, key, lab_config):
+  filepath = join(folder, SNAPSHOT_FILENAME)
+  tmp_filepath = "{}.{}.tmp".format(filepath, os.getpid())
+  try:
+    with open(tmp_filepath, "wb") as file:
+      pickle.dump({"version": SNAPSHOT_VERSION, "files": key, "lab_config": lab_config}, file, 2)
+    os.rename(tmp_filepath, filepath)
+  except (IOError, OSError) as e:
+    log.debug("cannot write snapshot {}: {}".format(filepath, e))
+
+
 def device_ordering(lab_config, device_types = ["server","tofino"], reverse=False):
   if not isinstance(device_types,list):
     device_types = [device_types]
@@ -89,14 +178,25 @@ def device_ordering(lab_config, device_types = ["server","tofino"], reverse=Fals
   
   return ordering
 
-def get_config(folder):
+def get_config(folder, use_snapshot=True):
     log.info("searching config files in {}".format(folder))
     all_config_files = get_all_config_files(folder)
     log.debug("all config files: {}".format(all_config_files))
     
+    key = config_files_key(all_config_files)
+    if use_snapshot:
+      lab_config = read_snapshot(folder, key)
+      if lab_config is not None:
+        log.info("lab configuration (snapshot): {} devices and {} cables".format(len(lab_config["devices"]), len(lab_config["cables"])))
+        return lab_config
+    
     lab_config = read_config_files(all_config_files)
     log.info("lab configuration: {} devices and {} cables".format(len(lab_config["devices"]), len(lab_config["cables"])))
     
     lab_config = augment_lab_config(lab_config)
+    lab_config = index_lab_config(lab_config)
+    
+    if use_snapshot:
+      write_snapshot(folder, key, lab_config)
     
     return lab_config
\ No newline at end of file
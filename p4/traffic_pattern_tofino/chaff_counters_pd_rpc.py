@@ -0,0 +1,48 @@
+# serves the counters of the fake traffic ports to chaff_daemon.py (JSON lines over TCP)
+# ~/tools/run_pd_rpc.py -p traffic_pattern_tofino ~/ditto/p4/traffic_pattern_tofino/chaff_counters_pd_rpc.py
+# request: {"ports": [144, 152]}, response: {"144": [frames, bytes], "152": [frames, bytes]}
+# (frames and bytes transmitted by the MAC of the port, see pal_rmon_counter_t)
+
+import json
+import socket
+import SocketServer
+device_name = socket.gethostname()
+
+from pal_rpc.ttypes import pal_rmon_counter_t
+
+print "device name %s" % device_name
+
+dev_id = 0
+counter_port = 9192
+
+
+# -------------------------- counters ----------------------
+
+def port_counters(port):
+    frames = pal.thrift.pal_port_this_stat_get(dev_id, port, pal_rmon_counter_t.pal_mac_stat_FramesTransmittedOK)
+    octets = pal.thrift.pal_port_this_stat_get(dev_id, port, pal_rmon_counter_t.pal_mac_stat_OctetsTransmittedTotal)
+    return [frames, octets]
+
+
+class CounterHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ""):
+            try:
+                request = json.loads(line)
+                response = {str(port): port_counters(port) for port in request["ports"]}
+            except Exception as e:
+                response = {"error": str(e)}
+            self.wfile.write(json.dumps(response) + "\n")
+            self.wfile.flush()
+
+
+# -------------------------- serve ----------------------
+
+SocketServer.TCPServer.allow_reuse_address = True
+server = SocketServer.TCPServer(("0.0.0.0", counter_port), CounterHandler)
+print "serving the counters of the fake traffic ports on port %i" % counter_port
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    server.server_close()
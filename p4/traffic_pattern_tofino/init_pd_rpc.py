@@ -113,33 +113,48 @@ for port in ports:
 
 # -------------------------- round robin queues ----------------------
 
-ports = info_dict["ports_rrqueues"]
-pattern = info_dict["config"]["pattern_sequence"]
-num_queues = len(pattern)
+# links of the device (programs for several links have a pattern, queues and shaping per link)
+links = info_dict.get("links", [{
+    "pattern_sequence": info_dict["config"]["pattern_sequence"],
+    "target_bw": info_dict["constants"].get("TARGET_BW", 100),
+    "state_index_to_port": info_dict["state_index_to_port"],
+    "ports_rrqueues": info_dict["ports_rrqueues"],
+    "queue_ports": info_dict["queue_ports"],
+}])
+if "traffic_classes" in info_dict:
+    links[0]["traffic_classes"] = info_dict["traffic_classes"]
+
+for link in links:
+    ports = link["ports_rrqueues"]
+    pattern = link["pattern_sequence"]
+    # one queue per state of each traffic class (qid_offset of the class + state index,
+    # programs generated with --runtime-pattern-length: per state up to the maximum length)
+    num_queues = sum([len(c["queue_ports"]) for c in link.get("traffic_classes", [link])])
+
+    #Queue identifiers
+    queue_id = {i:i for i in range(num_queues)}
 
-#Queue identifiers
-queue_id = {i:i for i in range(num_queues)}
-
-qmap = tm.q_map_t(*range(num_queues))
+    qmap = tm.q_map_t(*range(num_queues))
 
-for port in ports:
-    print "configure round-robin queueing for port %i with %i queues" % (port, num_queues)
-    
-    for i in range(num_queues):
-        tm.thrift.tm_set_q_sched_priority(dev_id, port, queue_id[i], 1)
+    for port in ports:
+        print "configure round-robin queueing for port %i with %i queues" % (port, num_queues)
         
-        dwrr_weight = 1
-        tm.thrift.tm_set_q_dwrr_weight(dev_id, port, queue_id[i], dwrr_weight)
+        for i in range(num_queues):
+            tm.thrift.tm_set_q_sched_priority(dev_id, port, queue_id[i], 1)
+            
+            dwrr_weight = 1
+            tm.thrift.tm_set_q_dwrr_weight(dev_id, port, queue_id[i], dwrr_weight)
 
 
 
 
 # -------------------------- traffic shaping ----------------------
-for (state_index, port) in info_dict["state_index_to_port"].items():
-    state_index = int(state_index)
-    margin = .01 # safety margin for rate to avoid congesting the rr queues
-    rate = 100000000. / sum(info_dict["config"]["pattern_sequence"]) * info_dict["config"]["pattern_sequence"][state_index] * (1-margin)
-
-    print "configure rate %i for port %i" % (rate, port)
-    tm.thrift.tm_enable_port_shaping(dev_id, port)
-    tm.thrift.tm_set_port_shaping_rate(dev_id, port, pps=False, rate=rate, burstsize=10000)
\ No newline at end of file
+for traffic_class in sum([link.get("traffic_classes", [link]) for link in links], []):
+    for (state_index, port) in traffic_class["state_index_to_port"].items():
+        state_index = int(state_index)
+        margin = .01 # safety margin for rate to avoid congesting the rr queues
+        rate = traffic_class["target_bw"] * 1e6 / sum(traffic_class["pattern_sequence"]) * traffic_class["pattern_sequence"][state_index] * (1-margin)
+
+        print "configure rate %i for port %i" % (rate, port)
+        tm.thrift.tm_enable_port_shaping(dev_id, port)
+        tm.thrift.tm_set_port_shaping_rate(dev_id, port, pps=False, rate=rate, burstsize=10000)
@@ -0,0 +1,34 @@
+# installs the table entries through pd_rpc (instead of the pd commands in bfshell_input_X.txt)
+# ~/tools/run_pd_rpc.py -p traffic_pattern_tofino ~/ditto/p4/traffic_pattern_tofino/install_entries_pd_rpc.py
+# (the ports still need to be configured with the ucli commands in bfshell_input_X.txt)
+
+import os
+import sys
+import socket
+device_name = socket.gethostname()
+
+print "device name %s" % device_name
+
+
+# -------------------------- read entries ----------------------
+script_path = "/home/tofino/ditto/p4/traffic_pattern_tofino/"
+
+sys.path.append(os.path.join(script_path, "../../python/p4_code_generator"))
+from table_entries import TableEntries
+from table_installer import PdRpcSession, TableInstaller, format_report
+
+# use the binary entries if generate_code.py wrote them (--entries-format binary)
+entries_path = script_path+'table_entries_%s.bin' % device_name
+if not os.path.exists(entries_path):
+    entries_path = script_path+'bfshell_input_%s.txt' % device_name
+
+entries = TableEntries.load(entries_path)
+print "install %i entries from %s" % (len(entries), entries_path)
+
+
+# -------------------------- install ----------------------
+session = PdRpcSession(globals(), "traffic_pattern_tofino")
+report = TableInstaller(session).install(entries)
+
+for line in format_report(report):
+    print line
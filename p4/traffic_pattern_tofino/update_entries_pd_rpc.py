@@ -0,0 +1,32 @@
+# applies one step of update_plan.json (generate_code.py --update-plan) through pd_rpc
+# DITTO_UPDATE_STEP=prepare ~/tools/run_pd_rpc.py -p traffic_pattern_tofino ~/ditto/p4/traffic_pattern_tofino/update_entries_pd_rpc.py
+# run each step (prepare, switch, cleanup) on both switches before the next step
+
+import os
+import sys
+import socket
+device_name = socket.gethostname()
+
+print "device name %s" % device_name
+
+
+# -------------------------- read plan ----------------------
+script_path = "/home/tofino/ditto/p4/traffic_pattern_tofino/"
+
+sys.path.append(os.path.join(script_path, "../../python/p4_code_generator"))
+from table_delta import read_plan, apply_plan, format_plan
+from table_installer import PdRpcSession
+
+plan = read_plan(script_path+'update_plan.json')
+for line in format_plan(plan):
+    print line
+
+step = os.environ["DITTO_UPDATE_STEP"]
+print "apply step %s" % step
+
+
+# -------------------------- update ----------------------
+session = PdRpcSession(globals(), "traffic_pattern_tofino")
+counts = apply_plan(plan, {device_name: session}, [step])
+
+print "%i operations" % counts.get(step, 0)
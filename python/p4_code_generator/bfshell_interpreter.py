@@ -0,0 +1,553 @@
+"""
+software model of the generated table entries.
+usage:
+python bfshell_interpreter.py --bfshell ../../p4/traffic_pattern_tofino/bfshell_input_tofino1.txt \
+    --info ../../p4/traffic_pattern_tofino/pd_rpc_info_tofino1.json --packets 1000000 -v
+
+Loads the table entries written by PatternCodeGenerator (bfshell input, .json or .bin) and
+executes the obfuscation tables of traffic_pattern_tofino.p4 on batches of packets:
+link_of_port (with several links), traffic_type, traffic_class (on the DSCP of the packets,
+with traffic classes), ignore_toobigpackets, assign_to_queue, recirculation_decision,
+set_padding_meta_next_etherType, add_padding_* (or pad_headers_* and add_padding in the
+single lookup padding mode) and deobfuscation_determine_next_ethertype.
+
+The final size and queue of every packet are checked against the pattern of its link and
+traffic class. In the single lookup padding mode, the pads of the pad_headers_* actions must
+add the bytes of add_padding and their etherTypes must form a chain.
+"""
+
+import os, sys, time
+import argparse
+import json
+import logging
+
+import numpy as np
+
+from traffic_trace import load_packet_sizes
+from table_entries import parse_bfshell, TableEntries
+from table_delta import links
+
+
+def setup_logging(loglevel="DEBUG"):
+    """Setup basic logging
+
+    Args:
+      loglevel (int): minimum loglevel for emitting messages
+    """
+    logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
+    logging.basicConfig(level=loglevel, stream=sys.stdout,
+                        format=logformat, datefmt="%Y-%m-%d %H:%M:%S")
+
+log = logging.getLogger(__name__)
+
+# custom_metadata.bytes_to_add is a 12bit field
+BYTES_TO_ADD_MASK = 0xfff
+# ipv4.diffserv: DSCP (6 bits) and ECN (2 bits)
+NUM_DSCP = 64
+
+
+def class_patterns(info):
+    """
+    returns the traffic class of the packets of each link and traffic type
+
+    Args:
+        info (dict): pd_rpc_info_X.json
+
+    Returns:
+        dict: (link_id, traffic_type) -> dict with name, pattern and qid_offset (traffic_type
+            None for all traffic types of a link without traffic classes)
+    """
+    patterns = {}
+    for link in links(info):
+        link_id = link.get("link_id", 0)
+        if "traffic_classes" not in link:
+            patterns[(link_id, None)] = {"name": "default", "pattern": link["pattern_sequence"], "qid_offset": 0}
+        for c in link.get("traffic_classes", []):
+            traffic_class = {"name": c["name"], "pattern": c["pattern_sequence"], "qid_offset": c["qid_offset"]}
+            for traffic_type in [c["traffic_type"], c["chaff_traffic_type"]]:
+                patterns[(link_id, traffic_type)] = traffic_class
+    return patterns
+
+
+def pad_group_pads(action):
+    """returns the pad size and number of pads of an action of a pad_headers_* table (e.g., add_pads_4x32_1x16)"""
+    if action is None or not action.startswith("add_pads_"):
+        return []
+    return [(int(p), int(n)) for (n, p) in [c.split("x") for c in action[len("add_pads_"):].split("_")]]
+
+
+class Table(object):
+    """
+    a match-action table with exact and range fields.
+    Entries with a lower priority value have precedence (like on the switch).
+    """
+
+    def __init__(self, name, entries):
+        self.name = name
+        self.entries = sorted(entries, key=lambda e: e["priority"] if e["priority"] is not None else 0)
+
+    def lookup(self, keys):
+        """looks up many packets at once
+
+        Args:
+            keys (dict): field name -> numpy array (one value per packet)
+
+        Returns:
+            numpy.ndarray: index of the matching entry for each packet (-1 on miss)
+        """
+        num_packets = len(keys.values()[0]) if keys else 0
+        hit = np.full(num_packets, -1, dtype=np.int64)
+
+        for (i, entry) in enumerate(self.entries):
+            match = hit < 0
+            for (field, value) in entry["match"].items():
+                if isinstance(value, tuple):
+                    match &= (keys[field] >= value[0]) & (keys[field] <= value[1])
+                else:
+                    match &= keys[field] == value
+            hit[match] = i
+        return hit
+
+    def actions(self, hit):
+        """returns the action names for the result of lookup (None on miss)"""
+        names = np.array([e["action"] for e in self.entries] + [None], dtype=object)
+        return names[hit]
+
+    def data(self, hit, name, default=0):
+        """returns the action data field name for the result of lookup (default on miss)"""
+        values = np.array([e["data"].get(name, default) for e in self.entries] + [default], dtype=np.int64)
+        return values[hit]
+
+
+class BfshellInterpreter(object):
+
+    # maximum number of recirculations before a packet is counted as lost
+    MAX_RECIRCULATIONS = 16
+
+    def __init__(self, entries, constants, patterns=None):
+        """
+        Args:
+            entries (list): table entries (see parse_bfshell)
+            constants (dict): constants of the code generator (from pd_rpc_info_<device>.json)
+            patterns (dict): traffic class of each link and traffic type (see class_patterns)
+        """
+        self.constants = constants
+        self.patterns = patterns or {}
+
+        by_table = {}
+        for entry in entries:
+            by_table.setdefault(entry["table"], []).append(entry)
+        self.tables = {name: Table(name, table_entries) for (name, table_entries) in by_table.items()}
+
+        # padding tables are applied from the largest to the smallest pad size
+        self.padding_tables = sorted([name for name in self.tables if name.startswith("add_padding_")],
+            key=lambda name: -int(name.split("_")[-1]))
+
+        # pad sizes of the single lookup padding mode (one add_padding table)
+        self.pad_sizes = sorted([int(k[len("NUM_"):-len("B_PADS")]) for k in constants
+            if k.startswith("NUM_") and k.endswith("B_PADS") and constants[k] > 0], reverse=True)
+        # pad_headers_* tables of the single lookup padding mode (in the order of the pipeline)
+        self.pad_group_tables = sorted([name for name in self.tables if name.startswith("pad_headers_")],
+            key=lambda name: int(name.split("_")[-1]))
+
+    @classmethod
+    def from_files(cls, bfshell_filepath, info_filepath):
+        entries = list(TableEntries.load(bfshell_filepath))
+        with open(info_filepath) as f:
+            info = json.load(f)
+        return cls(entries, info["constants"], class_patterns(info))
+
+    def table(self, name):
+        return self.tables.get(name, Table(name, []))
+
+    def ports(self, traffic_type=None):
+        """returns the ingress ports which the traffic_type table maps to the given traffic type (None: any)"""
+        return sorted([e["match"]["ig_intr_md_ingress_port"] for e in self.table("traffic_type").entries
+            if e["action"] == "set_traffic_type" and traffic_type in [None, e["data"].get("traffic_type")]])
+
+    def __first_pass(self, link_id, traffic_type, total_len):
+        """
+        ingress and egress processing of a packet in the first pass
+        (i.e., before it goes to the priority queue or to the recirculation port)
+
+        Returns:
+            dict of arrays: dropped, state_index, qid, target_size, recirculate, total_len, pads,
+                bad_padding
+        """
+        META = self.constants["PADDING_META_LEN"]
+        n = len(total_len)
+
+        hit = self.table("assign_to_queue").lookup({
+            "custom_metadata_link_id"           : link_id,
+            "padding_meta_traffic_type"         : traffic_type,
+            "padding_meta_instance_type"        : np.full(n, self.constants["INSTANCE_FIRSTPASS"], dtype=np.int64),
+            "padding_meta_totalLen"             : total_len,
+            "custom_metadata_packet_iterator"   : np.zeros(n, dtype=np.int64),
+        })
+        table = self.table("assign_to_queue")
+        dropped = (hit < 0) | (table.actions(hit) != "set_state_properties_priority")
+        target_size = table.data(hit, "target_size")
+
+        # bytes_to_add = target_size - totalLen (- PADDING_META_LEN if the packet is not too big)
+        bytes_to_add = np.where(target_size >= total_len, target_size - total_len - META, target_size - total_len) & BYTES_TO_ADD_MASK
+
+        recirculate = self.table("recirculation_decision").lookup({"custom_metadata_bytes_to_add": bytes_to_add}) < 0
+
+        # egress: add padding headers
+        pads = {}
+        bad_padding = np.zeros(n, dtype=bool)
+        if "add_padding" in self.tables:
+            (pads, bad_padding) = self.__pad_groups(bytes_to_add)
+            padding_table = self.table("add_padding")
+            num_bytes = padding_table.data(padding_table.lookup({"custom_metadata_bytes_to_add": bytes_to_add}), "num_bytes")
+            # the headers of the pad_headers_* actions must add the bytes of add_pads
+            bad_padding |= sum([pads[p] * p for p in pads], np.zeros(n, dtype=np.int64)) != num_bytes
+            bytes_to_add = (bytes_to_add - num_bytes) & BYTES_TO_ADD_MASK
+            total_len = total_len + num_bytes
+
+        for name in self.padding_tables:
+            pad_size = int(name.split("_")[-1])
+            padding_table = self.table(name)
+            pad_hit = padding_table.lookup({"custom_metadata_bytes_to_add": bytes_to_add})
+            num_pads = np.array([int(a.split("_")[-1]) if a is not None else 0 for a in padding_table.actions(np.arange(-1, len(padding_table.entries)))])
+            num_pads = num_pads[pad_hit + 1]
+            bytes_to_add = (bytes_to_add - num_pads * pad_size) & BYTES_TO_ADD_MASK
+            total_len = total_len + num_pads * pad_size
+            pads[pad_size] = num_pads
+
+        return {
+            "dropped"       : dropped,
+            "state_index"   : table.data(hit, "state_index", -1),
+            "qid"           : table.data(hit, "qid", -1),
+            "target_size"   : target_size,
+            "recirculate"   : recirculate & ~dropped,
+            "total_len"     : total_len,
+            "pads"          : pads,
+            "bad_padding"   : bad_padding & ~dropped,
+        }
+
+    def __pad_groups(self, bytes_to_add):
+        """
+        looks up the pad_headers_* tables of the single lookup padding mode (before add_padding,
+        which changes bytes_to_add)
+
+        Returns:
+            (dict, numpy.ndarray): number of pads of each pad size, and whether the etherTypes
+                of the headers do not form a chain (the last header of a group points to the first
+                header of the next group with headers, deobfuscation_determine_next_ethertype
+                finds the first header from the added bytes)
+        """
+        n = len(bytes_to_add)
+        pads = {p: np.zeros(n, dtype=np.int64) for p in self.pad_sizes}
+        groups = []
+        for name in self.pad_group_tables:
+            table = self.table(name)
+            hit = table.lookup({"custom_metadata_bytes_to_add": bytes_to_add})
+            entry_pads = [pad_group_pads(e["action"]) for e in table.entries] + [[]]
+            for p in pads:
+                pads[p] += np.array([dict(c).get(p, 0) for c in entry_pads], dtype=np.int64)[hit]
+            # etherType of the first header of the group (0 without headers)
+            first = np.array([self.constants["ETHERTYPE_%iB_PADS" % c[0][0]] if c else 0 for c in entry_pads], dtype=np.int64)[hit]
+            groups.append((first, table.data(hit, "next_etherType")))
+
+        bad_padding = np.zeros(n, dtype=bool)
+        following = np.zeros(n, dtype=np.int64)
+        for (first, next_ethertype) in reversed(groups):
+            has_pads = first > 0
+            bad_padding |= has_pads & (next_ethertype != following)
+            following = np.where(has_pads, first, following)
+        num_bytes = sum([pads[p] * p for p in pads], np.zeros(n, dtype=np.int64))
+        bad_padding |= (num_bytes > 0) & (self.deobfuscation_next_ethertype(num_bytes) != following)
+        return (pads, bad_padding)
+
+    def __second_pass(self, link_id, traffic_type, total_len):
+        """
+        ingress processing of a packet which comes back from the priority queue
+        (the packet goes to the round-robin queue)
+
+        Returns:
+            (numpy.ndarray, numpy.ndarray): dropped, round-robin queue
+        """
+        table = self.table("assign_to_queue")
+        hit = table.lookup({
+            "custom_metadata_link_id"           : link_id,
+            "padding_meta_traffic_type"         : traffic_type,
+            "padding_meta_instance_type"        : np.full(len(total_len), self.constants["INSTANCE_SECONDPASS"], dtype=np.int64),
+            "padding_meta_totalLen"             : total_len,
+            "custom_metadata_packet_iterator"   : np.zeros(len(total_len), dtype=np.int64),
+        })
+        dropped = (hit < 0) | (table.actions(hit) != "set_state_properties_roundrobin")
+        return dropped, table.data(hit, "qid", -1)
+
+    def simulate(self, ingress_port, frame_size, dscp=None):
+        """processes a batch of packets
+
+        Args:
+            ingress_port (numpy.ndarray): ingress port (internal port number) of each packet
+            frame_size (numpy.ndarray): size of each packet (IPv4 total length + 14)
+            dscp (numpy.ndarray): DSCP of each packet (default 0)
+
+        Returns:
+            dict of arrays: final_size, queue (round-robin qid), priority_queue, state_index,
+                            recirculations, dropped, obfuscated, link_id, traffic_type,
+                            next_etherType, bad_padding and pads_<size>
+        """
+        ingress_port = np.asarray(ingress_port, dtype=np.int64)
+        total_len = np.asarray(frame_size, dtype=np.int64).copy()
+        n = len(total_len)
+        diffserv = np.asarray(dscp if dscp is not None else np.zeros(n), dtype=np.int64) << 2
+
+        table = self.table("link_of_port")
+        link_id = table.data(table.lookup({"ig_intr_md_ingress_port": ingress_port}), "link_id")
+
+        hit = self.table("traffic_type").lookup({"ig_intr_md_ingress_port": ingress_port})
+        obfuscated = (hit >= 0) & (self.table("traffic_type").actions(hit) == "set_traffic_type")
+        traffic_type = self.table("traffic_type").data(hit, "traffic_type")
+
+        # the traffic class of production traffic (only the input ports have entries)
+        table = self.table("traffic_class")
+        class_hit = table.lookup({"ig_intr_md_ingress_port": ingress_port, "ipv4_diffserv": diffserv})
+        traffic_type = np.where(class_hit >= 0, table.data(class_hit, "traffic_type"), traffic_type)
+
+        too_big = self.table("ignore_toobigpackets").lookup({"padding_meta_origLen": total_len}) < 0
+        dropped = obfuscated & too_big
+
+        next_ethertype = self.table("set_padding_meta_next_etherType").data(
+            self.table("set_padding_meta_next_etherType").lookup({"custom_metadata_bytes_to_add": np.zeros(n, dtype=np.int64)}), "next_etherType")
+
+        result = {
+            "final_size"        : total_len.copy(),
+            "queue"             : np.full(n, -1, dtype=np.int64),
+            "priority_queue"    : np.full(n, -1, dtype=np.int64),
+            "state_index"       : np.full(n, -1, dtype=np.int64),
+            "recirculations"    : np.zeros(n, dtype=np.int64),
+            "dropped"           : dropped,
+            "obfuscated"        : obfuscated,
+            "link_id"           : link_id,
+            "traffic_type"      : traffic_type,
+            "next_etherType"    : next_ethertype,
+            "bad_padding"       : np.zeros(n, dtype=bool),
+        }
+        for pad_size in self.pad_sizes:
+            result["pads_%i" % pad_size] = np.zeros(n, dtype=np.int64)
+
+        active = np.nonzero(obfuscated & ~dropped)[0]
+        while len(active) > 0:
+            first_pass = self.__first_pass(link_id[active], traffic_type[active], total_len[active])
+
+            total_len[active] = first_pass["total_len"]
+            result["dropped"][active] |= first_pass["dropped"]
+            result["state_index"][active] = first_pass["state_index"]
+            result["priority_queue"][active] = first_pass["qid"]
+            result["bad_padding"][active] |= first_pass["bad_padding"]
+            for (pad_size, num_pads) in first_pass["pads"].items():
+                result["pads_%i" % pad_size][active] += num_pads
+
+            recirculated = active[first_pass["recirculate"]]
+            result["recirculations"][recirculated] += 1
+
+            lost = recirculated[result["recirculations"][recirculated] > self.MAX_RECIRCULATIONS]
+            result["dropped"][lost] = True
+            active = recirculated[result["recirculations"][recirculated] <= self.MAX_RECIRCULATIONS]
+
+        done = np.nonzero(obfuscated & ~result["dropped"])[0]
+        dropped, queue = self.__second_pass(link_id[done], traffic_type[done], total_len[done])
+        result["dropped"][done] |= dropped
+        result["queue"][done] = queue
+
+        bytes_to_add = np.zeros(n, dtype=np.int64)
+        bytes_to_add[done] = total_len[done] - np.asarray(frame_size)[done]
+        table = self.table("set_padding_meta_next_etherType")
+        result["next_etherType"] = table.data(table.lookup({"custom_metadata_bytes_to_add": bytes_to_add}), "next_etherType")
+
+        result["final_size"] = np.where(obfuscated, total_len + self.constants["PADDING_META_LEN"], total_len)
+        return result
+
+    def deobfuscation_next_ethertype(self, bytes_added):
+        """
+        returns the etherType which deobfuscation_determine_next_ethertype sets
+        for packets with the given number of padding bytes (0 on miss)
+        """
+        table = self.table("deobfuscation_determine_next_ethertype")
+        return table.data(table.lookup({"custom_metadata_bytes_to_add": np.asarray(bytes_added, dtype=np.int64)}), "etherType")
+
+
+def traffic_classes(interpreter, result):
+    """
+    returns the packets of each traffic class of each link
+
+    Returns:
+        list of (int, dict, numpy.ndarray): link_id, traffic class (see class_patterns) and
+            mask of its packets
+    """
+    classes = []
+    for (link_id, traffic_type) in sorted(interpreter.patterns, key=lambda k: (k[0], k[1] or 0)):
+        traffic_class = interpreter.patterns[(link_id, traffic_type)]
+        if any([c is traffic_class for (_, c, _) in classes]):
+            continue
+        types = [t for (l, t) in interpreter.patterns if l == link_id and interpreter.patterns[(l, t)] is traffic_class]
+        in_class = (result["link_id"] == link_id) & (np.isin(result["traffic_type"], types) if types != [None] else True)
+        classes.append((link_id, traffic_class, in_class))
+    return classes
+
+
+def check_result(interpreter, frame_size, result):
+    """
+    checks that every obfuscated packet which is not dropped has the size of its state
+    (in the pattern of its link and traffic class), goes to the round-robin queue of its state
+    and got a chain of padding headers
+
+    Returns:
+        list of strings: errors
+    """
+    errors = []
+    ok = result["obfuscated"] & ~result["dropped"]
+
+    for (link_id, traffic_class, in_class) in traffic_classes(interpreter, result):
+        prefix = "link %i class %s: " % (link_id, traffic_class["name"])
+        packets = ok & in_class
+        wrong_queue = packets & (result["queue"] != result["state_index"] + traffic_class["qid_offset"])
+        if wrong_queue.any():
+            errors.append(prefix + "%i packets in the wrong round-robin queue (e.g., size %i)" % (wrong_queue.sum(), frame_size[wrong_queue][0]))
+
+        expected = np.array(traffic_class["pattern"])[np.clip(result["state_index"], 0, len(traffic_class["pattern"]) - 1)]
+        wrong_size = packets & (result["final_size"] != expected)
+        if wrong_size.any():
+            errors.append(prefix + "%i packets with the wrong size (e.g., size %i -> %i instead of %i)" \
+                % (wrong_size.sum(), frame_size[wrong_size][0], result["final_size"][wrong_size][0], expected[wrong_size][0]))
+        ok &= ~in_class
+
+    if ok.any():
+        errors.append("%i packets of links or traffic types without pattern (e.g., link %i traffic type %i)" \
+            % (ok.sum(), result["link_id"][ok][0], result["traffic_type"][ok][0]))
+
+    bad_padding = result["obfuscated"] & ~result["dropped"] & result["bad_padding"]
+    if bad_padding.any():
+        errors.append("%i packets whose padding headers do not add the bytes of add_padding or do not form a chain (e.g., size %i)" \
+            % (bad_padding.sum(), frame_size[bad_padding][0]))
+    return errors
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args ([str]): command line parameters as list of strings
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="volume obfuscation table entry interpreter")
+
+    parser.add_argument(
+        "--bfshell",
+        type=str,
+        required=True,
+        help="bfshell input file (or table entries .json/.bin) written by generate_code.py")
+
+    parser.add_argument(
+        "--info",
+        type=str,
+        required=True,
+        help="pd_rpc_info file written by generate_code.py")
+
+    parser.add_argument(
+        "--packets",
+        type=int,
+        default=1000000,
+        help="number of synthetic packets (uniform sizes)")
+
+    parser.add_argument(
+        "--traffic",
+        type=str,
+        default=None,
+        help="draw packet sizes from this pcap file or packet size histogram")
+
+    parser.add_argument(
+        "--chaff",
+        dest="chaff",
+        help="send the packets through the chaff ports instead of the input ports",
+        action="store_true")
+
+    parser.add_argument(
+        "--dscp",
+        type=int,
+        nargs="+",
+        default=None,
+        help="draw the DSCP of the packets from these values (default: all values with traffic classes, otherwise 0)")
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="store_const",
+        const=logging.INFO)
+
+    parser.add_argument(
+        "-vv",
+        "--very-verbose",
+        dest="loglevel",
+        help="set loglevel to DEBUG",
+        action="store_const",
+        const=logging.DEBUG)
+
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+
+    interpreter = BfshellInterpreter.from_files(args.bfshell, args.info)
+    with open(args.info) as f:
+        fake_ports = json.load(f)["ports_cloning"]
+
+    rng = np.random.RandomState(0)
+    if args.traffic:
+        sizes, counts = load_packet_sizes(args.traffic)
+        frame_size = rng.choice(sizes, size=args.packets, p=counts * 1./counts.sum())
+    else:
+        frame_size = rng.randint(14+20, interpreter.constants["MTU"]+1, size=args.packets)
+
+    # the input ports of all links (or their fake traffic ports)
+    ports = [p for p in interpreter.ports() if (p in fake_ports) == args.chaff]
+    ingress_port = rng.choice(ports, size=args.packets)
+
+    if args.dscp is not None:
+        dscp = rng.choice(args.dscp, size=args.packets)
+    elif "traffic_class" in interpreter.tables:
+        # the DSCPs of all traffic classes
+        dscp = rng.randint(0, NUM_DSCP, size=args.packets)
+    else:
+        dscp = np.zeros(args.packets, dtype=np.int64)
+
+    start = time.time()
+    result = interpreter.simulate(ingress_port, frame_size, dscp)
+    log.info("processed %i packets in %.2fs" % (args.packets, time.time() - start))
+
+    ok = result["obfuscated"] & ~result["dropped"]
+    log.info("dropped: %i packets (largest accepted packet: %i)" % (result["dropped"].sum(), frame_size[ok].max() if ok.any() else 0))
+    for (link_id, traffic_class, in_class) in traffic_classes(interpreter, result):
+        for state_index in range(len(traffic_class["pattern"])):
+            in_state = ok & in_class & (result["state_index"] == state_index)
+            log.info("link %i class %s state %i: %i packets, final sizes %s, recirculations %s" \
+                % (link_id, traffic_class["name"], state_index, in_state.sum(), np.unique(result["final_size"][in_state]).tolist(),
+                   np.bincount(result["recirculations"][in_state]).tolist()))
+
+    errors = check_result(interpreter, frame_size, result)
+    for error in errors:
+        log.error(error)
+    if errors:
+        sys.exit(1)
+
+
+def run():
+    """Entry point for console_scripts
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
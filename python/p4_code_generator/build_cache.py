@@ -0,0 +1,317 @@
+"""
+build cache for the P4 program: compiles only if the sources changed.
+usage:
+python build_cache.py --p4 ~/ditto/p4/traffic_pattern_tofino/p4src/traffic_pattern_tofino.p4 -v
+python build_cache.py --p4 ~/ditto/p4/traffic_pattern_tofino/p4src/traffic_pattern_tofino.p4 --check
+
+The key of a build is the hash of the P4 sources (the main file and all files it includes
+with #include "...", without volatile lines such as "// generated: <time>" and without the
+CLI section of add_padding.p4, which is not compiled), the build command, $SDE_INSTALL and the
+version of the SDE (its manifest or bf-p4c --version), so a new SDE needs a new compile.
+After a compile, the artifacts of the program in $SDE_INSTALL are copied to <cache>/<key>/. If the cache already contains the key, the artifacts are copied back
+instead of compiling. The key of the installed artifacts is stored next to them, so
+nothing is copied if they are up to date.
+"""
+
+import os, sys, time
+import re
+import glob
+import argparse
+import hashlib
+import json
+import shutil
+import subprocess
+import logging
+
+
+def setup_logging(loglevel="DEBUG"):
+    """Setup basic logging
+
+    Args:
+      loglevel (int): minimum loglevel for emitting messages
+    """
+    logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
+    logging.basicConfig(level=loglevel, stream=sys.stdout,
+                        format=logformat, datefmt="%Y-%m-%d %H:%M:%S")
+
+log = logging.getLogger(__name__)
+
+# lines which change with every generator run (see PatternCodeGenerator.write_code_to_file)
+VOLATILE_PREFIXES = ["// generated:"]
+# sections of generated files which are not compiled (IN_SECTION_CLI is never defined)
+IGNORED_SECTIONS = ["CLI"]
+
+DEFAULT_BUILD_COMMAND = "sudo ~/tools/p4_build.sh {p4} --with-tofino"
+DEFAULT_CACHE_DIRECTORY = "~/.ditto_build_cache"
+
+# artifacts of a P4_14 program in $SDE_INSTALL (SDE 8.9)
+ARTIFACT_DIRECTORIES = [
+    "share/tofinopd/{program}",
+    "lib/tofinopd/{program}",
+    "lib/python2.7/site-packages/tofinopd/{program}",
+    "lib/python2.7/site-packages/{program}",
+]
+ARTIFACT_FILES = [
+    "share/p4/targets/tofino/{program}.conf",
+]
+
+KEY_FILENAME = ".ditto_build_key"
+
+INCLUDE = re.compile(r'^\s*#\s*include\s+"([^"]+)"', re.MULTILINE)
+
+
+def normalized(text, ignored_sections=IGNORED_SECTIONS):
+    """returns text without volatile lines and ignored sections"""
+    lines = []
+    depth = 0
+    for line in text.split("\n"):
+        if depth:
+            if line.startswith("#if"):
+                depth += 1
+            elif line.startswith("#endif"):
+                depth -= 1
+        elif line.strip() in ["#ifdef IN_SECTION_%s" % s for s in ignored_sections]:
+            depth = 1
+        elif not any([line.startswith(p) for p in VOLATILE_PREFIXES]):
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def source_files(filepath, files=None):
+    """returns the P4 file and all files it includes (recursively, in the order of inclusion)"""
+    files = files if files is not None else []
+    filepath = os.path.abspath(filepath)
+    if filepath in files:
+        return files
+    files.append(filepath)
+    with open(filepath) as f:
+        text = f.read()
+    for include in INCLUDE.findall(text):
+        path = os.path.join(os.path.dirname(filepath), include)
+        if os.path.exists(path):
+            source_files(path, files)
+    return files
+
+
+def sde_version(sde_install):
+    """
+    returns the version of the SDE of sde_install: name and content of its manifest
+    (bf-sde-<version>.manifest in the SDE directory, which contains $SDE_INSTALL) or the output
+    of bf-p4c --version ("" if neither is found)
+    """
+    directories = [os.path.dirname(os.path.abspath(sde_install))] if sde_install else []
+    directories += [os.environ["SDE"]] if os.environ.get("SDE") else []
+    for directory in directories:
+        manifests = sorted(glob.glob(os.path.join(directory, "*.manifest")))
+        if manifests:
+            text = ""
+            for path in manifests:
+                with open(path) as f:
+                    text += "%s\n%s" % (os.path.basename(path), f.read())
+            return text
+    compiler = os.path.join(sde_install, "bin", "bf-p4c")
+    try:
+        return subprocess.check_output([compiler if os.path.exists(compiler) else "bf-p4c", "--version"], stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def build_key(p4_filepath, build_command, sde_install="", sde_version=""):
+    """hash of the normalized sources (relative to the main file), the build command and the SDE (install directory and version)"""
+    h = hashlib.sha256()
+    h.update(build_command.encode("utf-8"))
+    h.update(("\0%s\0%s" % (os.path.abspath(sde_install) if sde_install else "", sde_version)).encode("utf-8"))
+    directory = os.path.dirname(os.path.abspath(p4_filepath))
+    for path in source_files(p4_filepath):
+        with open(path) as f:
+            text = normalized(f.read())
+        h.update(("\0%s\0%s" % (os.path.relpath(path, directory), text)).encode("utf-8"))
+    return h.hexdigest()
+
+
+class BuildCache(object):
+
+    def __init__(self, p4_filepath, sde_install, cache_directory=DEFAULT_CACHE_DIRECTORY, build_command=DEFAULT_BUILD_COMMAND):
+        self.p4_filepath = os.path.abspath(p4_filepath)
+        self.program = os.path.splitext(os.path.basename(p4_filepath))[0]
+        self.sde_install = sde_install
+        self.sde_version = sde_version(sde_install)
+        self.cache_directory = os.path.expanduser(cache_directory)
+        self.build_command = build_command.format(p4=self.p4_filepath)
+        self.key = build_key(self.p4_filepath, build_command, sde_install, self.sde_version)
+
+    def artifacts(self):
+        """returns the paths of the artifacts relative to $SDE_INSTALL"""
+        return [d.format(program=self.program) for d in ARTIFACT_DIRECTORIES + ARTIFACT_FILES]
+
+    def key_filepath(self):
+        return os.path.join(self.sde_install, ARTIFACT_DIRECTORIES[0].format(program=self.program), KEY_FILENAME)
+
+    def installed_key(self):
+        if not os.path.exists(self.key_filepath()):
+            return None
+        with open(self.key_filepath()) as f:
+            return f.read().strip()
+
+    def entry_directory(self):
+        return os.path.join(self.cache_directory, self.key)
+
+    def status(self):
+        """
+        Returns:
+            string: installed (artifacts are up to date), cached (artifacts are in the cache) or build (compile needed),
+                for the sources and the SDE of the key (another SDE version needs another compile)
+        """
+        if self.installed_key() == self.key:
+            return "installed"
+        if os.path.exists(os.path.join(self.entry_directory(), "info.json")):
+            return "cached"
+        return "build"
+
+    def copy(self, source_root, target_root):
+        for path in self.artifacts():
+            (source, target) = (os.path.join(source_root, path), os.path.join(target_root, path))
+            if not os.path.exists(source):
+                continue
+            if os.path.isdir(target):
+                shutil.rmtree(target)
+            elif os.path.exists(target):
+                os.remove(target)
+            if not os.path.exists(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            if os.path.isdir(source):
+                shutil.copytree(source, target, symlinks=True)
+            else:
+                shutil.copy2(source, target)
+
+    def mark_installed(self):
+        with open(self.key_filepath(), "w") as f:
+            f.write(self.key)
+
+    def build(self):
+        """
+        compiles the program if the cache does not contain its artifacts (and installs them otherwise)
+
+        Returns:
+            string: status before the build (see status)
+        """
+        status = self.status()
+        if status == "installed":
+            log.info("%s is up to date (%s)" % (self.program, self.key[:12]))
+        elif status == "cached":
+            log.info("restoring %s from %s" % (self.program, self.entry_directory()))
+            self.copy(os.path.join(self.entry_directory(), "install"), self.sde_install)
+            self.mark_installed()
+        else:
+            log.info("compiling %s: %s" % (self.program, self.build_command))
+            start = time.time()
+            subprocess.check_call(self.build_command, shell=True)
+            log.info("compiled in %.0fs" % (time.time() - start))
+
+            self.mark_installed()
+            tmp = self.entry_directory() + ".tmp"
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp)
+            self.copy(self.sde_install, os.path.join(tmp, "install"))
+            with open(os.path.join(tmp, "info.json"), "w") as f:
+                json.dump({"program": self.program, "p4": self.p4_filepath, "build_command": self.build_command,
+                           "sde_install": os.path.abspath(self.sde_install), "sde_version": self.sde_version.split("\n")[0],
+                           "time": time.strftime("%Y-%m-%d %H:%M:%S")}, f)
+            if os.path.exists(self.entry_directory()):
+                shutil.rmtree(self.entry_directory())
+            os.rename(tmp, self.entry_directory())
+        return status
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args ([str]): command line parameters as list of strings
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="volume obfuscation P4 build cache")
+
+    parser.add_argument(
+        "--p4",
+        type=str,
+        required=True,
+        help="main P4 file (e.g., traffic_pattern_tofino.p4)")
+
+    parser.add_argument(
+        "--sde-install",
+        type=str,
+        default=os.environ.get("SDE_INSTALL", ""),
+        help="install directory of the SDE (default: $SDE_INSTALL)")
+
+    parser.add_argument(
+        "--cache",
+        type=str,
+        default=DEFAULT_CACHE_DIRECTORY,
+        help="cache directory")
+
+    parser.add_argument(
+        "--build-command",
+        type=str,
+        default=DEFAULT_BUILD_COMMAND,
+        help="command to compile the program ({p4} is replaced by the path of the P4 file)")
+
+    parser.add_argument(
+        "--check",
+        dest="check",
+        help="only print the key and whether a compile is needed (exit code 1 if so)",
+        action="store_true")
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="store_const",
+        const=logging.INFO)
+
+    parser.add_argument(
+        "-vv",
+        "--very-verbose",
+        dest="loglevel",
+        help="set loglevel to DEBUG",
+        action="store_const",
+        const=logging.DEBUG)
+
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+
+    cache = BuildCache(args.p4, args.sde_install, args.cache, args.build_command)
+    for path in source_files(args.p4):
+        log.debug("source %s" % path)
+    if cache.sde_version:
+        log.debug("SDE %s" % cache.sde_version.split("\n")[0])
+    else:
+        log.warning("unknown SDE version (no manifest in the SDE directory or $SDE, no bf-p4c), the key only contains the install directory")
+
+    if args.check:
+        status = cache.status()
+        print "%s %s" % (cache.key, status)
+        sys.exit(1 if status == "build" else 0)
+
+    if not args.sde_install:
+        log.error("--sde-install or $SDE_INSTALL is required")
+        sys.exit(1)
+    cache.build()
+
+
+def run():
+    """Entry point for console_scripts
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,242 @@
+"""
+size of the chaff pool which circulates in the clone loops of the fake traffic ports.
+usage:
+python chaff_pool.py --info ../../p4/traffic_pattern_tofino/pd_rpc_info_tofino1.json --loop-rtt 10e-6 -v
+python chaff_pool.py --info ../../p4/traffic_pattern_tofino/pd_rpc_info_tofino1.json --loop-rtt 10e-6 \
+    --output ../../p4/traffic_pattern_tofino/chaff_plan_tofino1.json
+
+A chaff packet which arrives on a fake traffic port is cloned back to the port (clone session
+of ports_cloning, see init_pd_rpc.py) and its original is obfuscated in the state of its size
+(qid 0 of the state's priority queuing port). Every chaff packet in the loop therefore offers
+one chaff packet to its state per loop round trip time (RTT). Without production traffic, a
+state sends rate / (8 * size) packets per second (shaping rate, see init_pd_rpc.py), so the
+loop needs
+    packets = ceil(pps * RTT * (1 + headroom))
+chaff packets of the state. With too few, the pattern stalls under low load, with too many,
+the chaff occupies the queue buffer. The states of a traffic class are mapped to the fake
+traffic ports of the class in turn (see generate_code.py); the chaff of all states of a port
+has to fit in the port's bandwidth.
+
+The chaff of a state is the largest frame which assign_to_queue maps to the state without
+padding (see inject_chaff_packets.py). The injection plan lists the number of chaff packets
+of each state and the largest injection rate which does not overrun a loop (the bandwidth of
+the fake traffic port which is not used by the full pool). inject_chaff_packets.py --plan
+sends exactly these packets.
+"""
+
+import os, sys, time
+import argparse
+import json
+import logging
+import math
+
+from queue_simulator import SHAPING_MARGIN
+from table_delta import links, shaping_rates
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../send_packets"))
+from inject_chaff_packets import chaff_size, DEFAULT_MAX_FRAME_SIZE
+from raw_injector import WIRE_OVERHEAD
+
+
+def setup_logging(loglevel="DEBUG"):
+    """Setup basic logging
+
+    Args:
+      loglevel (int): minimum loglevel for emitting messages
+    """
+    logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
+    logging.basicConfig(level=loglevel, stream=sys.stdout,
+                        format=logformat, datefmt="%Y-%m-%d %H:%M:%S")
+
+log = logging.getLogger(__name__)
+
+# round trip time of a chaff packet through the clone loop (seconds)
+DEFAULT_LOOP_RTT = 10e-6
+# additional chaff for variations of the RTT
+DEFAULT_HEADROOM = .1
+# speed of the fake traffic ports (Gbps, see PatternCodeGenerator.phys_port_to_speed)
+DEFAULT_FAKE_PORT_SPEED = 100
+
+
+def chaff_plan(info, loop_rtt=DEFAULT_LOOP_RTT, port_speeds=None, headroom=DEFAULT_HEADROOM, max_frame_size=DEFAULT_MAX_FRAME_SIZE):
+    """
+    Args:
+        info (dict): pd_rpc_info_X.json
+        loop_rtt (float): round trip time of the clone loops (seconds)
+        port_speeds (dict): speed (Gbps) of each fake traffic port (internal port), default DEFAULT_FAKE_PORT_SPEED
+        headroom (float): additional share of chaff packets
+        max_frame_size (int): largest frame of the injecting interface
+
+    Returns:
+        dict: device, loop_rtt, headroom, states (link_id, traffic_class, state, size, chaff_size,
+            fake_port, fake_port_index, pps, packets), ports (fake_port, speed_gbps, packets, chaff_gbps,
+            utilization), packets and rate_gbps (injection rate)
+    """
+    rates = shaping_rates(info)
+    states = []
+    for (link, traffic_class) in [(l, c) for l in links(info) for c in l.get("traffic_classes", [l])]:
+        pattern = traffic_class["pattern_sequence"]
+        ports = traffic_class.get("ports_cloning", link.get("ports_cloning", info["ports_cloning"]))
+        # (the keys are strings in pd_rpc_info_X.json)
+        state_ports = {int(k): int(v) for (k, v) in traffic_class["state_index_to_port"].items()}
+        state_speeds = {int(k): v for (k, v) in traffic_class.get("state_index_to_speed", info["state_index_to_speed"]).items()}
+        for (state, size) in enumerate(pattern):
+            frame = chaff_size(pattern, state, info["constants"]["PADDING_META_LEN"], max_frame_size)
+            if frame is None:
+                log.warning("state %i (%i bytes) cannot be filled with frames of at most %i bytes" % (state, size, max_frame_size))
+                continue
+            port = ports[state % len(ports)]
+            # shaping rate (kbps), at most the speed of the state's port
+            rate = min(rates[state_ports[state]] * 1e3, state_speeds.get(state, float("inf")) * 1e9)
+            pps = rate / (8. * size)
+            states.append({
+                "link_id"         : link.get("link_id", 0),
+                "traffic_class"   : traffic_class.get("name", "default"),
+                "state"           : state,
+                "size"            : size,
+                "chaff_size"      : frame,
+                "fake_port"       : port,
+                "fake_port_index" : info["ports_cloning"].index(port),
+                "pps"             : pps,
+                "packets"         : int(math.ceil(pps * loop_rtt * (1 + headroom))),
+            })
+
+    plan_ports = []
+    for port in sorted(set([s["fake_port"] for s in states])):
+        port_states = [s for s in states if s["fake_port"] == port]
+        speed = (port_speeds or {}).get(port, DEFAULT_FAKE_PORT_SPEED)
+        chaff_gbps = sum([s["packets"] * (s["chaff_size"] + WIRE_OVERHEAD) * 8. for s in port_states]) / loop_rtt / 1e9
+        plan_ports.append({
+            "fake_port"   : port,
+            "speed_gbps"  : speed,
+            "packets"     : sum([s["packets"] for s in port_states]),
+            "chaff_gbps"  : chaff_gbps,
+            "utilization" : chaff_gbps / speed,
+        })
+
+    return {
+        "device"    : info["config"]["obfuscation_device"],
+        "loop_rtt"  : loop_rtt,
+        "headroom"  : headroom,
+        "states"    : states,
+        "ports"     : plan_ports,
+        "packets"   : sum([s["packets"] for s in states]),
+        # the injected packets of a port share its bandwidth with the loop
+        "rate_gbps" : max(min([p["speed_gbps"] - p["chaff_gbps"] for p in plan_ports] or [0]), 0) * (1 - SHAPING_MARGIN),
+    }
+
+
+def format_plan(plan):
+    """returns the lines of a readable summary of a chaff plan"""
+    lines = []
+    for s in plan["states"]:
+        lines.append("link %i class %s state %i (%iB): %i chaff packets of %iB on fake traffic port %i (%.0f pps)" % (
+            s["link_id"], s.get("traffic_class", "default"), s["state"], s["size"], s["packets"], s["chaff_size"], s["fake_port"], s["pps"]))
+    for p in plan["ports"]:
+        lines.append("fake traffic port %i: %i packets, %.2f of %i Gbps (%.0f%%)" % (
+            p["fake_port"], p["packets"], p["chaff_gbps"], p["speed_gbps"], 100. * p["utilization"]))
+    lines.append("%s: %i chaff packets for a loop RTT of %.1fus, inject at up to %.2f Gbps" % (
+        plan["device"], plan["packets"], plan["loop_rtt"] * 1e6, plan["rate_gbps"]))
+    return lines
+
+
+def check_plan(plan):
+    """returns the problems of a chaff plan (fake traffic ports which cannot carry the chaff of their states)"""
+    return ["fake traffic port %i needs %.2f Gbps of chaff but has %i Gbps (use more fake traffic ports)" % (p["fake_port"], p["chaff_gbps"], p["speed_gbps"])
+            for p in plan["ports"] if p["utilization"] > 1]
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args ([str]): command line parameters as list of strings
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="volume obfuscation chaff pool sizing")
+
+    parser.add_argument(
+        "--info",
+        type=str,
+        required=True,
+        help="pd_rpc_info file written by generate_code.py")
+
+    parser.add_argument(
+        "--loop-rtt",
+        type=float,
+        default=DEFAULT_LOOP_RTT,
+        help="measured or configured round trip time of the clone loops in seconds")
+
+    parser.add_argument(
+        "--headroom",
+        type=float,
+        default=DEFAULT_HEADROOM,
+        help="additional share of chaff packets")
+
+    parser.add_argument(
+        "--fake-port-speed",
+        type=int,
+        default=DEFAULT_FAKE_PORT_SPEED,
+        help="speed of the fake traffic ports in Gbps")
+
+    parser.add_argument(
+        "--max-frame-size",
+        type=int,
+        default=DEFAULT_MAX_FRAME_SIZE,
+        help="largest frame (without FCS) of the injecting interface")
+
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="write the injection plan to this JSON file (see inject_chaff_packets.py --plan)")
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="store_const",
+        const=logging.INFO)
+
+    parser.add_argument(
+        "-vv",
+        "--very-verbose",
+        dest="loglevel",
+        help="set loglevel to DEBUG",
+        action="store_const",
+        const=logging.DEBUG)
+
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+
+    with open(args.info) as f:
+        info = json.load(f)
+
+    port_speeds = {port: args.fake_port_speed for port in info["ports_cloning"]}
+    plan = chaff_plan(info, args.loop_rtt, port_speeds, args.headroom, args.max_frame_size)
+    for line in format_plan(plan):
+        log.info(line)
+    for problem in check_plan(plan):
+        log.warning(problem)
+
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump(plan, outfile)
+
+
+def run():
+    """Entry point for console_scripts
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,228 @@
+"""
+device configurations of all ditto links of a fleet (see fleet.yaml).
+usage:
+python fleet.py --fleet fleet.yaml -v
+python generate_code.py --fleet fleet.yaml --output ../../p4/traffic_pattern_tofino/fleet/ -v
+
+The fleet file lists the links as pairs of devices and the port roles which are the same on
+all devices (optionally overwritten per device). The ports of a link are taken from the cable
+between its devices in the lab configuration (cables.yaml), the loopback pairs of the priority
+queues and of the recirculation port are checked against it. The first device of a link is
+connected to the source server, the second one to the destination server.
+
+A device can protect several links (e.g., tofino1 with links to tofino2 and tofino3). All its
+links share its priority queuing ports, but each link needs its own server, fake traffic and
+recirculation ports (the switch identifies the link of a packet by its ingress port), which
+the "roles" of a link set per device.
+"""
+
+import os, sys, time
+import argparse
+import json
+import logging
+import yaml
+
+sys.path.append("/".join(os.path.abspath(os.getcwd()).split("/")[:-2])) # append root directory to path
+
+from labsetup_public.src.get_config import get_config, port_name
+
+
+def setup_logging(loglevel="DEBUG"):
+    """Setup basic logging
+
+    Args:
+      loglevel (int): minimum loglevel for emitting messages
+    """
+    logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
+    logging.basicConfig(level=loglevel, stream=sys.stdout,
+                        format=logformat, datefmt="%Y-%m-%d %H:%M:%S")
+
+log = logging.getLogger(__name__)
+
+LAB_CONFIG_DIRECTORY = "../../labsetup_public/config/"
+
+# port roles which can differ between the links of a device (see PatternCodeGenerator.LINK_FIELDS)
+LINK_ROLES = ["server", "fake_traffic", "recirculation"]
+
+DEFAULT_ROLES = {
+    "target"          : "device",
+    "chip"            : "tofino",
+    "server"          : 1,
+    "fake_traffic"    : [3, 4, 5],
+    "priorityqueuing" : [27, 28, 29, 30],
+    "recirculation"   : [31, 32],
+}
+
+
+def load_fleet(filepath):
+    """
+    Returns:
+        dict: links (list of device pairs), defaults (port roles) and devices (port roles per device)
+    """
+    with open(filepath) as f:
+        fleet = yaml.load(f, Loader=yaml.FullLoader)
+    defaults = dict(DEFAULT_ROLES)
+    defaults.update(fleet.get("defaults") or {})
+    return {
+        "links": [l if isinstance(l, dict) else list(l) for l in fleet["links"]],
+        "defaults": defaults,
+        "devices": fleet.get("devices") or {},
+    }
+
+
+def phys_port(lab_config, device, name):
+    return lab_config["devices"][device]["ports"][name]["phys"]
+
+
+def cables_between(lab_config, a, b):
+    """returns the physical ports (port of a, port of b) of all cables between the devices a and b"""
+    ports = []
+    for cable in lab_config["cables"]:
+        (source, destination) = (cable["source"], cable["destination"])
+        if (source["device"], destination["device"]) == (a, b):
+            ports.append((phys_port(lab_config, a, source["port"]), phys_port(lab_config, b, destination["port"])))
+        elif (source["device"], destination["device"]) == (b, a):
+            ports.append((phys_port(lab_config, a, destination["port"]), phys_port(lab_config, b, source["port"])))
+    return sorted(ports)
+
+
+def check_loopbacks(lab_config, device, ports):
+    """returns the pairs of ports (out, in) which are not connected to each other on the device"""
+    peer = lab_config["index"]["peer"][device]
+    return [(out_port, in_port) for (out_port, in_port) in zip(ports[0::2], ports[1::2])
+            if peer.get(port_name(out_port)) != (device, port_name(in_port)) and peer.get(port_name(in_port)) != (device, port_name(out_port))]
+
+
+def device_configurations(fleet, lab_config, pattern):
+    """
+    Args:
+        fleet (dict): see load_fleet
+        lab_config (dict): see get_config
+        pattern (list): default pattern (overwritten by the pattern of a link)
+
+    Returns:
+        dict: device -> device configuration (see generate_code.py, with "links" for devices
+            which protect more than one link)
+    """
+    links = {}
+    for link in fleet["links"]:
+        (devices, link_pattern, target_bw, cable, link_roles, link_classes) = (link, pattern, None, None, {}, {})
+        if isinstance(link, dict):
+            (devices, link_pattern, target_bw) = (link["devices"], link.get("pattern", pattern), link.get("target_bw"))
+            (cable, link_roles) = (link.get("ports"), link.get("roles") or {})
+            link_classes = {k: link[k] for k in ["traffic_classes", "strict_visible_pattern"] if k in link}
+        (a, b) = devices
+        ports = cables_between(lab_config, a, b)
+        if not ports:
+            raise ValueError("no cable between %s and %s" % (a, b))
+        if cable is not None:
+            if tuple(cable) not in ports:
+                raise ValueError("no cable between %s %s and %s %s" % (a, cable[0], b, cable[1]))
+            ports = [tuple(cable)]
+        if len(ports) > 1:
+            log.warning("%i cables between %s and %s, using ports %s" % (len(ports), a, b, ports[0]))
+
+        for (device, link_port, server) in [(a, ports[0][0], "src"), (b, ports[0][1], "dst")]:
+            roles = dict(fleet["defaults"])
+            roles.update(fleet["devices"].get(device, {}))
+            roles.update({k: v for (k, v) in (link_roles.get(device) or {}).items() if k in LINK_ROLES})
+            (recirculation_out, recirculation_in) = roles["recirculation"]
+            for (out_port, in_port) in check_loopbacks(lab_config, device, roles["priorityqueuing"] + roles["recirculation"]):
+                log.warning("%s: ports %i and %i are not connected in the lab configuration" % (device, out_port, in_port))
+
+            configuration = {
+                #use physical port numbers
+                "target"              : roles["target"],
+                "connected_server"    : server,
+                "pattern"             : list(link_pattern),
+                "input"               : [roles["server"], recirculation_in],
+                "output"              : link_port,
+                "obf_input"           : [link_port, recirculation_out], # obfuscated traffic input -> will be deobfuscated
+                "obf_output"          : roles["server"], # output port for deobfuscated traffic
+                "priorityqueuing_out" : list(roles["priorityqueuing"]),
+                "priorityqueuing_in"  : list(roles["priorityqueuing"]),
+                "fake_traffic"        : list(roles["fake_traffic"]),
+                "recirculation"       : recirculation_out,
+                "chip"                : roles["chip"],
+            }
+            if target_bw is not None:
+                configuration["target_bw"] = target_bw
+            configuration.update(link_classes)
+            links.setdefault(device, []).append(configuration)
+
+    # the first link of a device is its device configuration, all links are in "links"
+    configurations = {}
+    for (device, device_links) in links.items():
+        configurations[device] = dict(device_links[0])
+        if len(device_links) > 1:
+            log.info("%s protects %i links" % (device, len(device_links)))
+            # (traffic classes of one link do not apply to the other links)
+            configurations[device]["links"] = [
+                dict({k: v for (k, v) in l.items() if k not in ["target", "connected_server", "priorityqueuing_out", "priorityqueuing_in", "chip"]},
+                     traffic_classes=l.get("traffic_classes", []), strict_visible_pattern=l.get("strict_visible_pattern", False))
+                for l in device_links]
+    return configurations
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args ([str]): command line parameters as list of strings
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="volume obfuscation fleet configuration")
+
+    parser.add_argument(
+        "--fleet",
+        type=str,
+        default="fleet.yaml",
+        help="fleet file (links and port roles)")
+
+    parser.add_argument(
+        "--pattern",
+        type=int,
+        nargs="+",
+        default=[533, 1066, 1600],
+        help="default pattern")
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="store_const",
+        const=logging.INFO)
+
+    parser.add_argument(
+        "-vv",
+        "--very-verbose",
+        dest="loglevel",
+        help="set loglevel to DEBUG",
+        action="store_const",
+        const=logging.DEBUG)
+
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+
+    logging.getLogger('labsetup_public.src.get_config').setLevel(level=logging.ERROR)
+    configurations = device_configurations(load_fleet(args.fleet), get_config(LAB_CONFIG_DIRECTORY), args.pattern)
+    for (device, configuration) in sorted(configurations.items()):
+        log.info("%s: %s" % (device, json.dumps(configuration, sort_keys=True)))
+
+
+def run():
+    """Entry point for console_scripts
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
@@ -2,12 +2,26 @@ import os, sys, time
 import argparse
 import math
 import json
-import bisect
 import logging
+from multiprocessing import Pool
 
 sys.path.append("/".join(os.path.abspath(os.getcwd()).split("/")[:-2])) # append root directory to path
 
 from labsetup_public.src.get_config import get_config
+from traffic_trace import load_packet_sizes
+from pattern_optimizer import optimizer_for_generator, format_metrics
+from pad_optimizer import PadOptimizer, required_padding_bytes, format_num_pads, phv_usage, PHV_BUDGET_BITS, recirculation_distribution, format_distribution
+from tcam_compiler import compact_entries, format_report
+from table_entries import TableEntries
+from resource_estimator import ResourceEstimator
+from port_allocator import PortAllocator, SPEED_MODES, port_fec
+from queue_simulator import SHAPING_MARGIN
+from build_cache import normalized
+import resource_estimator
+import table_delta
+import chaff_pool
+import fleet
+from fleet import LAB_CONFIG_DIRECTORY
 
 def setup_logging(loglevel="DEBUG"):
     """Setup basic logging
@@ -21,13 +35,119 @@ def setup_logging(loglevel="DEBUG"):
 
 log = logging.getLogger(__name__)
 
+
+def dscp_runs(dscp):
+    """returns the runs (first, last) of consecutive DSCP values"""
+    runs = []
+    for d in sorted(set(dscp)):
+        if runs and runs[-1][1] == d - 1:
+            runs[-1] = (runs[-1][0], d)
+        else:
+            runs.append((d, d))
+    return runs
+
+
+def visible_pattern_deviation(classes):
+    """
+    returns the largest difference between the share of the packets of a size on the output port
+    and its share in the visible pattern (the pattern of the first traffic class).
+    A state with chaff always sends target_bw / sum(pattern) packets per second (its shaping rate
+    divided by its size); a state without chaff only sends while its class has production traffic.
+    The output is compared with the visible pattern while all classes are busy and while they are
+    idle, and the change of its volume between the two counts as well (the activity of a class
+    without chaff is visible). The classes only look like the visible pattern if all their states
+    have chaff, their sizes are sizes of the visible pattern and their bandwidths fit the pattern.
+
+    Args:
+        classes (list): traffic classes (pattern_sequence, target_bw and chaff_states, the states
+            with chaff), see PatternCodeGenerator.__init_traffic_classes
+    """
+    visible = classes[0]["pattern_sequence"]
+
+    def rates(busy):
+        rates = {}
+        for c in classes:
+            for state in (range(len(c["pattern_sequence"])) if busy else c["chaff_states"]):
+                size = c["pattern_sequence"][state]
+                rates[size] = rates.get(size, 0.) + c["target_bw"] * 1. / sum(c["pattern_sequence"])
+        return rates
+
+    (busy, idle) = (rates(True), rates(False))
+    deviations = [(sum(busy.values()) - sum(idle.values())) / sum(busy.values())]
+    for r in [busy, idle]:
+        total = sum(r.values())
+        if total > 0:
+            deviations += [abs(r.get(size, 0.) / total - visible.count(size) * 1. / len(visible)) for size in set(r) | set(visible)]
+    return max(deviations)
+
+
 class PatternCodeGenerator(object):
     
-    # traffic types
+    # traffic types (production traffic of further traffic classes: 3, 4, ..., their chaff: 15, 14, ...,
+    # see __init_traffic_classes)
     T_TYPE_PROD = 1
     T_TYPE_FAKE = 2
+    MAX_TRAFFIC_TYPE = 15
+    # further traffic classes per link (the production and chaff traffic types must not overlap)
+    MAX_TRAFFIC_CLASSES = (MAX_TRAFFIC_TYPE - T_TYPE_FAKE) // 2
+
+    # sizes of the padding headers
+    DEFAULT_PADS = [32,16,8,4,2,1]
+
+    PADDING_MODES = ["tables", "single_lookup"]
+    # most actions of a padding header table in the single lookup padding mode (see pad_groups)
+    MAX_PAD_GROUP_ACTIONS = 32
+    PARSER_MODES = ["full", "compact"]
+
+    # fields of a device configuration which a protected link can overwrite (see __init_links)
+    LINK_FIELDS = "pattern input output obf_input obf_output fake_traffic recirculation target_bw traffic_classes strict_visible_pattern".split()
+    # links per program (size of custom_metadata.link_id)
+    MAX_LINKS = 16
+    # round-robin queues of an output port (states of all traffic classes of a link)
+    MAX_QUEUES_PER_PORT = 32
+
+    # default constants (extended with pattern specific constants in __init__)
+    DEFAULT_CONSTANTS = {
+        # Number of pads of different sizes. Need to fit in PHV.
+        # (reduce numbers for faster compile time)
+        "NUM_32B_PADS"              : 4,
+        "NUM_16B_PADS"              : 6,
+        "NUM_8B_PADS"               : 2,
+        "NUM_4B_PADS"               : 2,
+        "NUM_2B_PADS"               : 2,
+        "NUM_1B_PADS"               : 2,
+
+        # ethertypes to identify padding headers
+        "ETHERTYPE_IPV4"            : 0x0800,
+        "ETHERTYPE_PADDING_META"    : 0x0888,
+        "ETHERTYPE_EVALUATION_META" : 0x0887,
+        "ETHERTYPE_QUEUEINFO"       : 0x0123,
+        "ETHERTYPE_32B_PADS"        : 0x0801,
+        "ETHERTYPE_16B_PADS"        : 0x0802,
+        "ETHERTYPE_8B_PADS"         : 0x0803,
+        "ETHERTYPE_4B_PADS"         : 0x0804,
+        "ETHERTYPE_2B_PADS"         : 0x0805,
+        "ETHERTYPE_1B_PADS"         : 0x09,
+
+        # 8bit padding headers only have 8bits for the ethertype field
+        "ETHERTYPE_IPV4_8BIT"       : 0x80,
+        "ETHERTYPE_1B_PADS_8BIT"    : 0x09,
+    
+        # instance types for the packet when it passes through the switch multiple times
+        "INSTANCE_FIRSTPASS"        : 0x1,
+        "INSTANCE_SECONDPASS"       : 0x2,
+        "INSTANCE_DONE"             : 0x3,
+
+        # length of the padding_meta header
+        "PADDING_META_LEN"          : 18,
+
+        # network settings
+        "MTU"                       : 1600, # B
+        # "MTU"                       : 1500,
+        "TARGET_BW"                 : 100, # Gbps
+    }
 
-    def __init__(self,target,device_configuration, device):
+    def __init__(self,target,device_configuration, device, lab_config=None):
 
         if target in "device model".split():
             self.target=target
@@ -37,89 +157,222 @@ class PatternCodeGenerator(object):
         
         self.port_configuration = device_configuration
 
-        self.lab_config = get_config("../../labsetup_public/config/")
+        # the lab configuration can be shared by several generators (see fleet.py)
+        self.lab_config = lab_config if lab_config is not None else get_config(LAB_CONFIG_DIRECTORY)
 
         self.code_parts = "CLI TOP HEADERS METADATA PARSER REGISTERS ACTIONS INGRESS EGRESS".split()
         self.code = {part: [] for part in self.code_parts}
+        self.entries = TableEntries()
 
         self.config = {
-            "pads"                  : [32,16,8,4,2,1],
+            "pads"                  : list(self.DEFAULT_PADS),
             "pattern_sequence"      : device_configuration["pattern"],
             "obfuscation_device"    : device,
         }
 
-        self.constants = {
-            # Number of pads of different sizes. Need to fit in PHV.
-            # (reduce numbers for faster compile time)
-            "NUM_32B_PADS"              : 4,
-            "NUM_16B_PADS"              : 6,
-            "NUM_8B_PADS"               : 2,
-            "NUM_4B_PADS"               : 2,
-            "NUM_2B_PADS"               : 2,
-            "NUM_1B_PADS"               : 2,
-    
-            # ethertypes to identify padding headers
-            "ETHERTYPE_IPV4"            : 0x0800,
-            "ETHERTYPE_PADDING_META"    : 0x0888,
-            "ETHERTYPE_EVALUATION_META" : 0x0887,
-            "ETHERTYPE_QUEUEINFO"       : 0x0123,
-            "ETHERTYPE_32B_PADS"        : 0x0801,
-            "ETHERTYPE_16B_PADS"        : 0x0802,
-            "ETHERTYPE_8B_PADS"         : 0x0803,
-            "ETHERTYPE_4B_PADS"         : 0x0804,
-            "ETHERTYPE_2B_PADS"         : 0x0805,
-            "ETHERTYPE_1B_PADS"         : 0x09,
-
-            # 8bit padding headers only have 8bits for the ethertype field
-            "ETHERTYPE_IPV4_8BIT"       : 0x80,
-            "ETHERTYPE_1B_PADS_8BIT"    : 0x09,
-            
-            # instance types for the packet when it passes through the switch multiple times
-            "INSTANCE_FIRSTPASS"        : 0x1,
-            "INSTANCE_SECONDPASS"       : 0x2,
-            "INSTANCE_DONE"             : 0x3,
-    
-            # length of the padding_meta header
-            "PADDING_META_LEN"          : 18,
-    
-            # network settings
-            "MTU"                       : 1600, # B
-            # "MTU"                       : 1500,
-            "TARGET_BW"                 : 100, # Gbps
-        }
+        self.constants = dict(self.DEFAULT_CONSTANTS)
+
+        # optional pad configuration (pad size -> number of pads), e.g. from pad_optimizer.py
+        if "num_pads" in device_configuration:
+            num_pads = device_configuration["num_pads"]
+            self.config["pads"] = [p for p in self.DEFAULT_PADS if num_pads.get(p, 0) > 0]
+            for p in self.DEFAULT_PADS:
+                self.constants["NUM_%iB_PADS"%p] = num_pads.get(p, 0)
+
+        # "tables": one range table per pad size (applied one after the other)
+        # "single_lookup": exact match tables which add all padding headers with one lookup each
+        #                  (independent of each other, see generate_code_padding_single_lookup)
+        self.padding_mode = device_configuration.get("padding_mode", "tables")
+        if self.padding_mode not in self.PADDING_MODES:
+            print "unsupported padding mode"
+            exit(1)
 
-        self.constants["PATTERN_LENGTH"] = len(self.config["pattern_sequence"])
-        self.constants["NUM_QUEUES"] = len(self.config["pattern_sequence"])
-        self.constants["NUM_QUEUES_MINUS_1"] = len(self.config["pattern_sequence"])-1
-        self.constants["MAX_PACKET_SIZE"] = max(self.config["pattern_sequence"])
+        # "full": transitions to all padding headers / "compact": only transitions which occur in obfuscated packets
+        self.parser_mode = device_configuration.get("parser_mode", "full")
+        if self.parser_mode not in self.PARSER_MODES:
+            print "unsupported parser mode"
+            exit(1)
+
+        # protected links of the device (each with its own ports, pattern, queues and shaping)
+        self.links = self.__init_links(device_configuration)
+        self.multi_link = len(self.links) > 1
+        patterns = [link["pattern_sequence"] for link in self.links]
+
+        # optional maximum pattern length of the program: the generated P4 code only depends on it
+        # (and not on the pattern), so a new pattern with at most this many states only needs
+        # new table entries and a new queue setup (init_pd_rpc.py)
+        # (with several links, the length of each link's pattern is always set at runtime)
+        self.runtime_pattern_length = device_configuration.get("max_pattern_length", None) is not None
+        self.max_pattern_length = device_configuration.get("max_pattern_length", None)
+        if self.multi_link and self.max_pattern_length is None:
+            self.max_pattern_length = max([len(p) for p in patterns])
+        if self.max_pattern_length is not None:
+            for pattern in patterns:
+                assert len(pattern) <= self.max_pattern_length, \
+                    "pattern has %i states, the program supports %i" % (len(pattern), self.max_pattern_length)
+            self.config["max_pattern_length"] = self.max_pattern_length
+        if self.runtime_pattern_length:
+            # round-robin queues for the maximum length (the classes keep their queues when the pattern changes)
+            for link in self.links:
+                for (i, c) in enumerate(link["classes"]):
+                    c["qid_offset"] = i * self.max_pattern_length
+                assert len(link["classes"]) * self.max_pattern_length <= self.MAX_QUEUES_PER_PORT, \
+                    "the traffic classes of link %i need %i queues on the output port (max %i)" \
+                    % (link["link_id"], len(link["classes"]) * self.max_pattern_length, self.MAX_QUEUES_PER_PORT)
+
+        self.constants["PATTERN_LENGTH"] = max([len(p) for p in patterns])
+        self.constants["NUM_QUEUES"] = max([len(p) for p in patterns])
+        self.constants["NUM_QUEUES_MINUS_1"] = max([len(p) for p in patterns])-1
+        self.constants["MAX_PACKET_SIZE"] = max([max(c["pattern_sequence"]) for link in self.links for c in link["classes"]])
         self.constants["MAX_PADDING_BYTES"] = sum([p*self.constants["NUM_%iB_PADS"%p] for p in self.config["pads"]])
         self.constants["MAX_PADDING_BYTES_PLUS_1"] = self.constants["MAX_PADDING_BYTES"] + 1
+
+        # recirculations of the packet sizes in each state (see pad_optimizer.py --recirculation-bound)
+        for link in self.links:
+            for c in link["classes"]:
+                distribution = recirculation_distribution(c["pattern_sequence"], self.constants["MAX_PADDING_BYTES"],
+                                                          self.constants["PADDING_META_LEN"], self.constants["MTU"])
+                log.info(self.group_prefix(link, c) + "recirculations: " + format_distribution(distribution))
         
         for instance_type in [self.constants["INSTANCE_FIRSTPASS"], self.constants["INSTANCE_SECONDPASS"], self.constants["INSTANCE_DONE"]]:
             for ethertype in "IPV4 QUEUEINFO 32B_PADS 16B_PADS 8B_PADS 4B_PADS 2B_PADS 1B_PADS".split():
                 self.constants["ETHERTYPE_%s_INSTANCETYPE_%i" % (ethertype, instance_type)] = (self.constants["ETHERTYPE_%s"%ethertype]<<4)+instance_type
 
+        # rate of the obfuscated traffic (Gbps), speeds of the queuing ports (see port_allocator.py)
+        self.constants["TARGET_BW"] = device_configuration.get("target_bw", self.DEFAULT_CONSTANTS["TARGET_BW"])
+        self.chip = device_configuration.get("chip", "tofino")
+        self.port_speeds = device_configuration.get("port_speeds") or SPEED_MODES[self.chip].keys()
+
         self.state_index_to_port = {}
         self.generated_files = []
         
         self.__init_priorityqueuing_ports()
 
+    def __init_links(self, device_configuration):
+        """
+        returns the protected links of the device: a device configuration without "links"
+        protects one link with its own fields, otherwise each entry of "links" overwrites
+        LINK_FIELDS of the device configuration (e.g., its own input, output, recirculation
+        ports and pattern). All links share the priority queuing ports of the device.
+
+        Returns:
+            list of dicts: link_id, port_configuration, pattern_sequence and target_bw
+        """
+        links = []
+        for (link_id, link) in enumerate(device_configuration.get("links") or [{}]):
+            port_configuration = dict(device_configuration)
+            port_configuration.update({k: v for (k, v) in link.items() if k in self.LINK_FIELDS})
+            links.append({
+                "link_id"           : link_id,
+                "port_configuration": port_configuration,
+                "pattern_sequence"  : list(port_configuration["pattern"]),
+                "target_bw"         : port_configuration.get("target_bw", self.DEFAULT_CONSTANTS["TARGET_BW"]),
+            })
+            links[-1]["classes"] = self.__init_traffic_classes(links[-1])
+        assert len(links) <= self.MAX_LINKS, "%i links, the program supports %i" % (len(links), self.MAX_LINKS)
+
+        # the link of a packet is identified by its ingress port
+        ingress_ports = {}
+        for link in links:
+            for port in self.get_ports("input fake_traffic obf_input".split(), link):
+                assert ingress_ports.get(port, link["link_id"]) == link["link_id"], \
+                    "port %s belongs to links %i and %i" % (port, ingress_ports[port], link["link_id"])
+                ingress_ports[port] = link["link_id"]
+        return links
+
+    def __init_traffic_classes(self, link):
+        """
+        returns the traffic classes of a link: the production traffic of each class gets its own
+        pattern, states (queues) and shaping rate. The first class is the link's pattern (traffic
+        type T_TYPE_PROD, chaff T_TYPE_FAKE) with the bandwidth which the further classes leave.
+        Further classes ("traffic_classes" of the link: name, pattern, share of the link's
+        bandwidth and the DSCP values or production input ports of the class) get the traffic
+        types 3, 4, ... and the chaff traffic types 15, 14, ... (the same on all links, so that the
+        deobfuscation drops the chaff of every class).
+
+        Every class has its own chaff, so that its states send their pattern while the class is
+        idle: the fake traffic ports of the link are assigned to the classes in turn (each class
+        needs at least one), the chaff of a class is cloned in the loops of its fake traffic ports.
+
+        Returns:
+            list of dicts: name, traffic_type, chaff_traffic_type, pattern_sequence, target_bw,
+                dscp, ports, fake_traffic (physical fake traffic ports), chaff_states (states with
+                chaff) and qid_offset (first round-robin queue of the class on the output port)
+        """
+        configuration = link["port_configuration"].get("traffic_classes") or []
+        assert len(configuration) <= self.MAX_TRAFFIC_CLASSES, \
+            "%i traffic classes, the program supports %i" % (len(configuration) + 1, self.MAX_TRAFFIC_CLASSES + 1)
+        fake_traffic = self.get_ports("fake_traffic".split(), link)
+        assert len(fake_traffic) > len(configuration), \
+            "link %i has %i traffic classes but %i fake traffic ports (each class needs its own chaff)" % (link["link_id"], len(configuration) + 1, len(fake_traffic))
+        shares = [c["share"] for c in configuration]
+        assert sum(shares) < 1, "the traffic classes take %.0f%% of the bandwidth of link %i" % (100. * sum(shares), link["link_id"])
+
+        classes = [{
+            "name"              : "default",
+            "traffic_type"      : self.T_TYPE_PROD,
+            "chaff_traffic_type": self.T_TYPE_FAKE,
+            "pattern_sequence"  : link["pattern_sequence"],
+            "target_bw"         : link["target_bw"] * (1 - sum(shares)),
+            "dscp"              : [],
+            "ports"             : [],
+        }]
+        for (i, c) in enumerate(configuration):
+            classes.append({
+                "name"              : c.get("name", "class%i" % (i+1)),
+                "traffic_type"      : self.T_TYPE_FAKE + 1 + i,
+                "chaff_traffic_type": self.MAX_TRAFFIC_TYPE - i,
+                "pattern_sequence"  : list(c["pattern"]),
+                "target_bw"         : link["target_bw"] * c["share"],
+                "dscp"              : list(c.get("dscp", [])),
+                "ports"             : list(c.get("ports", [])),
+            })
+            production_ports = self.production_input_ports(link)
+            for port in classes[-1]["ports"]:
+                assert port in production_ports, "port %s of traffic class %s is not a production input port %s" % (port, classes[-1]["name"], production_ports)
+
+        qid_offset = 0
+        for (i, c) in enumerate(classes):
+            c["fake_traffic"] = fake_traffic[i::len(classes)]
+            # (states which only carry frames above the MTU of the injecting interface get no chaff)
+            c["chaff_states"] = [state for state in range(len(c["pattern_sequence"]))
+                                 if chaff_pool.chaff_size(c["pattern_sequence"], state, self.constants["PADDING_META_LEN"]) is not None]
+            c["qid_offset"] = qid_offset
+            qid_offset += len(c["pattern_sequence"])
+        assert qid_offset <= self.MAX_QUEUES_PER_PORT, \
+            "the traffic classes of link %i need %i queues on the output port (max %i)" % (link["link_id"], qid_offset, self.MAX_QUEUES_PER_PORT)
+
+        if len(classes) > 1:
+            deviation = visible_pattern_deviation(classes)
+            log.info("link %i: traffic classes %s, packets per size differ by up to %.1f%% from the visible pattern" % (
+                link["link_id"], ", ".join(["%s (%.1f Gbps)" % (c["name"], c["target_bw"]) for c in classes]), 100. * deviation))
+            if link["port_configuration"].get("strict_visible_pattern", False):
+                assert deviation < 1e-3, \
+                    "the traffic classes of link %i do not match the visible pattern %s (see visible_pattern_deviation)" % (link["link_id"], link["pattern_sequence"])
+        return classes
+
+    def production_input_ports(self, link):
+        """returns the input ports of production traffic (all input ports but the recirculation port input[1])"""
+        return [p for (i, p) in enumerate(self.get_ports("input".split(), link)) if i != 1]
+
     def make_list(self,items):
         if not isinstance(items,list):
             items = [items]
         return items
 
-    def get_ports(self,categories):
+    def get_ports(self,categories,link=None):
         """returns the union of all ports in given categories
 
         Args:
             categories (string or list of strings): categories to merge
+            link (dict): optional link (default: the ports of the device configuration)
         """
         categories = self.make_list(categories)
+        port_configuration = link["port_configuration"] if link is not None else self.port_configuration
         
         ports = []
         for c in categories:
-            ports += self.make_list(self.port_configuration[c])
+            ports += self.make_list(port_configuration[c])
         return ports
 
     def phys_port_to_str(self,phys_port):
@@ -139,11 +392,14 @@ class PatternCodeGenerator(object):
 
     def phys_port_to_speed(self,phys_port):
         """
-        returns 100G if the port is used as x/- and 10G otherwise
+        returns TARGET_BW for the output port, 100G for other ports used as x/- and 10G otherwise
         """
         port_str = str(phys_port)
 
         if len(port_str.split("/")) == 1:
+            for link in self.links:
+                if phys_port == link["port_configuration"].get("output"):
+                    return "%iG" % link["target_bw"]
             return "100G"
         elif len(port_str.split("/")) == 2:
             return "10G"
@@ -160,71 +416,101 @@ class PatternCodeGenerator(object):
             int or list: internal port number(s)
         """
         if self.target == "device":
+            internal = self.lab_config["index"]["phys_to_internal"][self.config["obfuscation_device"]]
             if isinstance(phys_ports,list):
-                # return [self.lab_config["devices"][self.config["obfuscation_device"]]["ports"]["%i/-"%(phys_port)]["internal"] for phys_port in phys_ports]
-                return [self.lab_config["devices"][self.config["obfuscation_device"]]["ports"][self.phys_port_to_str(phys_port)]["internal"] for phys_port in phys_ports]
+                return [internal[self.phys_port_to_str(phys_port)] for phys_port in phys_ports]
             else:
-                # return self.lab_config["devices"][self.config["obfuscation_device"]]["ports"]["%i/-"%(phys_ports)]["internal"]
-                return self.lab_config["devices"][self.config["obfuscation_device"]]["ports"][self.phys_port_to_str(phys_ports)]["internal"]
+                return internal[self.phys_port_to_str(phys_ports)]
         else:
             return phys_ports
 
+    def get_queue_in_ports(self, link=None):
+        """returns the internal ports (all channels of the enabled ports) on which packets come back from the priority queues
+        (with several links: the channels of the link's states)"""
+        if self.multi_link and link is not None:
+            return link["queue_in_ports"]
+        if self.target != "device":
+            return self.get_internal_ports(self.get_ports("priorityqueuing_in".split()))
+        return [self.get_internal_ports("%i/%i" % (p, c)) for p in self.port_configuration["priorityqueuing_in"]
+                if p in self.queue_port_speeds for c in SPEED_MODES[self.chip][self.queue_port_speeds[p]]]
+
     def __init_priorityqueuing_ports(self):
         """
         initializes the ports that are used for priority queuing
+        (speeds of the loopback ports and the port of each state of each traffic class of each link, see port_allocator.py)
         """
-        log.warn("using 100Gb links for all ports")
-        # available_bws = [10, 25, 40, 50, 100]
-        available_bws = [10, 100]
-        
-        self.constants["BW_PER_QUEUE"] = available_bws[bisect.bisect_right(available_bws, self.constants["TARGET_BW"] * 1./self.constants["PATTERN_LENGTH"] - 1)]
-        
-        available_queues_per_port = {
-            "device": {
-                10: 4,
-                25: 4,
-                40: 2,
-                50: 2,
-                100: 1
-            },
-            "model": {
-                10: 1,
-                25: 1,
-                40: 1,
-                50: 1,
-                100: 1
-            }
-        }[self.target]
-        
-        num_needed_ports = self.constants["PATTERN_LENGTH"] * 1./ available_queues_per_port[self.constants["BW_PER_QUEUE"]]
-        
-        assert num_needed_ports <= len( self.port_configuration["priorityqueuing_out"]), \
-            "not enough queueing ports available: have %i, need %i" \
-                % (len( self.port_configuration["priorityqueuing_out"]), num_needed_ports)
-
-        available_pipes_for_num_pipes = {
-            4: [0, 1, 2, 3],
-            2: [0, 2],
-            1: [0],
-        }
-        
-        available_port_ids = []
-        
+        # the ports need to be fast enough for the shaped rate of each state (programs with a
+        # maximum pattern length: for any state of any pattern up to the maximum length)
+        groups = [(link, c) for link in self.links for c in link["classes"]]
+        for (link, c) in groups:
+            c["shares"] = [s * 1. / sum(c["pattern_sequence"]) for s in c["pattern_sequence"]]
+            c["demands"] = [c["target_bw"] * share * (1 - SHAPING_MARGIN) for share in c["shares"]]
+            c["queue_shares"] = c["shares"]
+            if self.runtime_pattern_length:
+                c["demands"] = [c["target_bw"] * (1 - SHAPING_MARGIN)] * self.max_pattern_length
+                # a queuing port for every state up to the maximum length (allocated with equal
+                # shares, so the states keep their ports and queues when the pattern changes)
+                c["queue_shares"] = [1. / self.max_pattern_length] * self.max_pattern_length
+
         if self.target == "device":
-            for phys_port in  self.port_configuration["priorityqueuing_out"]:
-                available_port_ids += [
-                    self.lab_config["devices"][self.config["obfuscation_device"]]["ports"]["%i/%i"%(phys_port,i)]["internal"] \
-                        for i in available_pipes_for_num_pipes[available_queues_per_port[self.constants["BW_PER_QUEUE"]]]
-                ]
+            device = self.config["obfuscation_device"]
+            allocator = PortAllocator(self.lab_config, device)
+            (self.queue_port_speeds, channel_speeds) = allocator.plan_loopback_ports(
+                self.port_configuration["priorityqueuing_out"], sum([c["demands"] for (link, c) in groups], []), self.port_speeds, self.chip)
+            log.info("queuing ports: %s" % ", ".join(["%i/- %iG" % (p, s) for (p, s) in sorted(self.queue_port_speeds.items())]))
+
+            # pipe-aware choice of the queuing port (channel) of each state
+            # (the links and classes take their channels one after the other, each leaves enough channels for the next ones)
+            internal = self.lab_config["index"]["phys_to_internal"][device]
+            candidates = sorted(channel_speeds, key=lambda p: (self.port_configuration["priorityqueuing_out"].index(int(p.split("/")[0])), p))
+            for link in self.links:
+                for warning in allocator.check_fixed_ports(link["port_configuration"]):
+                    log.warning(warning)
+            for (i, (link, c)) in enumerate(groups):
+                shares = c["queue_shares"]
+                reserved = sum([g["demands"] for (l, g) in groups[i+1:]], [])
+                (assignment, explanation) = allocator.allocate(candidates, shares, link["port_configuration"]["input"][0], link["port_configuration"]["output"],
+                                                               channel_speeds, c["demands"][:len(shares)], reserved)
+                for line in explanation:
+                    log.info(self.group_prefix(link, c) + line)
+                candidates = [p for p in candidates if p not in assignment.values()]
+                c["queue_ports"] = [internal[port] for (state, port) in sorted(assignment.items())]
+                c["state_index_to_speed"] = {state: channel_speeds[port] for (state, port) in assignment.items() if state < len(c["pattern_sequence"])}
+                c["queue_in_ports"] = [internal[allocator.loopback_peer(port)] for (state, port) in sorted(assignment.items())]
         elif self.target == "model":
             available_port_ids = list( self.port_configuration["priorityqueuing_out"])
-                
-        self.state_index_to_port = {i: available_port_ids[i] for i in range(self.constants["PATTERN_LENGTH"])}
+            for (link, c) in groups:
+                c["queue_ports"] = [available_port_ids.pop(0) for i in range(len(c["queue_shares"]))]
+                c["state_index_to_speed"] = {i: c["target_bw"] for i in range(len(c["pattern_sequence"]))}
+                c["queue_in_ports"] = list(c["queue_ports"])
+            self.queue_port_speeds = {}
+
+        # ports of the states of the pattern (programs with a maximum pattern length: the
+        # remaining queue_ports are configured by init_pd_rpc.py for longer patterns)
+        for (link, c) in groups:
+            c["state_index_to_port"] = {i: c["queue_ports"][i] for i in range(len(c["pattern_sequence"]))}
+
+        # the first class of a link has the link's pattern, the first link is the link of the device configuration (see device_specific_info)
+        for link in self.links:
+            link["state_index_to_port"] = link["classes"][0]["state_index_to_port"]
+            link["state_index_to_speed"] = link["classes"][0]["state_index_to_speed"]
+            link["queue_in_ports"] = sum([c["queue_in_ports"] for c in link["classes"]], [])
+        self.state_index_to_port = self.links[0]["state_index_to_port"]
+        self.state_index_to_speed = self.links[0]["state_index_to_speed"]
+        self.constants["BW_PER_QUEUE"] = min([min(c["state_index_to_speed"].values()) for (link, c) in groups])
         
-        log.info("state to port index: %s" % str(self.state_index_to_port)) 
+        for (link, c) in groups:
+            log.info(self.group_prefix(link, c) + "state to port index: %s" % str(c["state_index_to_port"]))
         
         # self.constants["RECIRCULATION_PORT"] = self.get_internal_ports(self.port_configuration["recirculation"])
 
+    def group_prefix(self, link, traffic_class):
+        """returns the log prefix of the states of a traffic class of a link (empty for a single link and class)"""
+        prefix = "link %i: " % link["link_id"] if self.multi_link else ""
+        if len(link["classes"]) > 1:
+            prefix += "class %s: " % traffic_class["name"]
+        return prefix
+
     def add_to_part(self,part,code):
         """
         adds code to the specified part of the program
@@ -237,50 +523,132 @@ class PatternCodeGenerator(object):
         """
         for p in self.code_parts:
             print p
-            print "\n".join(self.code[p])
+            print "\n".join(self.cli_lines() if p == "CLI" else self.code[p])
+
+    def cli_lines(self):
+        """
+        returns the ucli and bfshell input (the table entries as bfshell commands)
+        """
+        return "\n".join(self.code["CLI"]).split("\n") + ["pd-traffic-pattern-tofino"] + self.entries.to_bfshell() + ["end"]
     
     def write_code_to_file(self,filepath):
         """
         writes the generated code to a file
+        (the file is not touched if only its "// generated" line would change, see build_cache.py)
         """
+        text = self.code_text()
+        if os.path.exists(filepath):
+            with open(filepath) as f:
+                if normalized(f.read(), []) == normalized(self.code_header() + text, []):
+                    log.info("%s unchanged" % filepath)
+                    return
         f = open(filepath, "w")
-        f.write("// AUTOMATICALLY GENERATED FILE -- DO NOT EDIT MANUALLY\n")
-        f.write("// generated: %s\n\n\n" % time.strftime("%Y-%m-%d %H:%M:%S"))
-
-        for p in self.code_parts:
-            f.write("\n\n#ifdef IN_SECTION_%s" % (p))
-            f.write("\n// ************************** %s *********************\n\n" % (p))
-            f.write("\n".join(self.code[p]))
-            f.write("\n#endif")
+        f.write(self.code_header())
+        f.write(text)
         f.close()
         self.generated_files.append(filepath)
+
+    def code_header(self):
+        return "// AUTOMATICALLY GENERATED FILE -- DO NOT EDIT MANUALLY\n" + \
+            "// generated: %s\n\n\n" % time.strftime("%Y-%m-%d %H:%M:%S")
+
+    def code_text(self):
+        """
+        returns the sections of the generated code (as written by write_code_to_file)
+        """
+        text = ""
+        for p in self.code_parts:
+            text += "\n\n#ifdef IN_SECTION_%s" % (p)
+            text += "\n// ************************** %s *********************\n\n" % (p)
+            text += "\n".join(self.cli_lines() if p == "CLI" else self.code[p])
+            text += "\n#endif"
+        return text
     
     def write_cli_to_file(self,filepath):
         """
         writes only the CLI input to a file
         """
         f = open(filepath, "w")
-        p = "CLI"
-        f.write("\n".join(self.code[p]))
+        f.write("\n".join(self.cli_lines()))
         f.close()
         self.generated_files.append(filepath)
+
+    def write_entries_to_file(self,filepath,format):
+        """
+        writes only the table entries to a file (format: bfshell, json or binary, see table_entries.py)
+        """
+        self.entries.write(filepath, format)
+        self.generated_files.append(filepath)
     
     def write_device_specific_info_to_file(self,filepath):
-        info_dict = {
+        with open(filepath, 'w') as outfile:
+            json.dump(self.device_specific_info(), outfile)
+            self.generated_files.append(filepath)
+
+    def fake_port_speeds(self):
+        """returns the speed (Gbps) of each fake traffic port (internal port)"""
+        return {self.get_internal_ports(p): int(self.phys_port_to_speed(p)[:-1])
+                for link in self.links for p in self.get_ports("fake_traffic".split(), link)}
+
+    def write_chaff_plan_to_file(self, filepath, loop_rtt, headroom=chaff_pool.DEFAULT_HEADROOM):
+        """writes the injection plan of the chaff pool (see chaff_pool.py) and returns its problems"""
+        plan = chaff_pool.chaff_plan(self.device_specific_info(), loop_rtt, self.fake_port_speeds(), headroom)
+        for line in chaff_pool.format_plan(plan):
+            log.info(line)
+        with open(filepath, 'w') as outfile:
+            json.dump(plan, outfile)
+            self.generated_files.append(filepath)
+        return chaff_pool.check_plan(plan)
+
+    def device_specific_info(self):
+        """
+        returns the queue configuration for init_pd_rpc.py (the top level fields describe the
+        first link, "links" all links of a device with several links)
+        """
+        info = {
             "config": self.config,
             "constants": self.constants,
             "state_index_to_port": self.state_index_to_port,
-            "ports_cloning": self.get_internal_ports(self.get_ports("fake_traffic".split())),
-            "ports_priorityqueues": self.state_index_to_port.values(),
-            "ports_rrqueues": self.get_internal_ports(self.get_ports("output".split())),
+            "state_index_to_speed": self.state_index_to_speed,
+            "ports_cloning": self.get_internal_ports(sum([self.get_ports("fake_traffic".split(), link) for link in self.links], [])),
+            "ports_priorityqueues": sum([c["queue_ports"] for link in self.links for c in link["classes"]], []),
+            "queue_ports": self.links[0]["classes"][0]["queue_ports"],
+            "ports_rrqueues": self.get_internal_ports(sum([self.get_ports("output".split(), link) for link in self.links], [])),
             
             # "port_configuration": self.port_configuration,
             # "lab_config": self.lab_config,
         }
-        
-        with open(filepath, 'w') as outfile:
-            json.dump(info_dict, outfile)
-            self.generated_files.append(filepath)
+        for link in self.links:
+            if len(link["classes"]) > 1:
+                link["traffic_classes"] = [{
+                    "name": c["name"],
+                    "traffic_type": c["traffic_type"],
+                    "pattern_sequence": c["pattern_sequence"],
+                    "target_bw": c["target_bw"],
+                    "qid_offset": c["qid_offset"],
+                    "chaff_traffic_type": c["chaff_traffic_type"],
+                    "ports_cloning": self.get_internal_ports(c["fake_traffic"]),
+                    "state_index_to_port": c["state_index_to_port"],
+                    "state_index_to_speed": c["state_index_to_speed"],
+                    "queue_ports": c["queue_ports"],
+                } for c in link["classes"]]
+        if len(self.links[0]["classes"]) > 1:
+            info["traffic_classes"] = self.links[0]["traffic_classes"]
+        if self.multi_link:
+            info["links"] = [{
+                "link_id": link["link_id"],
+                "pattern_sequence": link["pattern_sequence"],
+                "target_bw": link["target_bw"],
+                "state_index_to_port": link["state_index_to_port"],
+                "state_index_to_speed": link["state_index_to_speed"],
+                "queue_ports": link["classes"][0]["queue_ports"],
+                "ports_cloning": self.get_internal_ports(self.get_ports("fake_traffic".split(), link)),
+                "ports_rrqueues": self.get_internal_ports(self.get_ports("output".split(), link)),
+            } for link in self.links]
+            for (link, link_info) in zip(self.links, info["links"]):
+                if "traffic_classes" in link:
+                    link_info["traffic_classes"] = link["traffic_classes"]
+        return info
     
     def write_general_info_to_file(self,filepath):
         info_dict = {
@@ -292,18 +660,61 @@ class PatternCodeGenerator(object):
             json.dump(info_dict, outfile)
             self.generated_files.append(filepath)
 
+    def program_constants(self):
+        """
+        returns the constants of the P4 program
+        (with a maximum pattern length, the pattern specific constants are replaced by their
+        largest values)
+        """
+        constants = dict(self.constants)
+        if self.multi_link:
+            constants["MULTI_LINK"] = 1
+            constants["NUM_LINKS"] = len(self.links)
+        if any([len(link["classes"]) > 1 for link in self.links]):
+            constants["TRAFFIC_CLASSES"] = 1
+        if self.max_pattern_length is not None:
+            constants["RUNTIME_PATTERN_LENGTH"] = 1
+            constants["PATTERN_LENGTH"] = self.max_pattern_length
+            constants["NUM_QUEUES"] = self.max_pattern_length
+            constants["NUM_QUEUES_MINUS_1"] = self.max_pattern_length-1
+            constants["MAX_PACKET_SIZE"] = self.constants["MTU"]
+        return constants
+
     def generate_code_constants(self):
         part = "TOP"
         code = "// constants"
 
-        for (k,v) in self.constants.items():
+        for (k,v) in sorted(self.program_constants().items()):
             code += "\n#define %s %s" % (k,str(v))
 
         self.add_to_part(part,code)
 
+    def pad_chain_transitions(self):
+        """
+        returns the transitions between padding headers which occur in obfuscated packets
+        ((None, first header) for the transitions from padding_meta)
+
+        Returns:
+            set of ((int, int), (int, int)): transitions between (pad size, header index)
+        """
+        transitions = set()
+        for b in range(1, self.constants["MAX_PADDING_BYTES"]+1):
+            headers = [(p,j) for (p,n) in self.pad_combination(b) for j in range(n)]
+            transitions.add((None, headers[0]))
+            transitions |= set(zip(headers[:-1], headers[1:]))
+        return transitions
+
     def generate_code_parsers(self):
+        """
+        in the compact parser mode, the parser only contains the transitions into padding headers
+        which the padding tables create: padding headers only follow padding_meta or another
+        padding header (in the order of pad_combination) and the last one has next_etherType 0
+        """
         part = "PARSER"
 
+        compact = self.parser_mode == "compact"
+        transitions = self.pad_chain_transitions()
+
         code = "// header declarations"
         code += "\nheader ethernet_t  ethernet; \n\
 header ipv4_t      ipv4;\n\
@@ -329,7 +740,7 @@ header evaluation_meta_t evaluation_meta;"
          ETHERTYPE_EVALUATION_META: parse_evaluation_meta;"
 
         for p in self.config["pads"]:
-            if self.constants["NUM_%iB_PADS"%p] > 0:
+            if self.constants["NUM_%iB_PADS"%p] > 0 and not compact:
                 code += "\n         ETHERTYPE_%iB_PADS : parse_padding%i_0;" % (p,p,)
         
         code += "\n         default: ingress;\n \
@@ -345,7 +756,7 @@ header evaluation_meta_t evaluation_meta;"
          ETHERTYPE_PADDING_META: parse_padding_meta;"
 
         for p in self.config["pads"]:
-            if self.constants["NUM_%iB_PADS"%p] > 0:
+            if self.constants["NUM_%iB_PADS"%p] > 0 and not compact:
                 code += "\n         ETHERTYPE_%iB_PADS : parse_padding%i_0;" % (p,p,)
         
         code += "\n         default: ingress;\n \
@@ -363,7 +774,7 @@ header evaluation_meta_t evaluation_meta;"
             code += "\n         ETHERTYPE_QUEUEINFO_INSTANCETYPE_%i: parse_queue_info;" % instance_type
 
             for p in self.config["pads"]:
-                if self.constants["NUM_%iB_PADS"%p] > 0:
+                if self.constants["NUM_%iB_PADS"%p] > 0 and (not compact or (None,(p,0)) in transitions):
                     code += "\n         ETHERTYPE_%iB_PADS_INSTANCETYPE_%i : parse_padding%i_0;" % (p,instance_type,p,)
             
         code += "\n         default: ingress;\n \
@@ -384,15 +795,18 @@ header evaluation_meta_t evaluation_meta;"
                 code = "\n"
                 code += "parser parse_padding%i_%i { \n\
     extract(padding%i_%i); \n\
-    return select(padding%i_%i.next_etherType) { \n\
-        ETHERTYPE_IPV4%s     : parse_ipv4;" % (p,i,p,i,p,i,smallEtherType,)
+    return select(padding%i_%i.next_etherType) {" % (p,i,p,i,p,i,)
 
-                if num_pads > i+1:
+                if not compact:
+                    code += " \n\
+        ETHERTYPE_IPV4%s     : parse_ipv4;" % (smallEtherType,)
+
+                if num_pads > i+1 and (not compact or ((p,i),(p,i+1)) in transitions):
                     code += "\n        ETHERTYPE_%iB_PADS%s : parse_padding%i_%i;" % (p,smallEtherType,p,i+1,)
                 
 
                 for pp in filter(lambda pp: pp<p, self.config["pads"]):
-                    if self.constants["NUM_%iB_PADS"%pp] > 0:
+                    if self.constants["NUM_%iB_PADS"%pp] > 0 and (not compact or ((p,i),(pp,0)) in transitions):
                         code += "\n         ETHERTYPE_%iB_PADS%s : parse_padding%i_0;" % (pp,smallEtherType,pp,)
 
                 code += "\n         default: ingress;\n \
@@ -411,7 +825,138 @@ header evaluation_meta_t evaluation_meta;"
 }"
         self.add_to_part(part,code)
     
+    def pad_combination(self, bytes_to_add):
+        """
+        returns the padding headers which the add_padding tables add for bytes_to_add
+        (largest pads first, as many as possible)
+
+        Returns:
+            list of (int, int): pad size and number of pads
+        """
+        combination = []
+        for p in self.config["pads"]:
+            num_pads = min(self.constants["NUM_%iB_PADS"%p], bytes_to_add // p)
+            if num_pads > 0:
+                combination.append((p, num_pads))
+                bytes_to_add -= num_pads*p
+        return combination
+
+    def pad_group_combinations(self, group):
+        """
+        returns the combinations of the pads of a group which the single lookup padding mode adds
+        (the pads of the group in pad_combination of each number of bytes, without the empty one)
+
+        Args:
+            group (list of int): pad sizes
+        """
+        combinations = set()
+        for b in range(1, self.constants["MAX_PADDING_BYTES"]+1):
+            combination = tuple([(p,n) for (p,n) in self.pad_combination(b) if p in group])
+            if combination:
+                combinations.add(combination)
+        return sorted(combinations, key=lambda c: [-p*n for (p,n) in c])
+
+    def pad_groups(self):
+        """
+        splits the pad sizes (largest first) into the groups of the single lookup padding mode:
+        each group takes the next pad size as long as it has at most MAX_PAD_GROUP_ACTIONS
+        combinations (one action each)
+
+        Returns:
+            list of lists of int: pad sizes of each group
+        """
+        groups = []
+        for p in self.config["pads"]:
+            if groups and len(self.pad_group_combinations(groups[-1] + [p])) <= self.MAX_PAD_GROUP_ACTIONS:
+                groups[-1].append(p)
+            else:
+                groups.append([p])
+        return groups
+
+    def pad_group_action(self, combination):
+        return "add_pads_" + "_".join(["%ix%i" % (n,p) for (p,n) in combination])
+
+    def single_lookup_entries(self):
+        """returns the number of values of bytes_to_add with an entry in the single lookup padding tables"""
+        num_entries = max([required_padding_bytes(c["pattern_sequence"], self.constants["PADDING_META_LEN"]) for link in self.links for c in link["classes"]] + [self.constants["MAX_PADDING_BYTES"]])
+        if self.max_pattern_length is not None:
+            # any pattern: bytes_to_add is at most MTU
+            num_entries = max(self.constants["MTU"], self.constants["MAX_PADDING_BYTES"])
+        return num_entries
+
+    def generate_code_padding_single_lookup(self):
+        """
+        one exact match table on bytes_to_add for each group of pad sizes (see pad_groups), with
+        one action per combination of the group's padding headers (the next_etherType of the
+        last header is action data), and add_padding which counts the added bytes.
+        The pad_headers_i tables match the bytes_to_add of the packet and do not depend on each
+        other, but add_pads subtracts the added bytes from bytes_to_add, so add_padding must be
+        applied after all pad_headers_i tables (see generate_code_apply_padding_tables).
+        """
+        part = "ACTIONS"
+        code = ""
+
+        groups = self.pad_groups()
+        for group in groups:
+            for combination in self.pad_group_combinations(group):
+                headers = [(p,j) for (p,n) in combination for j in range(n)]
+
+                code += "\n// pad with %s" % ", ".join(["%i blocks of %iB" % (n,p) for (p,n) in combination])
+                code += "\naction %s(next_etherType) {" % self.pad_group_action(combination)
+                for (k, (p,j)) in enumerate(headers):
+                    code += "\n    add_header(padding%i_%i);" % (p,j)
+                    next_etherType = "ETHERTYPE_%iB_PADS" % headers[k+1][0] if k+1 < len(headers) else "next_etherType"
+                    code += "\n    modify_field(padding%i_%i.next_etherType,%s);" % (p,j,next_etherType)
+                    if p>=4:
+                        code += "\n    modify_field(padding%i_%i.padding,%s);" % (p,j, hex(2**(p-2)-1))
+                code += "\n}\n"
+
+        code += "\n// count the bytes of the padding headers"
+        code += "\naction add_pads(num_bytes) {"
+        code += "\n    subtract_from_field(custom_metadata.bytes_to_add,num_bytes);"
+        code += "\n    add_to_field(padding_meta.totalLen,num_bytes);"
+        code += "\n}\n"
+        self.add_to_part(part,code)
+
+        table_size = int(2**math.ceil(math.log(self.single_lookup_entries(),2)))
+
+        for (i, group) in enumerate(groups):
+            code = "\n// padding with %s headers in one lookup" % "/".join(["%iB" % p for p in group])
+            code += "\ntable pad_headers_%i {" % i
+            code += "\n    reads {\n\
+        custom_metadata.bytes_to_add: exact;\n\
+    } \n\
+    actions {\n\
+        _NoAction;"
+
+            for combination in self.pad_group_combinations(group):
+                code += "\n        %s;" % self.pad_group_action(combination)
+
+            code += "\n    }\n\
+    default_action: _NoAction;\n\
+    size: %i;\n\
+}" % (table_size,)
+            self.add_to_part(part,code)
+
+        code = "\n// bytes of all padding headers"
+        code += "\ntable add_padding {"
+        code += "\n    reads {\n\
+        custom_metadata.bytes_to_add: exact;\n\
+    } \n\
+    actions {\n\
+        _NoAction;\n\
+        add_pads;\n\
+    }\n\
+    default_action: _NoAction;\n\
+    size: %i;\n\
+}" % (table_size,)
+        self.add_to_part(part,code)
+
     def generate_code_padding_actions_and_tables(self):
+        if self.padding_mode == "single_lookup":
+            self.generate_code_padding_single_lookup()
+            return
+
         part = "ACTIONS"
         code = ""
 
@@ -482,37 +1027,70 @@ header evaluation_meta_t evaluation_meta;"
         part = "EGRESS"
         code = ""
 
+        if self.padding_mode == "single_lookup":
+            for i in range(len(self.pad_groups())):
+                self.add_to_part(part,"apply(pad_headers_%i);" % (i,))
+            self.add_to_part(part,"apply(add_padding);")
+            return
+
         for p in self.config["pads"]:
             code = "apply(add_padding_%i);" % (p,)
             self.add_to_part(part,code)
     
     def generate_cli_forwarding(self):
-        part = "CLI"
-        code = ""
-        
-        output_port = self.get_internal_ports(self.port_configuration["output"])
-        
-        for port in self.get_internal_ports(self.get_ports("priorityqueuing_in".split())):
-            code += "pd fwd_port add_entry forward_and_obfuscate ig_intr_md_ingress_port %s action_egress_port %s \n" % (hex(port),hex(output_port))
-        
-        output_port = self.get_internal_ports(self.port_configuration["obf_output"])
-        for port in self.get_internal_ports(self.get_ports("obf_input".split())):
-            code += "pd fwd_port add_entry forward_and_deobfuscate ig_intr_md_ingress_port %s action_egress_port %s \n" % (hex(port),hex(output_port))
-        
-        code += "\n"
-        self.add_to_part(part,code)
+        for link in self.links:
+            output_port = self.get_internal_ports(link["port_configuration"]["output"])
+            
+            for port in self.get_queue_in_ports(link):
+                self.entries.add("fwd_port", "forward_and_obfuscate", [("ig_intr_md_ingress_port", port)], [("egress_port", output_port)])
+            
+            output_port = self.get_internal_ports(link["port_configuration"]["obf_output"])
+            for port in self.get_internal_ports(self.get_ports("obf_input".split(), link)):
+                self.entries.add("fwd_port", "forward_and_deobfuscate", [("ig_intr_md_ingress_port", port)], [("egress_port", output_port)])
     
     def generate_cli_cloning(self):
-        part = "CLI"
-        code = ""
-        
-        output_port = self.port_configuration["output"]
-        
-        for port in self.get_internal_ports(self.get_ports("fake_traffic".split())):
-            code += "pd clone_port add_entry clone_to_port ig_intr_md_ingress_port %s action_session_id %s \n" % (hex(port),hex(port))
-                
-        code += "\n"
-        self.add_to_part(part,code)
+        for link in self.links:
+            for port in self.get_internal_ports(self.get_ports("fake_traffic".split(), link)):
+                self.entries.add("clone_port", "clone_to_port", [("ig_intr_md_ingress_port", port)], [("session_id", port)])
+
+    def generate_cli_link(self):
+        """
+        sets the link of the packets on all ingress ports of a link (only with several links).
+        Obfuscated packets recirculate through the recirculation port (back in on input[1]),
+        deobfuscated packets the other way round.
+        """
+        if not self.multi_link:
+            return
+        for link in self.links:
+            recirculation_port = self.get_internal_ports(link["port_configuration"]["recirculation"])
+            recirculation_port_deobfuscation = self.get_internal_ports(link["port_configuration"]["input"][1])
+            ports = self.get_internal_ports(self.get_ports("input fake_traffic obf_input".split(), link)) + self.get_queue_in_ports(link)
+            for port in sorted(set(ports), key=ports.index):
+                self.entries.add("link_of_port", "set_link", [("ig_intr_md_ingress_port", port)],
+                        [("link_id", link["link_id"]), ("recirculation_port", recirculation_port),
+                        ("recirculation_port_deobfuscation", recirculation_port_deobfuscation)])
+
+    def generate_cli_traffic_class(self):
+        """
+        sets the traffic class of the production traffic by its DSCP on the input ports without
+        port class (one diffserv range per run of consecutive DSCP values, the ECN bits are ignored)
+        """
+        priority = 0
+        for link in self.links:
+            port_classes = [p for c in link["classes"] for p in c["ports"]]
+            for phys_port in self.production_input_ports(link):
+                if phys_port in port_classes:
+                    continue
+                for c in link["classes"][1:]:
+                    for (first, last) in dscp_runs(c["dscp"]):
+                        self.entries.add("traffic_class", "set_traffic_class",
+                                [("ig_intr_md_ingress_port", self.get_internal_ports(phys_port)), ("ipv4_diffserv", (first << 2, (last << 2) | 3))],
+                                [("traffic_type", c["traffic_type"])], priority)
+                        priority += 1
+
+    def link_match(self, link):
+        """returns the match on the link of the packet (only with several links)"""
+        return [("custom_metadata_link_id", link["link_id"])] if self.multi_link else []
         
     def generate_ucli_ports(self):
         part = "CLI"
@@ -521,16 +1099,21 @@ header evaluation_meta_t evaluation_meta;"
         if self.target == "device":
             # code += "ucli \n\n"
             
-            # normal ports
-            for phys_port in self.get_ports("input output fake_traffic recirculation obf_input obf_output".split()):
+            # normal ports (once, the links of a device can share ports)
+            ports = sum([self.get_ports("input output fake_traffic recirculation obf_input obf_output".split(), link) for link in self.links], [])
+            for phys_port in sorted(set(ports), key=ports.index):
 
 
-                code += "pm port-add %s %s NONE \n" % (self.phys_port_to_str(phys_port),self.phys_port_to_speed(phys_port))
+                speed = self.phys_port_to_speed(phys_port)
+                code += "pm port-add %s %s %s \n" % (self.phys_port_to_str(phys_port),speed,port_fec(self.chip, int(speed[:-1])))
                 code += "pm port-enb %s \n" % (self.phys_port_to_str(phys_port))
             
-            # ports for priority queueing
+            # ports for priority queueing (in the breakout mode of their speed)
             for phys_port in  self.get_ports("priorityqueuing_out".split()):
-                code += "pm port-add %i/- %iG NONE \n" % (phys_port,self.constants["BW_PER_QUEUE"])
+                if phys_port not in self.queue_port_speeds:
+                    continue
+                speed = self.queue_port_speeds[phys_port]
+                code += "pm port-add %i/- %iG %s \n" % (phys_port,speed,port_fec(self.chip, speed))
                 code += "pm port-enb %i/- \n" % (phys_port)
             
             code += "pm show\n"
@@ -552,103 +1135,135 @@ header evaluation_meta_t evaluation_meta;"
         
     
     def generate_cli_assign_queue(self):
-        part = "CLI"
-        code = ""
         priority = 0
+        for link in self.links:
+            for traffic_class in link["classes"]:
+                priority = self.generate_cli_assign_queue_class(link, traffic_class, priority)
+
+    def generate_cli_assign_queue_class(self, link, traffic_class, priority):
+        """
+        adds the queue assignment of the states of a traffic class of a link
+        (production traffic and the chaff of the class)
+
+        Returns:
+            int: next priority
+        """
+        pattern = traffic_class["pattern_sequence"]
+        state_index_to_port = traffic_class["state_index_to_port"]
         
-        state_to_iterators = {k:{"size":self.config["pattern_sequence"][k], "iterators":[]} for k in range(len(self.config["pattern_sequence"]))}
-        for p in set(self.config["pattern_sequence"]):
+        state_to_iterators = {k:{"size":pattern[k], "iterators":[]} for k in range(len(pattern))}
+        for p in set(pattern):
             indices = [k for (k,v) in filter(lambda (k,v): v["size"]==p, state_to_iterators.items())]
-            for i in range(len(self.config["pattern_sequence"])):
+            for i in range(len(pattern)):
                 state_to_iterators[indices[i%len(indices)]]["iterators"].append(i)
         
         # priority queues
-        traffictypes = [1]
+        traffictypes = [traffic_class["traffic_type"]]
         qid = 1
         for (k,v) in state_to_iterators.items():
-            lower_bound = max(max(filter(lambda x: x<v["size"], self.config["pattern_sequence"]+[0]))- self.constants["PADDING_META_LEN"],0)
+            lower_bound = max(max(filter(lambda x: x<v["size"], pattern+[0]))- self.constants["PADDING_META_LEN"],0)
             upper_bound = max(v["size"] - self.constants["PADDING_META_LEN"],0)
             for traffictype in traffictypes:
                 # for iterator in v["iterators"]:
                 for iterator in [0]:
                     
-                    code += "pd assign_to_queue add_entry set_state_properties_priority padding_meta_traffic_type %s "\
-                            "padding_meta_instance_type %s padding_meta_totalLen_start %s padding_meta_totalLen_end %s "\
-                            "custom_metadata_packet_iterator %s priority %s "\
-                            "action_egress_port %s action_state_index %s action_qid %s action_target_size %s \n" % \
-                            (hex(traffictype), hex(self.constants["INSTANCE_FIRSTPASS"]), hex(lower_bound), hex(upper_bound), \
-                            hex(iterator), hex(priority), hex(self.state_index_to_port[k]), hex(k), hex(qid), hex(v["size"]))
+                    self.entries.add("assign_to_queue", "set_state_properties_priority",
+                            self.link_match(link) + [("padding_meta_traffic_type", traffictype), ("padding_meta_instance_type", self.constants["INSTANCE_FIRSTPASS"]),
+                            ("padding_meta_totalLen", (lower_bound, upper_bound)), ("custom_metadata_packet_iterator", iterator)],
+                            [("egress_port", state_index_to_port[k]), ("state_index", k), ("qid", qid), ("target_size", v["size"])],
+                            priority)
                             
                     priority += 1
         
-        traffictype = 2
+        traffictype = traffic_class["chaff_traffic_type"]
         qid = 0
         for (k,v) in state_to_iterators.items():
             for iterator in [0]:
                 size = v["size"]
-                lower_bound = max(max(filter(lambda x: x<v["size"], self.config["pattern_sequence"]+[0]))- self.constants["PADDING_META_LEN"],0)
+                lower_bound = max(max(filter(lambda x: x<v["size"], pattern+[0]))- self.constants["PADDING_META_LEN"],0)
                 upper_bound = max(v["size"] - self.constants["PADDING_META_LEN"],0)
                         
-                code += "pd assign_to_queue add_entry set_state_properties_priority padding_meta_traffic_type %s "\
-                        "padding_meta_instance_type %s padding_meta_totalLen_start %s padding_meta_totalLen_end %s "\
-                        "custom_metadata_packet_iterator %s priority %s "\
-                        "action_egress_port %s action_state_index %s action_qid %s action_target_size %s \n" % \
-                        (hex(traffictype), hex(self.constants["INSTANCE_FIRSTPASS"]), hex(lower_bound), hex(upper_bound), \
-                        hex(iterator), hex(priority), hex(self.state_index_to_port[k]), hex(k), hex(qid), hex(size))
+                self.entries.add("assign_to_queue", "set_state_properties_priority",
+                        self.link_match(link) + [("padding_meta_traffic_type", traffictype), ("padding_meta_instance_type", self.constants["INSTANCE_FIRSTPASS"]),
+                        ("padding_meta_totalLen", (lower_bound, upper_bound)), ("custom_metadata_packet_iterator", iterator)],
+                        [("egress_port", state_index_to_port[k]), ("state_index", k), ("qid", qid), ("target_size", size)],
+                        priority)
                 priority += 1
         
         # round robin queues
-        traffictypes = [1, 2]
+        traffictypes = [traffic_class["traffic_type"], traffic_class["chaff_traffic_type"]]
         for traffictype in traffictypes:
-            output_port = self.get_internal_ports(self.port_configuration["output"])
+            output_port = self.get_internal_ports(link["port_configuration"]["output"])
             
             for iterator in [0]:
-                for state_index in range(len(self.config["pattern_sequence"])):
-                    size = self.config["pattern_sequence"][state_index]
+                for state_index in range(len(pattern)):
+                    size = pattern[state_index]
                     lower_bound = max(size-self.constants["MAX_PADDING_BYTES"],0)
                     
-                    code += "pd assign_to_queue add_entry set_state_properties_roundrobin padding_meta_traffic_type %s " \
-                            "padding_meta_instance_type %s padding_meta_totalLen_start %s padding_meta_totalLen_end %s "\
-                            "custom_metadata_packet_iterator %s priority %s action_egress_port %s action_qid %s \n" % \
-                            (hex(traffictype), hex(self.constants["INSTANCE_SECONDPASS"]), hex(lower_bound), hex(size), \
-                            hex(iterator), hex(priority), hex(output_port), hex(state_index))
+                    self.entries.add("assign_to_queue", "set_state_properties_roundrobin",
+                            self.link_match(link) + [("padding_meta_traffic_type", traffictype), ("padding_meta_instance_type", self.constants["INSTANCE_SECONDPASS"]),
+                            ("padding_meta_totalLen", (lower_bound, size)), ("custom_metadata_packet_iterator", iterator)],
+                            [("egress_port", output_port), ("qid", traffic_class["qid_offset"] + state_index)],
+                            priority)
                     priority += 1
-        
-        self.add_to_part(part,code)
+        return priority
     
     def generate_cli_type(self):
-        part = "CLI"
-        code = ""
-        
-        for port in self.get_internal_ports(self.get_ports("input".split())):
-            code += "pd traffic_type add_entry set_traffic_type ig_intr_md_ingress_port %s action_traffic_type %s action_instance_type %s action_needs_obfuscation %s \n" % (hex(port),hex(self.T_TYPE_PROD), hex(self.constants["INSTANCE_FIRSTPASS"]), hex(1))     
-        
-        for port in self.get_internal_ports(self.get_ports("priorityqueuing_in".split())):
-            code += "pd traffic_type add_entry set_instance_type ig_intr_md_ingress_port %s action_instance_type %s action_needs_obfuscation %s \n" % (hex(port), hex(self.constants["INSTANCE_SECONDPASS"]), hex(1))     
+        for link in self.links:
+            # traffic classes by input port (with traffic classes, recirculated packets keep their class)
+            port_classes = {p: c["traffic_type"] for c in link["classes"] for p in c["ports"]}
+            for (i, phys_port) in enumerate(self.get_ports("input".split(), link)):
+                port = self.get_internal_ports(phys_port)
+                if i == 1 and len(link["classes"]) > 1:
+                    self.entries.add("traffic_type", "set_instance_type", [("ig_intr_md_ingress_port", port)],
+                            [("instance_type", self.constants["INSTANCE_FIRSTPASS"]), ("needs_obfuscation", 1)])
+                    continue
+                self.entries.add("traffic_type", "set_traffic_type", [("ig_intr_md_ingress_port", port)],
+                        [("traffic_type", port_classes.get(phys_port, self.T_TYPE_PROD)), ("instance_type", self.constants["INSTANCE_FIRSTPASS"]), ("needs_obfuscation", 1)])
             
-        for port in self.get_internal_ports(self.get_ports("fake_traffic".split())):
-            code += "pd traffic_type add_entry set_traffic_type ig_intr_md_ingress_port %s action_traffic_type %s action_instance_type %s action_needs_obfuscation %s \n" % (hex(port),hex(self.T_TYPE_FAKE), hex(self.constants["INSTANCE_FIRSTPASS"]), hex(1))     
-            
-        self.add_to_part(part,code)
+            for port in self.get_queue_in_ports(link):
+                self.entries.add("traffic_type", "set_instance_type", [("ig_intr_md_ingress_port", port)],
+                        [("instance_type", self.constants["INSTANCE_SECONDPASS"]), ("needs_obfuscation", 1)])
+                
+            for traffic_class in link["classes"]:
+                for port in self.get_internal_ports(traffic_class["fake_traffic"]):
+                    self.entries.add("traffic_type", "set_traffic_type", [("ig_intr_md_ingress_port", port)],
+                            [("traffic_type", traffic_class["chaff_traffic_type"]), ("instance_type", self.constants["INSTANCE_FIRSTPASS"]), ("needs_obfuscation", 1)])
     
     def generate_cli_padding_meta_next_etherType(self):
-        part = "CLI"
-        code = ""
-
         priority = 0
 
         for p in self.config["pads"]:
             bytes_start = p
 
-            code += "\npd set_padding_meta_next_etherType add_entry padding_meta_set_next_etherType custom_metadata_bytes_to_add_start %s custom_metadata_bytes_to_add_end %s priority %s action_next_etherType %s" \
-                    % (hex(bytes_start), hex(self.constants["MTU"]), hex(priority), hex(self.constants["ETHERTYPE_%iB_PADS"%p]))
+            self.entries.add("set_padding_meta_next_etherType", "padding_meta_set_next_etherType",
+                    [("custom_metadata_bytes_to_add", (bytes_start, self.constants["MTU"]))],
+                    [("next_etherType", self.constants["ETHERTYPE_%iB_PADS"%p])], priority)
             priority += 1
-        
-        self.add_to_part(part,code)
     
+    def generate_cli_padding_single_lookup(self):
+        # bytes_to_add > MAX_PADDING_BYTES: add all headers (and recirculate)
+        max_bytes = self.constants["MAX_PADDING_BYTES"]
+        num_entries = max([required_padding_bytes(c["pattern_sequence"], self.constants["PADDING_META_LEN"]) for link in self.links for c in link["classes"]] + [max_bytes])
+        for (i, group) in enumerate(self.pad_groups()):
+            for b in range(1, num_entries+1):
+                combination = self.pad_combination(min(b, max_bytes))
+                group_combination = [(p,n) for (p,n) in combination if p in group]
+                if not group_combination:
+                    continue
+                # the last header of the group points to the first header of the next group (if any)
+                following = [p for (p,n) in combination if p < group[-1]]
+                next_etherType = self.constants["ETHERTYPE_%iB_PADS" % following[0]] if following else 0
+                self.entries.add("pad_headers_%i" % i, self.pad_group_action(group_combination),
+                        [("custom_metadata_bytes_to_add", b)], [("next_etherType", next_etherType)])
+        for b in range(1, num_entries+1):
+            self.entries.add("add_padding", "add_pads",
+                    [("custom_metadata_bytes_to_add", b)], [("num_bytes", min(b, max_bytes))])
+
     def generate_cli_padding_tables(self):
-        part = "CLI"
-        code = ""
+        if self.padding_mode == "single_lookup":
+            self.generate_cli_padding_single_lookup()
+            return
 
         for p in self.config["pads"]:
             num_pads = self.constants["NUM_%iB_PADS"%p]
@@ -658,75 +1273,62 @@ header evaluation_meta_t evaluation_meta;"
 
                 bytes_start = (i+1)*p
 
-                code += "\npd add_padding_%i add_entry add_padding%i_%i custom_metadata_bytes_to_add_start %s custom_metadata_bytes_to_add_end %s priority %s action_next_etherType 0x0" \
-                        % (p, p, i+1, hex(bytes_start), hex(self.constants["MTU"]), hex(priority))
+                self.entries.add("add_padding_%i" % p, "add_padding%i_%i" % (p, i+1),
+                        [("custom_metadata_bytes_to_add", (bytes_start, self.constants["MTU"]))], [("next_etherType", 0)], priority)
                 priority -= 1
 
                 for pp in sorted(self.config["pads"], reverse=False): # possible next pad
                     if pp>=p:
                         continue
                     bytes_end = self.constants["MTU"]
-                    code += "\npd add_padding_%i add_entry add_padding%i_%i custom_metadata_bytes_to_add_start %s custom_metadata_bytes_to_add_end %s priority %s action_next_etherType %s" \
-                            % (p, p, i+1, hex(bytes_start+pp), hex(bytes_end), hex(priority), hex(self.constants["ETHERTYPE_%iB_PADS"%pp]))
+                    self.entries.add("add_padding_%i" % p, "add_padding%i_%i" % (p, i+1),
+                            [("custom_metadata_bytes_to_add", (bytes_start+pp, bytes_end))],
+                            [("next_etherType", self.constants["ETHERTYPE_%iB_PADS"%pp])], priority)
                     priority -= 1
-
-            code += "\n"
-        
-        self.add_to_part(part,code)
     
     def generate_cli_recirculation(self):
-        part = "CLI"
-        code = "\npd recirculation_decision add_entry _NoAction custom_metadata_bytes_to_add_start 0x0 custom_metadata_bytes_to_add_end %s priority 0x1" % (hex(self.constants["MAX_PADDING_BYTES"]))
-        code += "\n"
-        
-        self.add_to_part(part,code)
+        self.entries.add("recirculation_decision", "_NoAction",
+                [("custom_metadata_bytes_to_add", (0, self.constants["MAX_PADDING_BYTES"]))], priority=1)
     
     def generate_cli_toobig(self):
-        part = "CLI"
-        code = "\npd ignore_toobigpackets add_entry _NoAction padding_meta_origLen_start 0 padding_meta_origLen_end %s priority 0x1" % (hex(self.constants["MAX_PACKET_SIZE"]-14-1))
-        code += "\n"
-        
-        self.add_to_part(part,code)
+        self.entries.add("ignore_toobigpackets", "_NoAction",
+                [("padding_meta_origLen", (0, self.constants["MAX_PACKET_SIZE"]-14-1))], priority=1)
     
     def generate_cli_packet_iterator(self):
-        part = "CLI"
-        code = ""
-        
-        for port in self.get_internal_ports(self.get_ports("input fake_traffic priorityqueuing_in".split())):
-            code += "\npd packet_iterator add_entry update_packet_iterator ig_intr_md_ingress_port %s" % (hex(port))
-        code += "\n"
-        
-        self.add_to_part(part,code)
+        for link in self.links:
+            for port in self.get_internal_ports(self.get_ports("input fake_traffic".split(), link)) + self.get_queue_in_ports(link):
+                self.entries.add("packet_iterator", "update_packet_iterator", [("ig_intr_md_ingress_port", port)])
     
     def generate_cli_deobf_blocklist(self):
-        part = "CLI"
-        code = ""
-        
-        traffictypes = [2]
+        # the chaff of all traffic classes (of the links of the peer, which has the same classes)
+        traffictypes = sorted(set([c["chaff_traffic_type"] for link in self.links for c in link["classes"]]))
         for traffictype in traffictypes:
-            code += "\npd deobfuscation_blocklist add_entry droppacket padding_meta_traffic_type %s" % (hex(traffictype))
-        code += "\n"
-        
-        self.add_to_part(part,code)
+            self.entries.add("deobfuscation_blocklist", "droppacket", [("padding_meta_traffic_type", traffictype)])
     
     def generate_cli_deobf_determine_ethertype(self):
-        part = "CLI"
-        code = ""
-
         bytes_start = 1
 
         for pad in sorted(self.config["pads"]):
             next_pad = min(filter(lambda x: x>pad, self.config["pads"]+[self.constants["MTU"]]))
             ethertype = self.constants["ETHERTYPE_%iB_PADS" % pad]
-            code += "\npd deobfuscation_determine_next_ethertype add_entry set_padding_meta_next_etherType custom_metadata_bytes_to_add_start %i custom_metadata_bytes_to_add_end %i priority %i action_etherType %s" % (bytes_start, next_pad-1, pad, hex(ethertype))
+            self.entries.add("deobfuscation_determine_next_ethertype", "set_padding_meta_next_etherType",
+                    [("custom_metadata_bytes_to_add", (bytes_start, next_pad-1))], [("etherType", ethertype)], pad)
             bytes_start = next_pad
-        code += "\n"
-        
-        self.add_to_part(part,code)
     
     def generate_cli_addlines(self,code):
         part = "CLI"
         self.add_to_part(part,code)
+
+    def compact_cli_tables(self):
+        """
+        replaces the overlapping range entries by the smallest set of non-overlapping entries
+        (see tcam_compiler.py)
+        """
+        entries, report = compact_entries(list(self.entries))
+        self.entries = TableEntries.from_entries(entries)
+
+        for line in format_report(report):
+            log.debug(line)
     
     
     def git_add_generated_files(self):
@@ -750,13 +1352,13 @@ header evaluation_meta_t evaluation_meta;"
         self.generate_ucli_rate_monitor()
         self.generate_cli_addlines("end")
         
-        # bfshell input
-        self.generate_cli_addlines("pd-traffic-pattern-tofino")
-
+        # bfshell input (see cli_lines)
         self.generate_cli_forwarding()
         self.generate_cli_cloning()
+        self.generate_cli_link()
         self.generate_cli_assign_queue()
         self.generate_cli_type()
+        self.generate_cli_traffic_class()
         self.generate_cli_packet_iterator()
         self.generate_cli_padding_meta_next_etherType()
         self.generate_cli_padding_tables()
@@ -764,8 +1366,84 @@ header evaluation_meta_t evaluation_meta;"
         self.generate_cli_toobig()
         self.generate_cli_deobf_determine_ethertype()
         self.generate_cli_deobf_blocklist()
-                
-        self.generate_cli_addlines("end")
+
+        if self.port_configuration.get("compact_tables", False):
+            self.compact_cli_tables()
+
+
+    def estimate_resources(self, p4_filepath):
+        """
+        estimates parser, PHV, table and stage usage of the program with the generated code
+        (see resource_estimator.py)
+
+        Returns:
+            dict: resource estimate (problems contains the exceeded budgets)
+        """
+        return ResourceEstimator(p4_filepath, sections=self.code, entries=self.entries).estimate()
+
+
+# lab configuration of the fleet workers (read once and shared with the forked processes)
+fleet_lab_config = None
+
+def init_fleet_worker(lab_config):
+    global fleet_lab_config
+    fleet_lab_config = lab_config
+
+
+def generate_device(job):
+    """
+    generates the code of one device of a fleet and writes it to its own directory
+
+    Args:
+        job (tuple): device, device configuration, P4 file (for the resource estimate),
+            output directory of the device and additional entry formats
+
+    Returns:
+        dict: device, generated files, parser usage, problems and generation time
+    """
+    (device, configuration, p4_filepath, directory, entries_formats) = job
+    start = time.time()
+
+    pcg = PatternCodeGenerator(configuration["target"], configuration, device, lab_config=fleet_lab_config)
+    pcg.generate_everything()
+    estimate = pcg.estimate_resources(p4_filepath)
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    pcg.write_code_to_file(os.path.join(directory,"add_padding.p4"))
+    pcg.write_device_specific_info_to_file(os.path.join(directory,"pd_rpc_info_%s.json" % device))
+    pcg.write_cli_to_file(os.path.join(directory,"bfshell_input_%s.txt" % device))
+    problems = list(estimate["problems"])
+    if "loop_rtt" in configuration:
+        problems += pcg.write_chaff_plan_to_file(os.path.join(directory,"chaff_plan_%s.json" % device), configuration["loop_rtt"])
+    for format in entries_formats:
+        extension = {"json": "json", "binary": "bin"}[format]
+        pcg.write_entries_to_file(os.path.join(directory,"table_entries_%s.%s" % (device, extension)), format)
+
+    return {
+        "device": device,
+        "files": pcg.generated_files,
+        "parser_states": estimate["parser_states"],
+        "parser_transitions": estimate["parser_transitions"],
+        "problems": problems,
+        "time": time.time() - start,
+    }
+
+
+def parse_traffic_class(text):
+    """parses name:dscp[,dscp...]:size[,size...]:share (see --traffic-class)"""
+    try:
+        (name, dscp, pattern, share) = text.split(":")
+        return {"name": name, "dscp": [int(d) for d in dscp.split(",") if d], "pattern": [int(p) for p in pattern.split(",")], "share": float(share)}
+    except ValueError:
+        raise argparse.ArgumentTypeError("traffic class %s is not name:dscp[,dscp...]:size[,size...]:share" % text)
+
+
+def queuing_ports_hint(args):
+    """returns a hint for a failed allocation of the queuing ports"""
+    if args.runtime_pattern_length is None:
+        return ""
+    return " (--runtime-pattern-length needs a queuing channel for the full rate of the link for each of the %i states)" % args.runtime_pattern_length
 
 
 def parse_args(args):
@@ -780,6 +1458,134 @@ def parse_args(args):
     parser = argparse.ArgumentParser(
         description="volume obfuscation code generator")
     
+    parser.add_argument(
+        "--traffic",
+        type=str,
+        default=None,
+        help="choose the pattern for this production traffic (pcap file or packet size histogram)")
+
+    parser.add_argument(
+        "--max-pattern-length",
+        type=int,
+        default=4,
+        help="maximum number of states of the optimized pattern (only with --traffic)")
+
+    parser.add_argument(
+        "--runtime-pattern-length",
+        type=int,
+        default=None,
+        help="compile the program for patterns with up to this many states (a new pattern then only needs new table entries and queue setup); "
+             "each state needs a queuing channel for the full rate of its link, see --port-speeds")
+
+    parser.add_argument(
+        "--optimize-pads",
+        dest="optimize_pads",
+        help="use the smallest number of padding headers which avoids recirculations for the pattern",
+        action="store_true")
+
+    parser.add_argument(
+        "--recirculation-bound",
+        type=int,
+        default=None,
+        help="choose the pads (within the PHV budget) such that no packet is recirculated more than this many times (adds states to the patterns if needed)")
+
+    parser.add_argument(
+        "--padding-mode",
+        type=str,
+        choices=PatternCodeGenerator.PADDING_MODES,
+        default="tables",
+        help="tables: one range table per pad size, single_lookup: independent exact match tables for groups of padding headers")
+
+    parser.add_argument(
+        "--parser-mode",
+        type=str,
+        choices=PatternCodeGenerator.PARSER_MODES,
+        default="full",
+        help="full: parser transitions to all padding headers, compact: only transitions which occur in obfuscated packets")
+
+    parser.add_argument(
+        "--estimate-only",
+        dest="estimate_only",
+        help="only estimate the resources of the generated program (do not write any files)",
+        action="store_true")
+
+    parser.add_argument(
+        "--entries-format",
+        type=str,
+        nargs="+",
+        choices=["json", "binary"],
+        default=[],
+        help="also write the table entries in these formats (table_entries_X.json/.bin, see table_entries.py)")
+
+    parser.add_argument(
+        "--update-plan",
+        dest="update_plan",
+        help="write update_plan.json with the changes from the files on disk to the new files (see table_delta.py)",
+        action="store_true")
+
+    parser.add_argument(
+        "--target-bw",
+        type=int,
+        default=None,
+        help="rate of the obfuscated traffic in Gbps (default: %i, e.g., 400 for 400G links)" % PatternCodeGenerator.DEFAULT_CONSTANTS["TARGET_BW"])
+
+    parser.add_argument(
+        "--port-speeds",
+        type=int,
+        nargs="+",
+        default=None,
+        help="allowed speeds of the priority queuing ports in Gbps (default: all speeds of the chip, see port_allocator.py)")
+
+    parser.add_argument(
+        "--traffic-class",
+        dest="traffic_classes",
+        type=parse_traffic_class,
+        action="append",
+        default=None,
+        help="traffic class with its own pattern: name:dscp[,dscp...]:size[,size...]:share (share of the bandwidth, e.g., voice:46:400,800:0.1)")
+
+    parser.add_argument(
+        "--strict-visible-pattern",
+        dest="strict_visible_pattern",
+        help="fail if the traffic classes together do not match the pattern on the output port",
+        action="store_true")
+
+    parser.add_argument(
+        "--chaff-plan",
+        dest="chaff_plan",
+        help="write chaff_plan_X.json with the chaff pool of each state (see chaff_pool.py and inject_chaff_packets.py --plan)",
+        action="store_true")
+
+    parser.add_argument(
+        "--loop-rtt",
+        type=float,
+        default=chaff_pool.DEFAULT_LOOP_RTT,
+        help="measured or configured round trip time of the chaff clone loops in seconds (for --chaff-plan)")
+
+    parser.add_argument(
+        "--fleet",
+        type=str,
+        default=None,
+        help="generate the code of all links in a fleet file (see fleet.py) in parallel")
+
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="../../p4/traffic_pattern_tofino/fleet/",
+        help="output directory of --fleet (one directory per device)")
+
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="number of processes of --fleet (default: number of CPUs)")
+
+    parser.add_argument(
+        "--compact-tables",
+        dest="compact_tables",
+        help="write non-overlapping range entries (fewer TCAM entries)",
+        action="store_true")
+
     parser.add_argument(
         "-v",
         "--verbose",
@@ -810,6 +1616,18 @@ def main(args):
 
     pattern = [533, 1066, 1600] # unif, l3
 
+    if args.traffic:
+        sizes, counts = load_packet_sizes(args.traffic)
+        optimizer = optimizer_for_generator(sizes, counts, PatternCodeGenerator.DEFAULT_CONSTANTS, PatternCodeGenerator.DEFAULT_PADS)
+        log.info("default %s" % format_metrics(optimizer.evaluate(pattern)))
+
+        max_pattern_length = args.max_pattern_length
+        if args.runtime_pattern_length is not None:
+            max_pattern_length = min(max_pattern_length, args.runtime_pattern_length)
+        best = optimizer.search(max_pattern_length)
+        log.info("optimized %s" % format_metrics(best))
+        pattern = best["pattern"]
+
     code_directory = "../../p4/traffic_pattern_tofino/"
 
     device_configuration = {
@@ -843,24 +1661,156 @@ def main(args):
         },
     }
 
+    if args.fleet:
+        lab_config = get_config(LAB_CONFIG_DIRECTORY)
+        device_configuration = fleet.device_configurations(fleet.load_fleet(args.fleet), lab_config, pattern)
+        log.info("fleet with %i devices" % len(device_configuration))
+
+    for configuration in device_configuration.values():
+        configuration["compact_tables"] = args.compact_tables
+        configuration["padding_mode"] = args.padding_mode
+        configuration["parser_mode"] = args.parser_mode
+        if args.runtime_pattern_length is not None:
+            configuration["max_pattern_length"] = args.runtime_pattern_length
+        if args.target_bw is not None:
+            configuration["target_bw"] = args.target_bw
+        if args.port_speeds is not None:
+            configuration["port_speeds"] = args.port_speeds
+        if args.traffic_classes is not None:
+            configuration["traffic_classes"] = args.traffic_classes
+        if args.strict_visible_pattern:
+            configuration["strict_visible_pattern"] = True
+        if args.chaff_plan:
+            configuration["loop_rtt"] = args.loop_rtt
+
+    if args.optimize_pads or args.recirculation_bound is not None:
+        # one pad configuration per pattern (the links of a fleet can have different patterns,
+        # a device with several links needs the pads of its longest gap)
+        pads_by_pattern = {}
+        owners = []
+        for configuration in device_configuration.values():
+            links = configuration.get("links") or [configuration]
+            patterns = [l.get("pattern", configuration["pattern"]) for l in links]
+            classes = [c for l in links for c in l.get("traffic_classes", configuration.get("traffic_classes")) or []]
+            patterns += [c["pattern"] for c in classes]
+            key = tuple([tuple(p) for p in patterns])
+            if key not in pads_by_pattern:
+                padding_meta_len = PatternCodeGenerator.DEFAULT_CONSTANTS["PADDING_META_LEN"]
+                optimizer = PadOptimizer(max_bytes=PatternCodeGenerator.DEFAULT_CONSTANTS["MTU"])
+                # (the pads have to fit in PHV_BUDGET_BITS)
+                try:
+                    if args.recirculation_bound is None:
+                        required_bytes = max([required_padding_bytes(p, padding_meta_len) for p in patterns])
+                        (num_pads, bounded_patterns) = (optimizer.optimize(required_bytes, PHV_BUDGET_BITS), patterns)
+                        log.info("pads for %i bytes: %s" % (required_bytes, format_num_pads(num_pads)))
+                    else:
+                        (num_pads, bounded_patterns) = optimizer.optimize_bounded(patterns, padding_meta_len, args.recirculation_bound, PHV_BUDGET_BITS)
+                        log.info("pads for at most %i recirculations: %s" % (args.recirculation_bound, format_num_pads(num_pads)))
+                except ValueError as e:
+                    log.error("%s (--recirculation-bound adds states to the pattern instead)" % e)
+                    sys.exit(1)
+                log.info("padding headers need %i of %i PHV bits" % (phv_usage(num_pads), PHV_BUDGET_BITS))
+                pads_by_pattern[key] = (num_pads, bounded_patterns)
+            configuration["num_pads"] = pads_by_pattern[key][0]
+            owners.append((configuration, links + classes, patterns, pads_by_pattern[key][1]))
+
+        # states added for the recirculation bound (this changes the visible pattern; the links and
+        # traffic classes can be shared between devices, so all pads are chosen before)
+        for (configuration, pattern_owners, patterns, bounded_patterns) in owners:
+            for (owner, pattern, bounded) in zip(pattern_owners, patterns, bounded_patterns):
+                if set(bounded) != set(pattern):
+                    log.warning("pattern %s needs the states %s for at most %i recirculations" % (
+                        pattern, sorted(set(bounded) - set(pattern)), args.recirculation_bound))
+                    owner["pattern"] = list(bounded)
+            configuration["pattern"] = pattern_owners[0].get("pattern", configuration["pattern"])
+
+    if args.fleet:
+        if args.update_plan or args.estimate_only:
+            log.warning("--update-plan and --estimate-only are not supported with --fleet")
+        jobs = [(device, configuration, os.path.join(code_directory,"p4src/traffic_pattern_tofino.p4"),
+                 os.path.join(args.output, device), args.entries_format)
+                for (device, configuration) in sorted(device_configuration.items())]
+        start = time.time()
+        pool = Pool(args.processes, initializer=init_fleet_worker, initargs=(lab_config,))
+        try:
+            results = pool.map(generate_device, jobs)
+        except ValueError as e:
+            pool.terminate()
+            log.error("%s%s" % (e, queuing_ports_hint(args)))
+            sys.exit(1)
+        pool.close()
+        pool.join()
+        for result in results:
+            log.info("%s: parser with %i states, %i transitions (TCAM entries), %.1fs" % (result["device"], result["parser_states"], result["parser_transitions"], result["time"]))
+            for problem in result["problems"]:
+                log.warning("%s: %s" % (result["device"], problem))
+            log.info(result["files"])
+        log.info("generated %i devices in %.1fs" % (len(results), time.time() - start))
+        return
+
+    # installed entries, queue configuration and program (before the files are replaced)
+    update = {}
+    if args.update_plan and not args.estimate_only:
+        for device in "tofino1 tofino2".split():
+            update[device] = {
+                "old": TableEntries.load(os.path.join(code_directory,"bfshell_input_%s.txt" % device)),
+                "old_info": json.load(open(os.path.join(code_directory,"pd_rpc_info_%s.json" % device))),
+                "old_code": open(os.path.join(code_directory,"p4src/include/generated/add_padding.p4")).read().split("\n"),
+            }
+
     for device in "tofino1 tofino2".split():
         log.info("generating code for %s" % device)
         configuration = device_configuration[device]
 
-        pcg = PatternCodeGenerator(configuration["target"],configuration, device)
+        try:
+            pcg = PatternCodeGenerator(configuration["target"],configuration, device)
+        except ValueError as e:
+            # the queuing ports cannot carry the states
+            log.error("%s%s" % (e, queuing_ports_hint(args)))
+            sys.exit(1)
         pcg.generate_everything()
 
-        pcg.write_code_to_file(os.path.join(code_directory,"p4src/include/generated/add_padding.p4"))
+        estimate = pcg.estimate_resources(os.path.join(code_directory,"p4src/traffic_pattern_tofino.p4"))
+        log.info("%s: parser with %i states, %i transitions (TCAM entries)" % (device, estimate["parser_states"], estimate["parser_transitions"]))
+        for problem in estimate["problems"]:
+            log.warning("%s: %s" % (device, problem))
+        if args.estimate_only:
+            for line in resource_estimator.format_report(estimate):
+                log.info(line)
+            continue
+
+        if device in update:
+            update[device]["new"] = pcg.entries
+            update[device]["new_info"] = pcg.device_specific_info()
+            update[device]["program_changes"] = table_delta.program_changes(update[device]["old_code"], pcg.code_text().split("\n"))
+
+        if device == "tofino1 tofino2".split()[-1]:
+            # the compiled sections are the same for all devices
+            pcg.write_code_to_file(os.path.join(code_directory,"p4src/include/generated/add_padding.p4"))
         pcg.write_device_specific_info_to_file(os.path.join(code_directory,"pd_rpc_info_%s.json" % device))
 
         # pcg.write_device_specific_info_to_file(os.path.join(code_directory,"server_info_%s.json" % configuration["connected_server"]))
         pcg.write_cli_to_file(os.path.join(code_directory,"bfshell_input_%s.txt" % device))
+        if args.chaff_plan:
+            for problem in pcg.write_chaff_plan_to_file(os.path.join(code_directory,"chaff_plan_%s.json" % device), args.loop_rtt):
+                log.warning("%s: %s" % (device, problem))
+        for format in args.entries_format:
+            extension = {"json": "json", "binary": "bin"}[format]
+            pcg.write_entries_to_file(os.path.join(code_directory,"table_entries_%s.%s" % (device, extension)), format)
 
         log.info(pcg.generated_files)
         log.info("MAX_PADDING_BYTES: %i" % pcg.constants["MAX_PADDING_BYTES"])
         
         # pcg.git_add_generated_files()
 
+    if update:
+        plan = table_delta.plan_update(update)
+        table_delta.write_plan(plan, os.path.join(code_directory,"update_plan.json"))
+        for line in table_delta.format_plan(plan):
+            log.info(line)
+        if plan["restart_required"]:
+            log.warning("the new program needs to be compiled and the switches restarted (the update plan cannot be applied)")
+
     # pcg.git_commit()
 
 
@@ -0,0 +1,438 @@
+"""
+script to choose the padding headers (sizes and numbers) for a given pattern.
+usage:
+python pad_optimizer.py --pattern 533 1066 1600 -v
+python pad_optimizer.py --pattern 533 1066 1600 --recirculation-bound 1 --phv-budget 4000 -v
+
+The padding tables add pads greedily from the largest to the smallest size
+(add_padding_32, add_padding_16, ...). With n_p pads of size p, this adds exactly
+bytes_to_add bytes for every value in [0, MAX_PADDING_BYTES] if the smaller pads
+can fill the gap between two consecutive multiples of each used size, i.e.
+sum(q*n_q for q < p) >= p-1 for every used size p.
+
+Each padding header is a separate header instance which needs to fit in PHV and
+each used size requires one (dependent) table application in egress.
+The solver minimizes the number of padding headers (then the number of padding
+tables, then the number of PHV bits, which equals 8*MAX_PADDING_BYTES) such that
+MAX_PADDING_BYTES covers the largest gap in the pattern, i.e. no packet needs to
+be recirculated, and the pads fit in the PHV budget (otherwise it fails).
+
+A packet which needs bytes_to_add > MAX_PADDING_BYTES gets all padding headers and is
+recirculated, i.e. it needs (bytes_to_add-1)//MAX_PADDING_BYTES recirculations.
+recirculation_distribution shows this number for every packet size up to the MTU.
+With a recirculation bound k, MAX_PADDING_BYTES only needs to cover 1/(k+1) of the
+largest gap. If the pads for the bound do not fit in the PHV budget, states are inserted
+into the pattern (split_states) until the pads within the budget cover every gap.
+"""
+
+import os, sys, time
+import argparse
+import json
+import logging
+
+import numpy as np
+
+
+def setup_logging(loglevel="DEBUG"):
+    """Setup basic logging
+
+    Args:
+      loglevel (int): minimum loglevel for emitting messages
+    """
+    logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
+    logging.basicConfig(level=loglevel, stream=sys.stdout,
+                        format=logformat, datefmt="%Y-%m-%d %H:%M:%S")
+
+log = logging.getLogger(__name__)
+
+# sizes (in bytes) of the padding header types in headers.p4
+PAD_SIZES = [1, 2, 4, 8, 16, 32]
+
+# PHV model (Tofino): 64 8-bit, 96 16-bit and 64 32-bit containers
+PHV_BUDGET_BITS = 64*8 + 96*16 + 64*32
+
+# PHV bits of the headers and metadata which do not depend on the padding configuration
+# (ethernet, ipv4, padding_meta, evaluation_meta, custom_metadata, clone_metadata)
+PHV_FIXED_BITS = 112 + 160 + 144 + 224 + 58 + 32
+
+# smallest possible packet (ethernet + IPv4 header without payload)
+MIN_PACKET_SIZE = 14 + 20
+
+
+def pad_header_bits(pad_size):
+    """returns the number of PHV bits of one padding header"""
+    return pad_size * 8
+
+
+def max_padding_bytes(num_pads):
+    """returns the number of bytes which can be added with the given pads (dict size -> number)"""
+    return sum([p*n for (p,n) in num_pads.items()])
+
+
+def is_contiguous(num_pads):
+    """
+    returns True if the padding tables can add any number of bytes in [0, max_padding_bytes(num_pads)]
+    """
+    reach = 0
+    for p in sorted(num_pads):
+        if num_pads[p] > 0:
+            if reach < p-1:
+                return False
+            reach += p*num_pads[p]
+    return True
+
+
+def required_padding_bytes(pattern, padding_meta_len, min_packet_size=MIN_PACKET_SIZE):
+    """
+    returns the largest number of bytes that need to be added to a packet in one of the states
+    (see generate_cli_assign_queue for the packet size ranges of the states)
+    """
+    pattern = sorted(set(pattern))
+    required = 0
+    for (i, size) in enumerate(pattern):
+        smallest_packet = pattern[i-1] - padding_meta_len + 1 if i > 0 else min_packet_size
+        required = max(required, size - padding_meta_len - smallest_packet)
+    return required
+
+
+def bounded_padding_bytes(required_bytes, max_recirculations=0):
+    """returns the MAX_PADDING_BYTES which adds required_bytes with at most max_recirculations recirculations"""
+    return -(-required_bytes // (max_recirculations+1))
+
+
+def recirculations_per_size(pattern, max_padding_bytes, padding_meta_len, mtu, min_packet_size=MIN_PACKET_SIZE):
+    """
+    returns the number of recirculations of every packet size in [min_packet_size, mtu]
+    (index: size - min_packet_size, -1 for packets which are too big for the pattern)
+    """
+    pattern = sorted(set(pattern))
+    sizes = np.arange(min_packet_size, mtu+1)
+    # smallest state which carries the packet (see generate_cli_assign_queue)
+    states = np.searchsorted(np.array(pattern) - padding_meta_len, sizes)
+    too_big = states == len(pattern)
+    bytes_to_add = np.array(pattern + [0])[states] - padding_meta_len - sizes
+    assert max_padding_bytes > 0, "no padding bytes"
+    recirculations = np.where(bytes_to_add > 0, (bytes_to_add-1) // max_padding_bytes, 0)
+    return np.where(too_big, -1, recirculations)
+
+
+def recirculation_distribution(pattern, max_padding_bytes, padding_meta_len, mtu, min_packet_size=MIN_PACKET_SIZE):
+    """
+    Returns:
+        dict: sizes (number of packet sizes per number of recirculations), worst_case (largest
+            number of recirculations), worst_size (smallest packet size with the worst case)
+            and too_big (number of packet sizes which do not fit in the pattern)
+    """
+    recirculations = recirculations_per_size(pattern, max_padding_bytes, padding_meta_len, mtu, min_packet_size)
+    served = recirculations[recirculations >= 0]
+    worst_case = int(served.max()) if len(served) > 0 else 0
+    return {
+        "sizes"       : {int(r): int((served == r).sum()) for r in np.unique(served)},
+        "worst_case"  : worst_case,
+        "worst_size"  : int(np.argmax(recirculations == worst_case)) + min_packet_size,
+        "too_big"     : int((recirculations < 0).sum()),
+    }
+
+
+def format_distribution(distribution):
+    text = ", ".join(["%i sizes with %i" % (n, r) for (r, n) in sorted(distribution["sizes"].items())])
+    text += " recirculations (worst case %i" % distribution["worst_case"]
+    if distribution["worst_case"] > 0:
+        text += ", e.g., size %i" % distribution["worst_size"]
+    text += ")"
+    if distribution["too_big"] > 0:
+        text += ", %i sizes too big" % distribution["too_big"]
+    return text
+
+
+def split_states(pattern, max_padding_bytes, padding_meta_len, max_recirculations=0, min_packet_size=MIN_PACKET_SIZE):
+    """
+    returns the pattern with the fewest additional states such that no packet needs more
+    than max_recirculations recirculations with the given MAX_PADDING_BYTES
+    (each new state is as large as possible, starting with the smallest gap; the new states
+    are inserted before the first occurrence of the state above their gap, the states of the
+    pattern keep their order and repetitions)
+    """
+    reach = (max_recirculations+1) * max_padding_bytes
+    assert reach > 0, "no padding bytes"
+    added = {}
+    smallest_packet = min_packet_size
+    for size in sorted(set(pattern)):
+        while size - padding_meta_len - smallest_packet > reach:
+            added.setdefault(size, []).append(smallest_packet + padding_meta_len + reach)
+            smallest_packet = added[size][-1] - padding_meta_len + 1
+        smallest_packet = size - padding_meta_len + 1
+
+    result = []
+    for size in pattern:
+        result += added.pop(size, [])
+        result.append(size)
+    return result
+
+
+class PadOptimizer(object):
+
+    def __init__(self, pad_sizes=PAD_SIZES, max_headers=64, max_bytes=1600):
+        """
+        Args:
+            pad_sizes (list): available sizes of padding headers
+            max_headers (int): maximum number of padding headers
+            max_bytes (int): stop increasing the number of bytes beyond this value (e.g., MTU)
+        """
+        self.pad_sizes = sorted(pad_sizes)
+        self.max_headers = max_headers
+        self.max_bytes = max_bytes
+        self.__solve()
+
+    def __solve(self):
+        """
+        dynamic program over the pad sizes (smallest first).
+        reachable[tables][headers, r] is True if the pads (with the given number of
+        padding tables and headers) can add any number of bytes up to exactly r.
+        The number of pads of each size is stored to reconstruct the solutions.
+        """
+        num_tables = len(self.pad_sizes)
+        length = self.max_bytes + 2*max(self.pad_sizes)
+
+        reachable = np.zeros((num_tables+1, self.max_headers+1, length), dtype=bool)
+        reachable[0,0,0] = True
+        self.choices = []
+
+        for p in self.pad_sizes:
+            # do not use this pad size
+            new_reachable = reachable.copy()
+            choices = np.where(reachable, 0, -1).astype(np.int16)
+
+            # use n pads of this size (only if the smaller pads fill the gaps)
+            src = reachable.copy()
+            src[:,:,:p-1] = False
+            src[:,:,self.max_bytes:] = False
+
+            for n in range(1, min(self.max_headers, (length-1)//p) + 1):
+                shifted = np.zeros(reachable.shape, dtype=bool)
+                shifted[1:,n:,n*p:] = src[:-1,:-n,:length-n*p]
+                new = shifted & ~new_reachable
+                new_reachable |= new
+                choices[new] = n
+
+            reachable = new_reachable
+            self.choices.append(choices)
+
+        self.reachable = reachable
+
+    def __reconstruct(self, tables, headers, reach):
+        """returns the number of pads of each size for a solution"""
+        num_pads = {}
+        for (p, choices) in reversed(list(zip(self.pad_sizes, self.choices))):
+            n = int(choices[tables, headers, reach])
+            num_pads[p] = n
+            headers -= n
+            tables -= 1 if n > 0 else 0
+            reach -= n*p
+        return num_pads
+
+    def optimize(self, required_bytes, phv_budget=PHV_BUDGET_BITS):
+        """returns the cheapest pad configuration within the PHV budget which can add at least
+        required_bytes (fewest headers, then fewest tables, then fewest bytes/PHV bits)
+
+        Returns:
+            dict: pad size -> number of pads
+        """
+        feasible = self.reachable[:,:,required_bytes:]
+        for headers in range(self.max_headers+1):
+            for tables in range(feasible.shape[0]):
+                reach = np.nonzero(feasible[tables, headers])[0]
+                # (the PHV bits grow with the bytes, the fewest bytes fit best)
+                if len(reach) > 0:
+                    num_pads = self.__reconstruct(tables, headers, int(reach[0]) + required_bytes)
+                    if phv_usage(num_pads) <= phv_budget:
+                        return num_pads
+
+        raise ValueError("cannot add %i bytes with at most %i padding headers in %i PHV bits" % (required_bytes, self.max_headers, phv_budget))
+
+    def optimize_bounded(self, patterns, padding_meta_len, max_recirculations=0, phv_budget=PHV_BUDGET_BITS, min_packet_size=MIN_PACKET_SIZE):
+        """
+        returns the pads for which no packet of the patterns needs more than max_recirculations
+        recirculations. If these pads exceed the PHV budget (or max_headers), the pads with the
+        largest MAX_PADDING_BYTES within the budget are used and states are added to the patterns.
+
+        Args:
+            patterns (list): patterns which share the pads (e.g., the links and traffic classes of a device)
+
+        Returns:
+            (dict, list): pad size -> number of pads, patterns (with additional states if needed)
+        """
+        required_bytes = max([required_padding_bytes(p, padding_meta_len, min_packet_size) for p in patterns])
+        try:
+            num_pads = self.optimize(bounded_padding_bytes(required_bytes, max_recirculations), phv_budget)
+            return (num_pads, [list(p) for p in patterns])
+        except ValueError:
+            pass
+
+        fitting = [point for point in self.tradeoff_curve() if phv_usage(point["num_pads"]) <= phv_budget]
+        if not fitting:
+            raise ValueError("no padding headers fit in %i PHV bits" % phv_budget)
+        best = max(fitting, key=lambda point: (point["max_padding_bytes"], -point["headers"]))
+        patterns = [split_states(p, best["max_padding_bytes"], padding_meta_len, max_recirculations, min_packet_size) for p in patterns]
+        return (best["num_pads"], patterns)
+
+    def tradeoff_curve(self):
+        """
+        returns the largest MAX_PADDING_BYTES for each number of padding headers
+
+        Returns:
+            list of dicts: headers, tables, phv_bits, max_padding_bytes, num_pads
+        """
+        curve = []
+        for headers in range(1, self.max_headers+1):
+            best = None
+            for tables in range(self.reachable.shape[0]):
+                reach = np.nonzero(self.reachable[tables, headers])[0]
+                if len(reach) > 0 and (best is None or reach[-1] > best[1]):
+                    best = (tables, int(reach[-1]))
+            if best is None:
+                continue
+            (tables, reach) = best
+            curve.append({
+                "headers"           : headers,
+                "tables"            : tables,
+                "phv_bits"          : reach * 8,
+                "max_padding_bytes" : reach,
+                "num_pads"          : self.__reconstruct(tables, headers, reach),
+            })
+            if reach >= self.max_bytes:
+                break
+        return curve
+
+
+def phv_usage(num_pads):
+    """returns the estimated PHV usage (in bits) of the program with the given pads"""
+    return PHV_FIXED_BITS + sum([n*pad_header_bits(p) for (p,n) in num_pads.items()])
+
+
+def format_num_pads(num_pads):
+    return ", ".join(["%ix%iB" % (num_pads[p], p) for p in sorted(num_pads, reverse=True) if num_pads[p] > 0])
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args ([str]): command line parameters as list of strings
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="volume obfuscation padding header optimizer")
+
+    parser.add_argument(
+        "--pattern",
+        type=int,
+        nargs="+",
+        required=True,
+        help="pattern sizes")
+
+    parser.add_argument(
+        "--min-packet-size",
+        type=int,
+        default=MIN_PACKET_SIZE,
+        help="size of the smallest production packet")
+
+    parser.add_argument(
+        "--max-headers",
+        type=int,
+        default=64,
+        help="maximum number of padding headers")
+
+    parser.add_argument(
+        "--phv-budget",
+        type=int,
+        default=PHV_BUDGET_BITS,
+        help="number of PHV bits available")
+
+    parser.add_argument(
+        "--recirculation-bound",
+        type=int,
+        default=None,
+        help="allow up to this many recirculations of a packet and keep the pads within the PHV budget (states are added to the pattern if needed)")
+
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="write the pad configuration and the trade-off curve to this JSON file")
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="store_const",
+        const=logging.INFO)
+
+    parser.add_argument(
+        "-vv",
+        "--very-verbose",
+        dest="loglevel",
+        help="set loglevel to DEBUG",
+        action="store_const",
+        const=logging.DEBUG)
+
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+
+    from generate_code import PatternCodeGenerator
+    constants = PatternCodeGenerator.DEFAULT_CONSTANTS
+
+    required_bytes = required_padding_bytes(args.pattern, constants["PADDING_META_LEN"], args.min_packet_size)
+    log.info("pattern %s requires up to %i padding bytes" % (args.pattern, required_bytes))
+
+    optimizer = PadOptimizer(max_headers=args.max_headers, max_bytes=constants["MTU"])
+
+    log.info("trade-off curve:")
+    curve = optimizer.tradeoff_curve()
+    for point in curve:
+        log.info("%3i headers, %i tables, %5i PHV bits: MAX_PADDING_BYTES %4i (%s)%s" \
+            % (point["headers"], point["tables"], point["phv_bits"], point["max_padding_bytes"], format_num_pads(point["num_pads"]),
+               " exceeds PHV budget" if phv_usage(point["num_pads"]) > args.phv_budget else ""))
+
+    default_pads = {p: constants["NUM_%iB_PADS"%p] for p in PatternCodeGenerator.DEFAULT_PADS}
+    log.info("default: %s (%i headers, MAX_PADDING_BYTES %i, PHV %i/%i bits)" \
+        % (format_num_pads(default_pads), sum(default_pads.values()), max_padding_bytes(default_pads), phv_usage(default_pads), args.phv_budget))
+    log.info("default: %s" % format_distribution(recirculation_distribution(
+        args.pattern, max_padding_bytes(default_pads), constants["PADDING_META_LEN"], constants["MTU"], args.min_packet_size)))
+
+    try:
+        if args.recirculation_bound is None:
+            (num_pads, pattern) = (optimizer.optimize(required_bytes, args.phv_budget), args.pattern)
+        else:
+            (num_pads, (pattern,)) = optimizer.optimize_bounded([args.pattern], constants["PADDING_META_LEN"], args.recirculation_bound, args.phv_budget, args.min_packet_size)
+    except ValueError as e:
+        log.error("%s (--recirculation-bound adds states to the pattern instead)" % e)
+        sys.exit(1)
+    log.info("optimized: %s (%i headers, MAX_PADDING_BYTES %i, PHV %i/%i bits)" \
+        % (format_num_pads(num_pads), sum(num_pads.values()), max_padding_bytes(num_pads), phv_usage(num_pads), args.phv_budget))
+    if args.recirculation_bound is not None and pattern != list(args.pattern):
+        log.warning("the pads for at most %i recirculations do not fit in the PHV budget, pattern with additional states: %s" % (args.recirculation_bound, pattern))
+    distribution = recirculation_distribution(pattern, max_padding_bytes(num_pads), constants["PADDING_META_LEN"], constants["MTU"], args.min_packet_size)
+    log.info("optimized: %s" % format_distribution(distribution))
+
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump({"num_pads": num_pads, "required_bytes": required_bytes, "tradeoff_curve": curve,
+                       "pattern": pattern, "recirculations": distribution}, outfile)
+
+
+def run():
+    """Entry point for console_scripts
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
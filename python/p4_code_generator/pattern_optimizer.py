@@ -0,0 +1,354 @@
+"""
+script to find a pattern for a given production traffic mix.
+usage:
+python pattern_optimizer.py --traffic production.pcap -v
+
+The traffic is given as a pcap file or as a packet size histogram (see traffic_trace.py).
+Candidate patterns are scored with the following metrics:
+
+* capacity: fraction of the link bandwidth which is available for production traffic
+  (all states are sent at the same packet rate, so the state which receives
+  the largest share of production packets limits the throughput)
+* padding_overhead: fraction of the bytes of obfuscated production packets which are padding
+* chaff_share: fraction of the bytes on the link which are chaff when the link is saturated
+* recirculations: expected number of recirculations per production packet
+* drop_share: fraction of production packets which are too big for the pattern
+"""
+
+import os, sys, time
+import argparse
+import itertools
+import json
+import logging
+
+import numpy as np
+
+from traffic_trace import load_packet_sizes, size_histogram
+
+
+def setup_logging(loglevel="DEBUG"):
+    """Setup basic logging
+
+    Args:
+      loglevel (int): minimum loglevel for emitting messages
+    """
+    logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
+    logging.basicConfig(level=loglevel, stream=sys.stdout,
+                        format=logformat, datefmt="%Y-%m-%d %H:%M:%S")
+
+log = logging.getLogger(__name__)
+
+
+class PatternOptimizer(object):
+
+    # number of candidate patterns which are evaluated at once
+    BATCH_SIZE = 100000
+
+    def __init__(self, sizes, counts, mtu, padding_meta_len, max_padding_bytes):
+        """
+        Args:
+            sizes (numpy.ndarray): packet sizes of the production traffic
+            counts (numpy.ndarray): number of packets for each entry in sizes
+            mtu (int): maximum size of an obfuscated packet
+            padding_meta_len (int): length of the padding_meta header
+            max_padding_bytes (int): number of bytes which can be added without recirculation
+        """
+        self.mtu = mtu
+        self.padding_meta_len = padding_meta_len
+        self.max_padding_bytes = max_padding_bytes
+
+        sizes = np.minimum(np.asarray(sizes, dtype=np.int64), mtu+1) # packets > MTU end up in the last bin
+        self.histogram = size_histogram(sizes, counts, mtu+1)
+        self.num_packets = self.histogram.sum()
+
+        self.cum_counts = np.concatenate(([0.], np.cumsum(self.histogram)))
+        self.cum_bytes = np.concatenate(([0.], np.cumsum(self.histogram * np.arange(mtu+2))))
+        self.cum_recirculations = {}
+
+        # largest pattern size which is needed to carry all packets (that fit into the MTU)
+        served_sizes = np.nonzero(self.histogram[:mtu+1])[0]
+        if len(served_sizes) == 0:
+            raise ValueError("no packets with size <= MTU in the traffic")
+        self.max_size = int(min(served_sizes.max() + padding_meta_len, mtu))
+
+    def __recirculation_cumsum(self, target_size):
+        """
+        returns the cumulative number of recirculations for packets in state target_size
+        (index x+1: recirculations of all packets with size <= x)
+        """
+        if target_size not in self.cum_recirculations:
+            bytes_to_add = target_size - self.padding_meta_len - np.arange(self.mtu+2)
+            recirculations = np.where(bytes_to_add > 0, (bytes_to_add-1) // self.max_padding_bytes, 0)
+            self.cum_recirculations[target_size] = np.concatenate(([0.], np.cumsum(self.histogram * recirculations)))
+        return self.cum_recirculations[target_size]
+
+    def evaluate_batch(self, patterns):
+        """scores many patterns at once
+
+        Args:
+            patterns (numpy.ndarray): one sorted pattern (without duplicates) per row
+
+        Returns:
+            dict: one array per metric
+        """
+        patterns = np.asarray(patterns, dtype=np.int64)
+        previous = np.concatenate((np.zeros((len(patterns),1), dtype=np.int64), patterns[:,:-1]), axis=1)
+
+        # range of packet sizes (totalLen) for each state, see generate_cli_assign_queue
+        upper = np.clip(patterns - self.padding_meta_len, -1, self.mtu+1) + 1
+        lower = np.where(previous > 0, np.clip(previous - self.padding_meta_len, -1, self.mtu+1) + 1, 0)
+
+        counts = self.cum_counts[upper] - self.cum_counts[lower]
+        orig_bytes = self.cum_bytes[upper] - self.cum_bytes[lower]
+
+        recirculations = np.zeros(patterns.shape)
+        for target_size in np.unique(patterns):
+            mask = patterns == target_size
+            cum = self.__recirculation_cumsum(int(target_size))
+            recirculations[mask] = cum[upper[mask]] - cum[lower[mask]]
+
+        served = counts.sum(axis=1)
+        served_nonzero = np.maximum(served, 1e-12)
+        padded_bytes = (counts * patterns).sum(axis=1)
+        pattern_bytes = patterns.sum(axis=1)
+        max_share = counts.max(axis=1) / served_nonzero
+
+        return {
+            "capacity"          : orig_bytes.sum(axis=1) / served_nonzero / (pattern_bytes * np.maximum(max_share, 1e-12)),
+            "padding_overhead"  : 1 - orig_bytes.sum(axis=1) / np.maximum(padded_bytes, 1e-12),
+            "chaff_share"       : 1 - padded_bytes / np.maximum(counts.max(axis=1) * pattern_bytes, 1e-12),
+            "recirculations"    : recirculations.sum(axis=1) / served_nonzero,
+            "drop_share"        : 1 - served / self.num_packets,
+        }
+
+    def evaluate(self, pattern):
+        """returns the metrics (dict) of a single pattern"""
+        pattern = sorted(set(pattern))
+        metrics = self.evaluate_batch(np.array([pattern]))
+        result = {k: float(v[0]) for (k,v) in metrics.items()}
+        result["pattern"] = pattern
+        return result
+
+    def candidate_sizes(self, num_candidates):
+        """
+        returns candidate pattern sizes.
+        A pattern size is only useful if it is exactly as big as a packet (plus padding_meta),
+        otherwise it could be reduced without any disadvantage.
+        If there are more than num_candidates such sizes, we use size quantiles
+        (half of the candidates) and evenly spaced sizes (the other half).
+        """
+        sizes = np.nonzero(self.histogram[:self.mtu+1])[0] + self.padding_meta_len
+        sizes = sizes[sizes < self.max_size]
+
+        if num_candidates is not None and len(sizes) > num_candidates - 1:
+            weights = self.histogram[sizes - self.padding_meta_len]
+            quantiles = np.cumsum(weights) / weights.sum()
+            levels = np.linspace(0, 1, num_candidates//2 + 1)[:-1]
+            by_quantile = np.minimum(np.searchsorted(quantiles, levels), len(sizes)-1)
+            evenly_spaced = np.linspace(0, len(sizes)-1, num_candidates - 1 - len(np.unique(by_quantile))).astype(np.int64)
+            sizes = np.unique(sizes[np.concatenate((by_quantile, evenly_spaced))])
+
+        return np.concatenate((sizes, [self.max_size])).astype(np.int64)
+
+    def __better(self, metrics, best, max_recirculations):
+        """
+        returns the index of the best pattern in metrics or None if no pattern is better than best
+        """
+        feasible = np.ones(len(metrics["capacity"]), dtype=bool)
+        if max_recirculations is not None:
+            feasible &= metrics["recirculations"] <= max_recirculations
+        if not feasible.any():
+            return None
+
+        # highest capacity, ties are broken by the number of recirculations
+        score = np.where(feasible, metrics["capacity"] - 1e-9 * metrics["recirculations"], -np.inf)
+        i = int(np.argmax(score))
+        if best is None or score[i] > best["capacity"] - 1e-9 * best["recirculations"]:
+            return i
+        return None
+
+    def search(self, max_length, num_candidates=64, max_recirculations=None, refine=True):
+        """searches the best pattern with up to max_length states
+
+        Args:
+            max_length (int): maximum number of states in the pattern
+            num_candidates (int): number of candidate sizes for the exhaustive search
+            max_recirculations (float): upper bound for the expected number of recirculations per packet
+            refine (bool): improve the best pattern with all possible packet sizes
+
+        Returns:
+            dict: pattern and metrics of the best pattern
+        """
+        candidates = self.candidate_sizes(num_candidates)
+        best = None
+
+        for length in range(1, max_length+1):
+            combinations = itertools.combinations(candidates[:-1], length-1)
+            num_evaluated = 0
+            while True:
+                batch = list(itertools.islice(combinations, self.BATCH_SIZE))
+                if len(batch) == 0:
+                    break
+                patterns = np.array([c + (self.max_size,) for c in batch], dtype=np.int64)
+                metrics = self.evaluate_batch(patterns)
+                num_evaluated += len(patterns)
+
+                i = self.__better(metrics, best, max_recirculations)
+                if i is not None:
+                    best = {k: float(v[i]) for (k,v) in metrics.items()}
+                    best["pattern"] = [int(s) for s in patterns[i]]
+            log.debug("evaluated %i patterns of length %i" % (num_evaluated, length))
+
+        if best is None:
+            raise ValueError("no pattern satisfies the constraints")
+
+        if refine:
+            best = self.refine(best, max_recirculations)
+
+        return best
+
+    def refine(self, best, max_recirculations=None):
+        """
+        local search: move each state (except the largest) to all packet sizes
+        between its neighbours until the pattern does not improve anymore
+        """
+        all_sizes = self.candidate_sizes(None)
+
+        improved = True
+        while improved:
+            improved = False
+            pattern = best["pattern"]
+            for i in range(len(pattern)-1):
+                lower = pattern[i-1] if i > 0 else 0
+                options = all_sizes[(all_sizes > lower) & (all_sizes < pattern[i+1])]
+                if len(options) == 0:
+                    continue
+                patterns = np.tile(np.array(pattern, dtype=np.int64), (len(options),1))
+                patterns[:,i] = options
+                metrics = self.evaluate_batch(patterns)
+
+                j = self.__better(metrics, best, max_recirculations)
+                if j is not None:
+                    best = {k: float(v[j]) for (k,v) in metrics.items()}
+                    best["pattern"] = [int(s) for s in patterns[j]]
+                    improved = True
+                    break
+        return best
+
+
+def format_metrics(metrics):
+    return "pattern %s: capacity %.3f, padding overhead %.3f, chaff share %.3f, recirculations/packet %.3f, dropped %.4f" \
+        % (metrics["pattern"], metrics["capacity"], metrics["padding_overhead"], metrics["chaff_share"], metrics["recirculations"], metrics["drop_share"])
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args ([str]): command line parameters as list of strings
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="volume obfuscation pattern optimizer")
+
+    parser.add_argument(
+        "--traffic",
+        type=str,
+        required=True,
+        help="pcap file or packet size histogram (.json or .csv) of the production traffic")
+
+    parser.add_argument(
+        "--max-length",
+        type=int,
+        default=4,
+        help="maximum number of states in the pattern")
+
+    parser.add_argument(
+        "--candidates",
+        type=int,
+        default=64,
+        help="number of candidate sizes in the exhaustive search")
+
+    parser.add_argument(
+        "--max-recirculations",
+        type=float,
+        default=None,
+        help="maximum expected number of recirculations per packet")
+
+    parser.add_argument(
+        "--compare",
+        type=int,
+        nargs="+",
+        default=None,
+        help="also evaluate this pattern")
+
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="write the best pattern and its metrics to this JSON file")
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="store_const",
+        const=logging.INFO)
+
+    parser.add_argument(
+        "-vv",
+        "--very-verbose",
+        dest="loglevel",
+        help="set loglevel to DEBUG",
+        action="store_const",
+        const=logging.DEBUG)
+
+    return parser.parse_args(args)
+
+
+def optimizer_for_generator(sizes, counts, constants, pads):
+    """
+    returns a PatternOptimizer with the MTU and padding configuration of PatternCodeGenerator
+
+    Args:
+        constants (dict): constants of the code generator
+        pads (list): sizes of the padding headers
+    """
+    max_padding_bytes = sum([p*constants["NUM_%iB_PADS"%p] for p in pads])
+
+    return PatternOptimizer(sizes, counts, constants["MTU"], constants["PADDING_META_LEN"], max_padding_bytes)
+
+
+def main(args):
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+
+    from generate_code import PatternCodeGenerator
+
+    sizes, counts = load_packet_sizes(args.traffic)
+    optimizer = optimizer_for_generator(sizes, counts, PatternCodeGenerator.DEFAULT_CONSTANTS, PatternCodeGenerator.DEFAULT_PADS)
+
+    start = time.time()
+    best = optimizer.search(args.max_length, args.candidates, args.max_recirculations)
+    log.info("search took %.2fs" % (time.time() - start))
+    log.info("best %s" % format_metrics(best))
+
+    if args.compare:
+        log.info("compared %s" % format_metrics(optimizer.evaluate(args.compare)))
+
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump(best, outfile)
+
+
+def run():
+    """Entry point for console_scripts
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
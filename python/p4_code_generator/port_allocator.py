@@ -0,0 +1,311 @@
+"""
+pipe-aware allocation of the priority queuing ports.
+usage:
+python port_allocator.py --device tofino1 -v
+python port_allocator.py --device tofino1 --pattern 533 1066 1600 --target-bw 100 --speeds 100 10 -v
+
+Obfuscated packets take the path
+input port -> (ingress) -> priority queuing port -> loopback -> (ingress) -> output port
+Every hop from the ingress pipe of a port to the egress pipe of a port on another pipe crosses
+pipes (latency and bandwidth of the shared crossbar). For every state of the pattern, the
+allocator chooses the queuing port (channel) with
+1. the fewest cross-pipe hops (input -> queuing port, loopback port -> output port),
+2. the least loaded pipe (share of the obfuscated traffic on the pipe's queuing ports),
+3. the configured order of the queuing ports.
+The pipes of the ports come from the lab configuration (pipe attribute of each port).
+
+Each state needs a channel which is at least as fast as its shaped rate. plan_loopback_ports
+chooses the speed (breakout mode) of the loopback pairs of queuing ports such that the pattern
+needs as few physical ports as possible (then as few channels as possible). Both ports of a
+loopback cable run in the same mode.
+"""
+
+import os, sys, time
+import argparse
+import itertools
+import logging
+
+sys.path.append("/".join(os.path.abspath(os.getcwd()).split("/")[:-2])) # append root directory to path
+
+from labsetup_public.src.get_config import get_config, port_name
+from queue_simulator import SHAPING_MARGIN
+
+
+def setup_logging(loglevel="DEBUG"):
+    """Setup basic logging
+
+    Args:
+      loglevel (int): minimum loglevel for emitting messages
+    """
+    logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
+    logging.basicConfig(level=loglevel, stream=sys.stdout,
+                        format=logformat, datefmt="%Y-%m-%d %H:%M:%S")
+
+log = logging.getLogger(__name__)
+
+# channels of a port for each speed (Gbps) and breakout mode
+SPEED_MODES = {
+    "tofino": {
+        100: [0],
+        50: [0, 2],
+        40: [0],
+        25: [0, 1, 2, 3],
+        10: [0, 1, 2, 3],
+    },
+    "tofino2": {
+        400: [0],
+        200: [0, 4],
+        100: [0, 2, 4, 6],
+        50: range(8),
+        25: range(8),
+        10: range(8),
+    },
+}
+
+# forward error correction for pm port-add (NONE otherwise)
+SPEED_FEC = {
+    "tofino": {},
+    "tofino2": {400: "RS", 200: "RS", 100: "RS", 50: "RS"},
+}
+
+
+def port_fec(chip, speed):
+    return SPEED_FEC[chip].get(speed, "NONE")
+
+
+def channels_fit(channel_speeds, demands):
+    """returns True if every demand (Gbps) gets its own channel which is at least as fast"""
+    (channel_speeds, demands) = (sorted(channel_speeds, reverse=True), sorted(demands, reverse=True))
+    return len(demands) <= len(channel_speeds) and all([d <= c for (d, c) in zip(demands, channel_speeds)])
+
+
+class PortAllocator(object):
+
+    def __init__(self, lab_config, device):
+        self.device = device
+        self.pipes = lab_config["index"]["pipe"][device]
+        self.peers = lab_config["index"]["peer"][device]
+
+    def pipe(self, port):
+        return self.pipes.get(port_name(port))
+
+    def loopback_peer(self, port):
+        """returns the port (same channel) at the other end of a loopback cable (the port itself without cable)"""
+        name = port_name(port)
+        (phys, channel) = name.split("/")
+        peer = self.peers.get(name) or self.peers.get("%s/-" % phys)
+        if peer is None or peer[0] != self.device:
+            return name
+        return "%s/%s" % (peer[1].split("/")[0], channel)
+
+    def cross_pipe_hops(self, port, input_port, output_port):
+        """returns the hops of a queuing port which cross pipes"""
+        hops = []
+        if self.pipe(input_port) != self.pipe(port):
+            hops.append("input %s (pipe %s) -> %s (pipe %s)" % (port_name(input_port), self.pipe(input_port), port_name(port), self.pipe(port)))
+        peer = self.loopback_peer(port)
+        if self.pipe(peer) != self.pipe(output_port):
+            hops.append("loopback %s (pipe %s) -> output %s (pipe %s)" % (peer, self.pipe(peer), port_name(output_port), self.pipe(output_port)))
+        return hops
+
+    def allocate(self, candidates, shares, input_port, output_port, speeds=None, demands=None, reserved=()):
+        """
+        Args:
+            candidates (list): port names of the queuing ports (channels) in the configured order
+            shares (list): share of the obfuscated traffic of each state
+            input_port: port of the unobfuscated traffic
+            output_port: port of the obfuscated traffic
+            speeds (dict): optional speed (Gbps) of each channel
+            demands (list): optional rate (Gbps) of each state (requires speeds)
+            reserved (list): rates (Gbps) which need a channel after the allocation (e.g., states of other links)
+
+        Returns:
+            (dict, list): state index -> port name, explanation (lines)
+        """
+        if len(shares) > len(candidates):
+            raise ValueError("not enough queueing ports available: have %i, need %i" % (len(candidates), len(shares)))
+        if demands is None:
+            (speeds, demands, reserved) = ({p: 0 for p in candidates}, [0] * len(shares), [0] * len(reserved))
+
+        load = {}
+        free = list(candidates)
+        assignment = {}
+        explanation = []
+        for (state, share) in enumerate(shares):
+            # only channels which leave a fast enough channel for each of the remaining states
+            fitting = [p for p in free if speeds[p] >= demands[state] and
+                       channels_fit([speeds[q] for q in free if q != p], demands[state + 1:len(shares)] + list(reserved))]
+            if not fitting:
+                raise ValueError("no channel for state %i (%.1f Gbps)" % (state, demands[state]))
+            port = min(fitting, key=lambda p: (len(self.cross_pipe_hops(p, input_port, output_port)), load.get(self.pipe(p), 0.), free.index(p)))
+            free.remove(port)
+            load[self.pipe(port)] = load.get(self.pipe(port), 0.) + share
+            assignment[state] = port
+
+            hops = self.cross_pipe_hops(port, input_port, output_port)
+            explanation.append((state, "state %i (%.0f%% of the traffic) -> %s (%spipe %s, loopback %s): %s" % (
+                state, 100. * share, port, "%iG, " % speeds[port] if speeds[port] else "", self.pipe(port), self.loopback_peer(port),
+                "crosses pipes: " + ", ".join(hops) if hops else "no cross-pipe hop")))
+
+        explanation = [line for (state, line) in explanation]
+        explanation.append("load per pipe: %s" % ", ".join(["pipe %s %.0f%%" % (p, 100. * l) for (p, l) in sorted(load.items())]))
+        return (assignment, explanation)
+
+    def loopback_pairs(self, ports):
+        """groups the queuing ports (physical port numbers) into loopback pairs (in the configured order)"""
+        pairs = []
+        for port in ports:
+            if any([port in pair for pair in pairs]):
+                continue
+            peer = int(self.loopback_peer(port).split("/")[0])
+            pairs.append((port, peer) if peer != port and peer in ports else (port,))
+        return pairs
+
+    def modes(self, port, speeds, chip):
+        """returns the speeds of a port (fastest first) whose channels exist in the lab configuration"""
+        return [s for s in sorted(speeds, reverse=True)
+                if s in SPEED_MODES[chip] and all(["%i/%i" % (port, c) in self.pipes for c in SPEED_MODES[chip][s]])]
+
+    def plan_loopback_ports(self, ports, demands, speeds, chip="tofino"):
+        """
+        chooses the loopback pairs and their speeds with the fewest physical ports (then channels)
+
+        Args:
+            ports (list): physical ports for priority queuing (in the configured order)
+            demands (list): rate (Gbps) of each state
+            speeds (list): allowed speeds (Gbps)
+            chip (string): key of SPEED_MODES
+
+        Returns:
+            (dict, dict): physical port -> speed, channel (port name) -> speed
+        """
+        pairs = self.loopback_pairs(ports)
+        best = None
+        for k in range(1, len(pairs) + 1):
+            modes = [m for m in sorted(set(speeds), reverse=True) if all([m in self.modes(p, speeds, chip) for pair in pairs[:k] for p in pair])]
+            for combination in itertools.combinations_with_replacement(modes, k):
+                channels = {}
+                for (pair, speed) in zip(pairs[:k], combination):
+                    for port in pair:
+                        channels.update({"%i/%i" % (port, c): speed for c in SPEED_MODES[chip][speed]})
+                if not channels_fit(channels.values(), demands):
+                    continue
+                cost = (sum([len(pair) for pair in pairs[:k]]), len(channels))
+                if best is None or cost < best[0]:
+                    best = (cost, {port: speed for (pair, speed) in zip(pairs[:k], combination) for port in pair}, channels)
+        if best is None:
+            raise ValueError("the queuing ports %s cannot carry %s Gbps with speeds %s" % (ports, ", ".join(["%.1f" % d for d in demands]), sorted(speeds)))
+        return (best[1], best[2])
+
+    def check_fixed_ports(self, port_configuration):
+        """returns warnings for the cabled ports of the hot path on different pipes (input, output, recirculation)"""
+        warnings = []
+        input_port = port_configuration["input"][0]
+        for role in ["output", "recirculation"]:
+            if role in port_configuration and self.pipe(port_configuration[role]) != self.pipe(input_port):
+                warnings.append("%s port %s (pipe %s) is not on the pipe of input port %s (pipe %s)" % (
+                    role, port_name(port_configuration[role]), self.pipe(port_configuration[role]), port_name(input_port), self.pipe(input_port)))
+        return warnings
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args ([str]): command line parameters as list of strings
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="volume obfuscation pipe-aware port allocation")
+
+    parser.add_argument(
+        "--device",
+        type=str,
+        required=True,
+        help="device in the fleet file")
+
+    parser.add_argument(
+        "--fleet",
+        type=str,
+        default="fleet.yaml",
+        help="fleet file with the port roles (see fleet.py)")
+
+    parser.add_argument(
+        "--pattern",
+        type=int,
+        nargs="+",
+        default=[533, 1066, 1600],
+        help="pattern (one queuing port per state)")
+
+    parser.add_argument(
+        "--target-bw",
+        type=int,
+        default=100,
+        help="rate of the obfuscated traffic (Gbps)")
+
+    parser.add_argument(
+        "--speeds",
+        type=int,
+        nargs="+",
+        default=None,
+        help="allowed speeds of the queuing ports (Gbps, default: all speeds of the chip)")
+
+    parser.add_argument(
+        "--chip",
+        type=str,
+        choices=sorted(SPEED_MODES),
+        default="tofino",
+        help="chip of the device")
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="store_const",
+        const=logging.INFO)
+
+    parser.add_argument(
+        "-vv",
+        "--very-verbose",
+        dest="loglevel",
+        help="set loglevel to DEBUG",
+        action="store_const",
+        const=logging.DEBUG)
+
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+
+    import fleet
+    logging.getLogger('labsetup_public.src.get_config').setLevel(level=logging.ERROR)
+    lab_config = get_config(fleet.LAB_CONFIG_DIRECTORY)
+    port_configuration = fleet.device_configurations(fleet.load_fleet(args.fleet), lab_config, args.pattern)[args.device]
+
+    allocator = PortAllocator(lab_config, args.device)
+    for warning in allocator.check_fixed_ports(port_configuration):
+        log.warning(warning)
+    shares = [s * 1. / sum(args.pattern) for s in args.pattern]
+    demands = [args.target_bw * share * (1 - SHAPING_MARGIN) for share in shares]
+    (port_speeds, channel_speeds) = allocator.plan_loopback_ports(port_configuration["priorityqueuing_out"], demands,
+                                                                  args.speeds or SPEED_MODES[args.chip].keys(), args.chip)
+    log.info("queuing ports: %s" % ", ".join(["%i/- %iG" % (p, s) for (p, s) in sorted(port_speeds.items())]))
+    candidates = sorted(channel_speeds, key=lambda p: (port_configuration["priorityqueuing_out"].index(int(p.split("/")[0])), p))
+    (assignment, explanation) = allocator.allocate(candidates, shares, port_configuration["input"][0], port_configuration["output"], channel_speeds, demands)
+    for line in explanation:
+        log.info(line)
+
+
+def run():
+    """Entry point for console_scripts
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,506 @@
+"""
+queueing model of the priority/round-robin queue design.
+usage:
+python queue_simulator.py --info ../../p4/traffic_pattern_tofino/pd_rpc_info_tofino1.json \
+    --traffic production.pcap --load 40 --packets 100000000 -v
+
+Each state has its own priority queuing port (see init_pd_rpc.py): production packets
+(qid 1) have strict priority over chaff packets (qid 0) and the port is shaped to
+TARGET_BW * size / sum(pattern) * (1 - SHAPING_MARGIN), i.e. all states send the same
+number of packets per second. As long as chaff is available, the port sends one packet
+of the state's size every period; a production packet waits for the next free
+transmission slot (the packet in transmission is not preempted). The departure slot of
+the n-th production packet of a state therefore follows
+    k_n = max(ceil(a_n / T), k_(n-1) + 1) = n + max_(j<=n) (ceil(a_j / T) - j)
+which is computed with numpy for large blocks of packets. When a priority queue
+overflows, the blocks are shortened around the dropped packets.
+The shaped rates add up to less than TARGET_BW, so the round-robin queues only add
+the serialization delay at TARGET_BW.
+"""
+
+import os, sys, time
+import argparse
+import json
+import logging
+
+import numpy as np
+
+from traffic_trace import load_trace, load_packet_sizes
+
+
+def setup_logging(loglevel="DEBUG"):
+    """Setup basic logging
+
+    Args:
+      loglevel (int): minimum loglevel for emitting messages
+    """
+    logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
+    logging.basicConfig(level=loglevel, stream=sys.stdout,
+                        format=logformat, datefmt="%Y-%m-%d %H:%M:%S")
+
+log = logging.getLogger(__name__)
+
+# safety margin of the shaping rate (see init_pd_rpc.py)
+SHAPING_MARGIN = .01
+
+# added latency histogram: 1ns bins up to 10ms
+LATENCY_BIN = 1e-9
+LATENCY_BINS = 10000000
+
+
+class ShapedQueue(object):
+    """
+    priority queuing port of one state
+    """
+
+    # fall back to a scalar loop if the queue overflows within this many packets
+    MIN_BLOCK = 64
+
+    def __init__(self, size, rate, buffer_packets, phase=0.):
+        """
+        Args:
+            size (int): packet size of the state
+            rate (float): shaping rate in bits per second
+            buffer_packets (int): number of production packets the queue can hold
+            phase (float): time of the first transmission slot
+        """
+        self.size = size
+        self.period = size * 8. / rate
+        self.buffer_packets = buffer_packets
+        self.phase = phase
+
+        # slot of the last production packet (far in the past before the first packet)
+        self.last_slot = -2**62
+        self.sent = 0
+        self.dropped = 0
+
+    def slots(self, start, end):
+        """returns the number of transmission slots in [start, end]"""
+        return int(np.floor((end - self.phase) / self.period) - np.ceil((start - self.phase) / self.period) + 1)
+
+    def __block(self, earliest, current, last):
+        """
+        departure slots of a block of packets without drops
+
+        Returns:
+            (numpy.ndarray, int): departure slots and index of the first packet that finds the queue full (-1 if none)
+        """
+        idx = np.arange(len(earliest), dtype=np.int64)
+        slots = idx + np.maximum(last + 1, np.maximum.accumulate(earliest - idx))
+
+        # number of packets in the queue (incl. the packet in transmission) at each arrival
+        previous = np.concatenate(([last], slots[:-1]))
+        overflow = np.nonzero(previous - current + 1 >= self.buffer_packets)[0]
+        return slots, (int(overflow[0]) if len(overflow) > 0 else -1)
+
+    def __scalar(self, earliest, current, slots, accepted, start, end):
+        """processes packets start..end-1 one by one"""
+        last = self.last_slot
+        for i in range(start, end):
+            if last - current[i] + 1 >= self.buffer_packets:
+                accepted[i] = False
+            else:
+                last = max(earliest[i], last + 1)
+                slots[i] = last
+        self.last_slot = last
+
+    def process(self, arrivals):
+        """
+        Args:
+            arrivals (numpy.ndarray): sorted arrival times of production packets at the queue
+
+        Returns:
+            (numpy.ndarray, numpy.ndarray): departure times (end of transmission) and a mask of the accepted packets
+        """
+        n = len(arrivals)
+        x = (arrivals - self.phase) / self.period
+        earliest = np.ceil(x).astype(np.int64)
+        current = np.floor(x).astype(np.int64)
+
+        slots = np.zeros(n, dtype=np.int64)
+        accepted = np.ones(n, dtype=bool)
+
+        start = 0
+        window = 65536
+        while start < n:
+            end = min(start + window, n)
+            if window <= self.MIN_BLOCK:
+                # the queue is overloaded: drops are too frequent for numpy blocks
+                end = min(start + 4096, n)
+                self.__scalar(earliest, current, slots, accepted, start, end)
+                start = end
+                window = 65536
+                continue
+
+            block, overflow = self.__block(earliest[start:end], current[start:end], self.last_slot)
+            if overflow < 0:
+                slots[start:end] = block
+                self.last_slot = int(block[-1])
+                start = end
+                window *= 2
+            else:
+                slots[start:start+overflow] = block[:overflow]
+                if overflow > 0:
+                    self.last_slot = int(block[overflow-1])
+                accepted[start+overflow] = False
+                start += overflow + 1
+                window = max(2 * overflow, self.MIN_BLOCK)
+
+        self.sent += int(accepted.sum())
+        self.dropped += int(n - accepted.sum())
+        departures = (slots + 1) * self.period + self.phase
+        return departures, accepted
+
+
+class QueueSimulator(object):
+
+    def __init__(self, info, buffer_bytes=100000, pipeline_latency=0., seed=0):
+        """
+        Args:
+            info (dict): content of pd_rpc_info_<device>.json
+            buffer_bytes (int): buffer of each priority queue
+            pipeline_latency (float): latency of one pass through the pipeline (added for each recirculation)
+            seed (int): seed for the phases of the shaped ports
+        """
+        self.pattern = info["config"]["pattern_sequence"]
+        self.constants = info["constants"]
+        self.bandwidth = self.constants.get("TARGET_BW", 100) * 1e9
+        self.pipeline_latency = pipeline_latency
+
+        rng = np.random.RandomState(seed)
+        self.queues = []
+        for size in self.pattern:
+            rate = self.bandwidth / sum(self.pattern) * size * (1 - SHAPING_MARGIN)
+            queue = ShapedQueue(size, rate, max(buffer_bytes // size, 1))
+            queue.phase = rng.uniform(0, queue.period)
+            self.queues.append(queue)
+
+        # the first state with a size wins (lowest priority value in assign_to_queue)
+        self.sorted_sizes = sorted(set(self.pattern))
+        self.size_to_state = {size: self.pattern.index(size) for size in self.sorted_sizes}
+
+        self.latency_histogram = np.zeros(LATENCY_BINS, dtype=np.int64)
+        self.packets = 0
+        self.too_big = 0
+        self.recirculations = 0
+        self.input_bytes = 0
+        self.start = None
+        self.end = None
+
+    def assign_states(self, sizes):
+        """
+        returns the state index (-1 for packets which are too big) and the number of recirculations of each packet
+        """
+        META = self.constants["PADDING_META_LEN"]
+        thresholds = np.array([s - META for s in self.sorted_sizes])
+        index = np.searchsorted(thresholds, sizes)
+
+        too_big = index >= len(self.sorted_sizes)
+        target = np.array(self.sorted_sizes + [0])[index]
+        state = np.array([self.size_to_state[s] for s in self.sorted_sizes] + [-1])[index]
+
+        bytes_to_add = np.where(too_big, 0, target - sizes - META)
+        recirculations = np.where(bytes_to_add > 0, (bytes_to_add - 1) // self.constants["MAX_PADDING_BYTES"], 0)
+        return state, recirculations
+
+    def process(self, timestamps, sizes):
+        """
+        simulates a chunk of production packets (timestamps must be sorted and
+        later than the timestamps of the previous chunk)
+        """
+        if len(timestamps) == 0:
+            return
+        if self.start is None:
+            self.start = timestamps[0]
+        self.end = timestamps[-1]
+
+        state, recirculations = self.assign_states(sizes)
+        self.packets += len(sizes)
+        self.too_big += int((state < 0).sum())
+        self.recirculations += int(recirculations.sum())
+        self.input_bytes += int(sizes.sum())
+
+        for (state_index, queue) in enumerate(self.queues):
+            in_state = np.nonzero(state == state_index)[0]
+            if len(in_state) == 0:
+                continue
+
+            arrivals = timestamps[in_state] + recirculations[in_state] * self.pipeline_latency
+            if self.pipeline_latency > 0:
+                order = np.argsort(arrivals, kind="mergesort")
+                in_state, arrivals = in_state[order], arrivals[order]
+
+            departures, accepted = queue.process(arrivals)
+
+            # round-robin queue: serialization of the padded packet instead of the original packet
+            latency = departures[accepted] - timestamps[in_state][accepted] \
+                + (queue.size - sizes[in_state][accepted]) * 8. / self.bandwidth
+            bins = np.minimum((latency / LATENCY_BIN).astype(np.int64), LATENCY_BINS - 1)
+            self.latency_histogram += np.bincount(bins, minlength=LATENCY_BINS)
+
+    def percentile(self, q):
+        """returns the q-th percentile of the added latency (seconds)"""
+        cumulative = np.cumsum(self.latency_histogram)
+        if cumulative[-1] == 0:
+            return 0.
+        return np.searchsorted(cumulative, q / 100. * cumulative[-1]) * LATENCY_BIN
+
+    def report(self):
+        duration = max(self.end - self.start, 1e-9) if self.start is not None else 1e-9
+        delivered = int(self.latency_histogram.sum())
+        dropped = sum([q.dropped for q in self.queues])
+
+        states = []
+        chaff_bits = 0.
+        for queue in self.queues:
+            slots = queue.slots(self.start, self.end) if self.start is not None else 0
+            chaff = max(slots - queue.sent, 0)
+            chaff_bits += chaff * queue.size * 8.
+            states.append({
+                "size"          : queue.size,
+                "sent"          : queue.sent,
+                "dropped"       : queue.dropped,
+                "utilization"   : queue.sent * 1. / slots if slots > 0 else 0.,
+                "chaff_pps"     : chaff / duration,
+            })
+
+        bins = np.arange(LATENCY_BINS) * LATENCY_BIN
+        return {
+            "packets"           : self.packets,
+            "too_big"           : self.too_big,
+            "dropped"           : dropped,
+            "drop_rate"         : (dropped + self.too_big) * 1. / max(self.packets, 1),
+            "recirculations"    : self.recirculations,
+            "load_gbps"         : self.input_bytes * 8. / duration / 1e9,
+            "chaff_gbps"        : chaff_bits / duration / 1e9,
+            "latency_mean"      : float((self.latency_histogram * bins).sum()) / max(delivered, 1),
+            "latency_p50"       : self.percentile(50),
+            "latency_p99"       : self.percentile(99),
+            "latency_p999"      : self.percentile(99.9),
+            "latency_max"       : float(np.nonzero(self.latency_histogram)[0][-1]) * LATENCY_BIN if delivered > 0 else 0.,
+            "states"            : states,
+        }
+
+
+def saturation_load(info, sizes, counts):
+    """
+    returns the production load (Gbps of original packets) at which
+    the priority queue of one of the states is saturated
+    """
+    pattern = info["config"]["pattern_sequence"]
+    simulator = QueueSimulator(info)
+    state, _ = simulator.assign_states(np.asarray(sizes))
+    counts = np.asarray(counts, dtype=np.float64)
+    counts = counts[state >= 0]
+    shares = np.bincount(state[state >= 0], weights=counts, minlength=len(pattern)) / counts.sum()
+    mean_size = (np.asarray(sizes)[state >= 0] * counts).sum() / counts.sum()
+
+    packet_rate = min([1. / q.period / share for (q, share) in zip(simulator.queues, shares) if share > 0])
+    return packet_rate * mean_size * 8 / 1e9
+
+
+def poisson_chunks(sizes, counts, load_gbps, num_packets, chunk_size, seed=0):
+    """
+    generates Poisson arrivals with the given packet size distribution in chunks
+
+    Yields:
+        (numpy.ndarray, numpy.ndarray): timestamps and sizes
+    """
+    rng = np.random.RandomState(seed)
+    probabilities = np.asarray(counts, dtype=np.float64) / np.sum(counts)
+    mean_size = (np.asarray(sizes) * probabilities).sum()
+    packet_rate = load_gbps * 1e9 / (8 * mean_size)
+
+    now = 0.
+    generated = 0
+    while generated < num_packets:
+        n = min(chunk_size, num_packets - generated)
+        timestamps = now + np.cumsum(rng.exponential(1. / packet_rate, size=n))
+        yield timestamps, rng.choice(sizes, size=n, p=probabilities)
+        now = timestamps[-1]
+        generated += n
+
+
+def trace_chunks(timestamps, sizes, chunk_size, load_gbps=None):
+    """
+    splits a trace into chunks (optionally rescaling the inter-arrival times to the given load)
+
+    Yields:
+        (numpy.ndarray, numpy.ndarray): timestamps and sizes
+    """
+    order = np.argsort(timestamps, kind="mergesort")
+    timestamps = timestamps[order] - timestamps[order][0]
+    sizes = sizes[order]
+
+    if load_gbps is not None and timestamps[-1] > 0:
+        trace_load = sizes.sum() * 8. / timestamps[-1] / 1e9
+        timestamps = timestamps * (trace_load / load_gbps)
+
+    for start in range(0, len(sizes), chunk_size):
+        yield timestamps[start:start+chunk_size], sizes[start:start+chunk_size]
+
+
+def simulate(info, chunks, buffer_bytes, pipeline_latency):
+    simulator = QueueSimulator(info, buffer_bytes, pipeline_latency)
+    for (timestamps, sizes) in chunks:
+        simulator.process(timestamps, sizes)
+    return simulator.report()
+
+
+def format_report(report):
+    return "load %.2f Gbps: drops %.4f%% (too big %i), latency mean %.0fns p50 %.0fns p99 %.0fns p99.9 %.0fns max %.0fns, chaff %.2f Gbps" % \
+        (report["load_gbps"], report["drop_rate"] * 100, report["too_big"], report["latency_mean"] * 1e9, report["latency_p50"] * 1e9,
+         report["latency_p99"] * 1e9, report["latency_p999"] * 1e9, report["latency_max"] * 1e9, report["chaff_gbps"])
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args ([str]): command line parameters as list of strings
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="volume obfuscation queueing simulator")
+
+    parser.add_argument(
+        "--info",
+        type=str,
+        required=True,
+        help="pd_rpc_info file written by generate_code.py")
+
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default=None,
+        help="arrival trace (pcap file or CSV file with timestamp,size)")
+
+    parser.add_argument(
+        "--traffic",
+        type=str,
+        default=None,
+        help="packet size distribution for Poisson arrivals (pcap file or packet size histogram)")
+
+    parser.add_argument(
+        "--load",
+        type=float,
+        default=None,
+        help="production load in Gbps (Poisson arrivals or rescaled trace)")
+
+    parser.add_argument(
+        "--sweep",
+        type=float,
+        nargs="+",
+        default=None,
+        help="simulate these loads (Gbps) and report where production traffic starts to back up")
+
+    parser.add_argument(
+        "--packets",
+        type=int,
+        default=10000000,
+        help="number of Poisson arrivals per simulation")
+
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=10000000,
+        help="number of packets simulated at once")
+
+    parser.add_argument(
+        "--buffer",
+        type=int,
+        default=100000,
+        help="buffer of each priority queue in bytes")
+
+    parser.add_argument(
+        "--pipeline-latency",
+        type=float,
+        default=0.,
+        help="latency of one recirculation in seconds")
+
+    parser.add_argument(
+        "--latency-threshold",
+        type=float,
+        default=10e-6,
+        help="production traffic backs up if the 99th percentile of the added latency exceeds this value (seconds)")
+
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="write the reports to this JSON file")
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="store_const",
+        const=logging.INFO)
+
+    parser.add_argument(
+        "-vv",
+        "--very-verbose",
+        dest="loglevel",
+        help="set loglevel to DEBUG",
+        action="store_const",
+        const=logging.DEBUG)
+
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+
+    with open(args.info) as f:
+        info = json.load(f)
+
+    if args.trace:
+        trace_timestamps, trace_sizes = load_trace(args.trace)
+        sizes, counts = np.unique(trace_sizes, return_counts=True)
+        chunks = lambda load: trace_chunks(trace_timestamps, trace_sizes, args.chunk_size, load)
+    else:
+        if args.traffic:
+            sizes, counts = load_packet_sizes(args.traffic)
+        else:
+            sizes = np.arange(14+20, info["constants"]["MTU"] - info["constants"]["PADDING_META_LEN"] + 1)
+            counts = np.ones(len(sizes))
+        chunks = lambda load: poisson_chunks(sizes, counts, load, args.packets, args.chunk_size)
+
+    log.info("pattern %s, production traffic saturates a priority queue at %.2f Gbps" \
+        % (info["config"]["pattern_sequence"], saturation_load(info, sizes, counts)))
+
+    loads = args.sweep if args.sweep else [args.load if args.load is not None or args.trace else 10.]
+    reports = []
+    for load in loads:
+        start = time.time()
+        report = simulate(info, chunks(load), args.buffer, args.pipeline_latency)
+        log.info("%s (%i packets in %.1fs)" % (format_report(report), report["packets"], time.time() - start))
+        for (state_index, state) in enumerate(report["states"]):
+            log.debug("state %i (%iB): %i sent, %i dropped, utilization %.3f, chaff %.0f pps" \
+                % (state_index, state["size"], state["sent"], state["dropped"], state["utilization"], state["chaff_pps"]))
+        reports.append(report)
+
+    if args.sweep:
+        backed_up = [r for r in reports if r["dropped"] > 0 or r["latency_p99"] > args.latency_threshold]
+        if backed_up:
+            log.info("production traffic backs up at %.2f Gbps" % backed_up[0]["load_gbps"])
+        else:
+            log.info("production traffic does not back up up to %.2f Gbps" % reports[-1]["load_gbps"])
+
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump(reports, outfile)
+
+
+def run():
+    """Entry point for console_scripts
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,662 @@
+"""
+analytic resource and stage estimate for traffic_pattern_tofino.p4 (before running p4_build.sh).
+usage:
+python resource_estimator.py --p4 ../../p4/traffic_pattern_tofino/p4src/traffic_pattern_tofino.p4 \
+    --bfshell ../../p4/traffic_pattern_tofino/bfshell_input_tofino1.txt -v
+
+The P4_14 program (with the generated code, either from the files on disk or from a
+PatternCodeGenerator) is preprocessed and parsed into header types and instances,
+parser states, actions, tables and the apply order in the ingress and egress controls.
+The estimate contains
+- parser states and transitions (select cases),
+- PHV bits of all header and metadata instances,
+- TCAM and SRAM blocks of each table (declared size, range expansion of the actual entries),
+- the actions of each table and their VLIW instructions (one instruction word per action
+  with primitives, ALU operations per instruction),
+- the number of stages, assuming that a table needs a new stage if it matches on or
+  modifies a field which a preceding table (on the same control flow path) modifies,
+  or if the instruction memory of its stage is full.
+The numbers are rough (the compiler packs PHV containers and tables differently), but
+configurations which exceed a budget by far will not compile.
+"""
+
+import os, sys, time
+import re
+import argparse
+import logging
+
+from table_entries import TableEntries
+from tcam_compiler import table_cost
+from pad_optimizer import PHV_BUDGET_BITS
+
+
+def setup_logging(loglevel="DEBUG"):
+    """Setup basic logging
+
+    Args:
+      loglevel (int): minimum loglevel for emitting messages
+    """
+    logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
+    logging.basicConfig(level=loglevel, stream=sys.stdout,
+                        format=logformat, datefmt="%Y-%m-%d %H:%M:%S")
+
+log = logging.getLogger(__name__)
+
+# Tofino budgets (per pipe)
+NUM_STAGES = 12
+TCAM_BLOCKS_PER_STAGE = 24
+SRAM_BLOCKS_PER_STAGE = 80
+TABLES_PER_STAGE = 16
+# instruction words of one stage and thread (ingress/egress), operations of one VLIW
+# instruction (one ALU per PHV container: 64 8-bit, 96 16-bit and 64 32-bit)
+VLIW_INSTRUCTIONS_PER_STAGE = 32
+ALU_OPERATIONS_PER_INSTRUCTION = 64 + 96 + 64
+PARSER_TCAM_ENTRIES = 256
+
+# memory blocks: TCAM 512 x 44 bits, SRAM 1024 x 128 bits
+TCAM_BLOCK_ENTRIES = 512
+TCAM_BLOCK_WIDTH = 44
+SRAM_BLOCK_WORDS = 1024
+SRAM_WORD_WIDTH = 128
+
+# widths of intrinsic metadata fields which are not declared in the program
+INTRINSIC_FIELD_WIDTHS = {
+    "ig_intr_md.ingress_port"               : 9,
+    "ig_intr_md_for_tm.ucast_egress_port"   : 9,
+    "ig_intr_md_for_tm.qid"                 : 5,
+    "ig_intr_md_for_tm.drop_ctl"            : 3,
+    "eg_intr_md.egress_port"                : 9,
+    "eg_intr_md.pkt_length"                 : 16,
+}
+
+# primitives which write their first argument
+WRITE_PRIMITIVES = "modify_field add_to_field subtract_from_field add subtract max min bit_and bit_or bit_xor shift_left shift_right".split()
+
+# generated code which replaces include/generated/add_padding.p4
+GENERATED_FILE = "add_padding.p4"
+
+
+def strip_comments(text):
+    text = re.sub(r"/\*.*?\*/", lambda m: "\n" * m.group(0).count("\n"), text, flags=re.DOTALL)
+    return re.sub(r"//[^\n]*", "", text)
+
+
+def preprocess(filepath, sections=None, defines=None):
+    """
+    minimal C preprocessor for the P4 program (#include "...", #define, #undef, #ifdef, #ifndef, #else, #endif)
+
+    Args:
+        filepath (string): path to the main P4 file
+        sections (dict): generated code (part -> code) which replaces include/generated/add_padding.p4
+        defines (dict): predefined macros
+
+    Returns:
+        (string, dict): preprocessed program and the macros (name -> (params, body))
+    """
+    defines = dict(defines or {"__TARGET_TOFINO__": (None, "")})
+    output = []
+
+    def process(text, directory):
+        active = []
+        lines = strip_comments(text).replace("\\\n", " ").split("\n")
+        for line in lines:
+            stripped = line.strip()
+            if not stripped.startswith("#"):
+                if all(active):
+                    output.append(line)
+                continue
+
+            (directive, _, rest) = stripped[1:].strip().partition(" ")
+            rest = rest.strip()
+            if directive in ("ifdef", "ifndef"):
+                active.append((rest in defines) == (directive == "ifdef"))
+            elif directive == "if":
+                active.append(rest != "0")
+            elif directive == "else":
+                active[-1] = not active[-1]
+            elif directive == "endif":
+                active.pop()
+            elif not all(active):
+                continue
+            elif directive == "define":
+                match = re.match(r"(\w+)(\(([^)]*)\))?\s*(.*)", rest)
+                params = [p.strip() for p in match.group(3).split(",")] if match.group(2) else None
+                defines[match.group(1)] = (params, match.group(4).strip())
+            elif directive == "undef":
+                defines.pop(rest, None)
+            elif directive == "include" and rest.startswith('"'):
+                path = os.path.join(directory, rest.strip('"'))
+                if os.path.basename(path) == GENERATED_FILE and sections is not None:
+                    section = [name[len("IN_SECTION_"):] for name in defines if name.startswith("IN_SECTION_")]
+                    process("\n".join(sections.get(section[0], [])) if section else "", directory)
+                else:
+                    with open(path) as f:
+                        process(f.read(), os.path.dirname(path))
+
+    with open(filepath) as f:
+        process(f.read(), os.path.dirname(filepath))
+
+    return expand_macros("\n".join(output), defines), defines
+
+
+def expand_macros(text, defines):
+    """expands object-like and (non-nested) function-like macros"""
+    objects = {k: v for (k, (params, v)) in defines.items() if params is None and v}
+    functions = {k: v for (k, v) in defines.items() if v[0] is not None}
+
+    for _ in range(10):
+        previous = text
+        for (name, (params, body)) in functions.items():
+            def replace(match, params=params, body=body):
+                args = [a.strip() for a in match.group(1).split(",")]
+                result = body
+                for (param, arg) in zip(params, args):
+                    result = re.sub(r"\b%s\b" % param, arg, result)
+                return result.replace("##", "").replace(" ## ", "")
+            text = re.sub(r"\b%s\s*\(([^()]*)\)" % name, replace, text)
+
+        if objects:
+            pattern = re.compile(r"\b(%s)\b" % "|".join(sorted(objects, key=len, reverse=True)))
+            text = pattern.sub(lambda m: objects[m.group(1)], text)
+
+        if text == previous:
+            break
+    return text
+
+
+def find_blocks(text, keyword):
+    """
+    returns the named blocks "<keyword> <name> [(...)] { ... }"
+
+    Returns:
+        list of (string, string, string): name, parameters and body
+    """
+    blocks = []
+    for match in re.finditer(r"\b%s\s+(\w+)\s*(\(([^)]*)\))?\s*\{" % keyword, text):
+        (start, depth) = (match.end(), 1)
+        i = start
+        while depth > 0 and i < len(text):
+            depth += {"{": 1, "}": -1}.get(text[i], 0)
+            i += 1
+        blocks.append((match.group(1), match.group(3) or "", text[start:i-1]))
+    return blocks
+
+
+def parse_control(body):
+    """
+    parses the body of a control block
+
+    Returns:
+        list of statements: ("apply", table), ("if", condition, statements, statements) or ("call", control)
+    """
+    statements = []
+    i = 0
+
+    def skip_block(i):
+        """returns the body of the block starting at text[i] == "{" and the index after it"""
+        (depth, start) = (1, i+1)
+        i += 1
+        while depth > 0:
+            depth += {"{": 1, "}": -1}.get(body[i], 0)
+            i += 1
+        return body[start:i-1], i
+
+    while i < len(body):
+        rest = body[i:]
+        match = re.match(r"\s*apply\s*\(\s*(\w+)\s*\)\s*", rest)
+        if match:
+            statements.append(("apply", match.group(1)))
+            i += match.end()
+            if i < len(body) and body[i] == "{":
+                _, i = skip_block(i)
+            elif i < len(body) and body[i] == ";":
+                i += 1
+            continue
+
+        match = re.match(r"\s*if\s*\(", rest)
+        if match:
+            (depth, j) = (1, i + match.end())
+            while depth > 0:
+                depth += {"(": 1, ")": -1}.get(body[j], 0)
+                j += 1
+            condition = body[i + match.end():j-1]
+            j += len(body[j:]) - len(body[j:].lstrip())
+            then_body, i = skip_block(j)
+
+            else_statements = []
+            match = re.match(r"\s*else\s*", body[i:])
+            if match:
+                i += match.end()
+                if body[i:].startswith("if"):
+                    # else if: parse the remaining if statement as the else branch
+                    start = i
+                    nested = parse_control(body[start:])
+                    else_statements = nested[:1]
+                    i = start + _statement_length(body[start:])
+                else:
+                    else_body, i = skip_block(i)
+                    else_statements = parse_control(else_body)
+            statements.append(("if", condition, parse_control(then_body), else_statements))
+            continue
+
+        match = re.match(r"\s*(\w+)\s*;", rest)
+        if match:
+            statements.append(("call", match.group(1)))
+            i += match.end()
+            continue
+
+        i += 1
+    return statements
+
+
+def _statement_length(text):
+    """returns the length of the if statement (incl. else branches) at the start of text"""
+    i = text.index("(")
+    depth = 1
+    i += 1
+    while depth > 0:
+        depth += {"(": 1, ")": -1}.get(text[i], 0)
+        i += 1
+    while True:
+        i = text.index("{", i)
+        depth = 1
+        i += 1
+        while depth > 0:
+            depth += {"{": 1, "}": -1}.get(text[i], 0)
+            i += 1
+        match = re.match(r"\s*else\s*(if\s*\()?", text[i:])
+        if not match:
+            return i
+        i += match.end()
+        if match.group(1):
+            depth = 1
+            while depth > 0:
+                depth += {"(": 1, ")": -1}.get(text[i], 0)
+                i += 1
+
+
+def condition_fields(condition):
+    """returns the fields (and header validity bits) read by a condition"""
+    fields = set(re.findall(r"\b(\w+\.\w+)\b", condition))
+    fields |= set(["%s.$valid" % h for h in re.findall(r"valid\s*\(\s*(\w+)\s*\)", condition)])
+    return fields
+
+
+class P4Program(object):
+
+    def __init__(self, text):
+        self.header_types = {}
+        for (name, _, body) in find_blocks(text, "header_type"):
+            self.header_types[name] = [(f, int(w)) for (f, w) in re.findall(r"(\w+)\s*:\s*(\d+)\s*;", body)]
+
+        self.instances = {}
+        for (kind, header_type, name, count) in re.findall(r"\b(header|metadata)\s+(\w+)\s+(\w+)\s*(?:\[\s*(\d+)\s*\])?\s*;", text):
+            self.instances[name] = {"type": header_type, "metadata": kind == "metadata", "count": int(count) if count else 1}
+
+        self.parser_states = {}
+        for (name, _, body) in find_blocks(text, "parser"):
+            select = re.search(r"select\s*\([^)]*\)\s*\{(.*)\}", body, re.DOTALL)
+            if select:
+                transitions = re.findall(r"([^:;{}]+?)\s*:\s*(\w+)\s*;", select.group(1))
+            else:
+                transitions = [("default", s) for s in re.findall(r"return\s+(\w+)\s*;", body)]
+            self.parser_states[name] = {
+                "extracts"      : re.findall(r"extract\s*\(\s*([\w\[\]]+)\s*\)", body),
+                "transitions"   : [(v.strip(), s) for (v, s) in transitions],
+            }
+
+        self.actions = {}
+        for (name, params, body) in find_blocks(text, "action"):
+            writes, reads = set(), set()
+            params = [p.strip() for p in params.split(",") if p.strip()]
+            param_fields = {}
+            primitives = re.findall(r"(\w+)\s*\(([^;]*)\)\s*;", body)
+            for (primitive, args) in primitives:
+                args = [a.strip() for a in args.split(",")]
+                if primitive in WRITE_PRIMITIVES:
+                    writes.add(args[0])
+                    reads |= set([a for a in args[1:] if "." in a])
+                    if primitive == "modify_field" and len(args) > 1 and args[1] in params:
+                        param_fields[args[1]] = args[0]
+                    if primitive in ("add_to_field", "subtract_from_field"):
+                        reads.add(args[0])
+                elif primitive in ("add_header", "remove_header"):
+                    writes.add("%s.$valid" % args[0])
+                else:
+                    reads |= set([a for a in args if "." in a])
+            # (every written field, added/removed header and other primitive takes one ALU operation)
+            others = [p for (p, _) in primitives if p not in WRITE_PRIMITIVES and p not in ("add_header", "remove_header")]
+            self.actions[name] = {"writes": writes, "reads": reads, "params": params, "param_fields": param_fields,
+                                  "operations": len(writes) + len(others)}
+
+        self.tables = {}
+        for (name, _, body) in find_blocks(text, "table"):
+            reads = re.search(r"reads\s*\{(.*?)\}", body, re.DOTALL)
+            keys = re.findall(r"([\w.$()]+)\s*:\s*(\w+)\s*;", reads.group(1)) if reads else []
+            actions = re.search(r"actions\s*\{(.*?)\}", body, re.DOTALL)
+            size = re.search(r"\bsize\s*:\s*(\d+)", body)
+            default_action = re.search(r"default_action\s*:\s*(\w+)", body)
+            actions = re.findall(r"(\w+)\s*;", actions.group(1)) if actions else []
+            if default_action and default_action.group(1) not in actions:
+                actions.append(default_action.group(1))
+            self.tables[name] = {
+                "keys"      : [(re.sub(r"valid\((\w+)\)", r"\1.$valid", k), kind) for (k, kind) in keys],
+                "actions"   : actions,
+                "size"      : int(size.group(1)) if size else 0,
+            }
+
+        self.controls = {name: parse_control(body) for (name, _, body) in find_blocks(text, "control")}
+
+    def field_width(self, field):
+        if field.endswith(".$valid"):
+            return 1
+        if field in INTRINSIC_FIELD_WIDTHS:
+            return INTRINSIC_FIELD_WIDTHS[field]
+        (instance, _, name) = field.partition(".")
+        instance = re.sub(r"\[.*\]", "", instance)
+        if instance in self.instances:
+            for (f, w) in self.header_types.get(self.instances[instance]["type"], []):
+                if f == name:
+                    return w
+        return 16
+
+    def table_writes(self, table):
+        writes = set()
+        for action in self.tables[table]["actions"]:
+            writes |= self.actions.get(action, {}).get("writes", set())
+        return writes
+
+    def table_reads(self, table):
+        reads = set([k for (k, _) in self.tables[table]["keys"]])
+        for action in self.tables[table]["actions"]:
+            reads |= self.actions.get(action, {}).get("reads", set())
+        return reads
+
+    def table_instructions(self, table):
+        """returns the actions of a table which need a VLIW instruction (actions with primitives)"""
+        return set([a for a in self.tables[table]["actions"] if self.actions.get(a, {}).get("operations", 0) > 0])
+
+    def action_data_width(self, table):
+        width = 0
+        for action in self.tables[table]["actions"]:
+            action = self.actions.get(action, {"params": [], "param_fields": {}})
+            width = max(width, sum([self.field_width(action["param_fields"][p]) if p in action["param_fields"] else 16 for p in action["params"]]))
+        return width
+
+
+def phv_usage(program):
+    """
+    returns the number of PHV bits of all header and metadata instances
+
+    Returns:
+        (int, int): header bits and metadata bits
+    """
+    headers, metadata = 0, 0
+    for (name, instance) in program.instances.items():
+        bits = sum([w for (_, w) in program.header_types.get(instance["type"], [])]) * instance["count"]
+        if instance["metadata"]:
+            metadata += bits
+        else:
+            headers += bits
+    return headers, metadata
+
+
+def table_resources(program, table, entries=None):
+    """
+    estimates the memory of a table
+
+    Args:
+        entries (list): parsed table entries (see parse_bfshell) or None
+
+    Returns:
+        dict: size, entries, key_width, match (exact/tcam/none), tcam_blocks, sram_blocks,
+            actions, instructions (VLIW instructions) and operations (most ALU operations of an action)
+    """
+    keys = program.tables[table]["keys"]
+    size = program.tables[table]["size"]
+    key_width = sum([program.field_width(k) for (k, _) in keys])
+    tcam = any([kind in ("ternary", "range", "lpm") for (_, kind) in keys])
+
+    num_entries = len(entries) if entries is not None else 0
+    tcam_entries = max(size, table_cost(entries)["tcam_entries"] if entries else 0)
+
+    resources = {
+        "size"          : size,
+        "entries"       : num_entries,
+        "key_width"     : key_width,
+        "match"         : "none" if not keys else ("tcam" if tcam else "exact"),
+        "tcam_blocks"   : 0,
+        "sram_blocks"   : 0,
+        "actions"       : len(program.tables[table]["actions"]),
+        "instructions"  : len(program.table_instructions(table)),
+        "operations"    : max([program.actions.get(a, {}).get("operations", 0) for a in program.tables[table]["actions"]] + [0]),
+    }
+    if not keys:
+        return resources
+
+    action_data_width = program.action_data_width(table)
+    action_data_blocks = -(-max(size, num_entries) * action_data_width // (SRAM_BLOCK_WORDS * SRAM_WORD_WIDTH)) if action_data_width > 0 else 0
+
+    if tcam:
+        resources["tcam_blocks"] = -(-tcam_entries // TCAM_BLOCK_ENTRIES) * -(-key_width // TCAM_BLOCK_WIDTH)
+        resources["sram_blocks"] = action_data_blocks
+    else:
+        # exact match: hash tables with some overhead bits per entry
+        entries_per_word = max(SRAM_WORD_WIDTH // (key_width + 4), 1)
+        resources["sram_blocks"] = -(-max(size, num_entries) // (SRAM_BLOCK_WORDS * entries_per_word)) + action_data_blocks
+    return resources
+
+
+def estimate_stages(program, control, resources):
+    """
+    places the tables of a control in stages (the first stage after the tables it depends on
+    in which the instructions of its actions fit)
+
+    Returns:
+        dict: table -> (first stage, last stage)
+    """
+    placement = {}
+    # actions with an instruction word in each stage
+    instructions = {}
+
+    def place(statements, visible, gate_fields):
+        placed = []
+        for statement in statements:
+            if statement[0] == "apply" and statement[1] in program.tables:
+                table = statement[1]
+                reads = program.table_reads(table)
+                keys = set([k for (k, _) in program.tables[table]["keys"]]) | gate_fields
+                writes = program.table_writes(table)
+
+                stage = 0
+                for (other, other_writes) in visible:
+                    if other_writes & (keys | reads | writes):
+                        stage = max(stage, placement[other][1] + 1)
+
+                # large tables are split over several stages
+                r = resources.get(table, {})
+                extra = max(-(-r.get("tcam_blocks", 0) // TCAM_BLOCKS_PER_STAGE), -(-r.get("sram_blocks", 0) // SRAM_BLOCKS_PER_STAGE), 1) - 1
+
+                table_instructions = program.table_instructions(table)
+                if len(table_instructions) <= VLIW_INSTRUCTIONS_PER_STAGE:
+                    while any([len(instructions.get(s, set()) | table_instructions) > VLIW_INSTRUCTIONS_PER_STAGE for s in range(stage, stage + extra + 1)]):
+                        stage += 1
+                for s in range(stage, stage + extra + 1):
+                    instructions[s] = instructions.get(s, set()) | table_instructions
+                placement[table] = (stage, stage + extra)
+                visible = visible + [(table, writes)]
+                placed.append((table, writes))
+
+            elif statement[0] == "if":
+                fields = gate_fields | condition_fields(statement[1])
+                then_placed = place(statement[2], visible, fields)
+                else_placed = place(statement[3], visible, fields)
+                visible = visible + then_placed + else_placed
+                placed += then_placed + else_placed
+
+            elif statement[0] == "call" and statement[1] in program.controls:
+                called = place(program.controls[statement[1]], visible, gate_fields)
+                visible = visible + called
+                placed += called
+        return placed
+
+    place(program.controls.get(control, []), [], set())
+    return placement
+
+
+class ResourceEstimator(object):
+
+    def __init__(self, p4_filepath, sections=None, entries=None):
+        """
+        Args:
+            p4_filepath (string): path to traffic_pattern_tofino.p4
+            sections (dict): generated code (part -> list of code) instead of the generated file on disk
+            entries (TableEntries or list): table entries (to estimate the range expansion of the actual entries)
+        """
+        text, self.defines = preprocess(p4_filepath, sections)
+        self.program = P4Program(text)
+
+        self.entries = {}
+        for entry in entries or []:
+            self.entries.setdefault(entry["table"], []).append(entry)
+
+    def estimate(self):
+        program = self.program
+        report = {"problems": []}
+
+        # parser
+        report["parser_states"] = len(program.parser_states)
+        report["parser_transitions"] = sum([len(s["transitions"]) for s in program.parser_states.values()])
+        if report["parser_transitions"] > PARSER_TCAM_ENTRIES:
+            report["problems"].append("parser: %i transitions (parser TCAM has %i entries)" % (report["parser_transitions"], PARSER_TCAM_ENTRIES))
+
+        # PHV
+        (header_bits, metadata_bits) = phv_usage(program)
+        report["phv_bits"] = header_bits + metadata_bits
+        report["phv_header_bits"] = header_bits
+        report["phv_metadata_bits"] = metadata_bits
+        if report["phv_bits"] > PHV_BUDGET_BITS:
+            report["problems"].append("PHV: %i bits (budget %i bits)" % (report["phv_bits"], PHV_BUDGET_BITS))
+
+        # tables
+        resources = {t: table_resources(program, t, self.entries.get(t)) for t in program.tables}
+        report["tables"] = resources
+        report["tcam_blocks"] = sum([r["tcam_blocks"] for r in resources.values()])
+        report["sram_blocks"] = sum([r["sram_blocks"] for r in resources.values()])
+        for (table, r) in sorted(resources.items()):
+            if r["entries"] > r["size"] and r["match"] != "none":
+                report["problems"].append("table %s: %i entries (size %i)" % (table, r["entries"], r["size"]))
+            if r["instructions"] > VLIW_INSTRUCTIONS_PER_STAGE:
+                report["problems"].append("table %s: %i VLIW instructions (budget %i per stage)" % (table, r["instructions"], VLIW_INSTRUCTIONS_PER_STAGE))
+            if r["operations"] > ALU_OPERATIONS_PER_INSTRUCTION:
+                report["problems"].append("table %s: %i ALU operations in one action (budget %i)" % (table, r["operations"], ALU_OPERATIONS_PER_INSTRUCTION))
+        if report["tcam_blocks"] > NUM_STAGES * TCAM_BLOCKS_PER_STAGE:
+            report["problems"].append("TCAM: %i blocks (budget %i)" % (report["tcam_blocks"], NUM_STAGES * TCAM_BLOCKS_PER_STAGE))
+        if report["sram_blocks"] > NUM_STAGES * SRAM_BLOCKS_PER_STAGE:
+            report["problems"].append("SRAM: %i blocks (budget %i)" % (report["sram_blocks"], NUM_STAGES * SRAM_BLOCKS_PER_STAGE))
+
+        # stages (ingress and egress each have up to NUM_STAGES stages and their own instruction
+        # words, but the tables of both controls share the logical tables of each stage)
+        report["stages"] = {}
+        tables_per_stage = {}
+        for control in ("ingress", "egress"):
+            placement = estimate_stages(program, control, resources)
+            report["stages"][control] = max([last for (_, last) in placement.values()] + [-1]) + 1
+            report["placement_%s" % control] = placement
+
+            for (table, (first, last)) in placement.items():
+                for stage in range(first, last+1):
+                    tables_per_stage[stage] = tables_per_stage.get(stage, 0) + 1
+
+            if report["stages"][control] > NUM_STAGES:
+                report["problems"].append("%s: %i stages (budget %i)" % (control, report["stages"][control], NUM_STAGES))
+
+        if tables_per_stage and max(tables_per_stage.values()) > TABLES_PER_STAGE:
+            report["problems"].append("%i tables in one stage (ingress and egress, budget %i)" % (max(tables_per_stage.values()), TABLES_PER_STAGE))
+
+        return report
+
+
+def format_report(report):
+    lines = [
+        "parser: %i states, %i transitions" % (report["parser_states"], report["parser_transitions"]),
+        "PHV: %i bits (headers %i, metadata %i, budget %i)" % (report["phv_bits"], report["phv_header_bits"], report["phv_metadata_bits"], PHV_BUDGET_BITS),
+        "tables: %i TCAM blocks, %i SRAM blocks" % (report["tcam_blocks"], report["sram_blocks"]),
+        "stages: ingress %i, egress %i (budget %i)" % (report["stages"]["ingress"], report["stages"]["egress"], NUM_STAGES),
+    ]
+    for (table, r) in sorted(report["tables"].items()):
+        if r["match"] != "none":
+            lines.append("  %-40s %-5s size %5i entries %5i key %3ib TCAM %3i SRAM %3i actions %3i VLIW %3i ops %3i" \
+                % (table, r["match"], r["size"], r["entries"], r["key_width"], r["tcam_blocks"], r["sram_blocks"], r["actions"], r["instructions"], r["operations"]))
+    return lines
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args ([str]): command line parameters as list of strings
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="volume obfuscation resource estimator")
+
+    parser.add_argument(
+        "--p4",
+        type=str,
+        default="../../p4/traffic_pattern_tofino/p4src/traffic_pattern_tofino.p4",
+        help="main P4 file")
+
+    parser.add_argument(
+        "--bfshell",
+        type=str,
+        default=None,
+        help="bfshell input file (or table entries .json/.bin) written by generate_code.py")
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="store_const",
+        const=logging.INFO)
+
+    parser.add_argument(
+        "-vv",
+        "--very-verbose",
+        dest="loglevel",
+        help="set loglevel to DEBUG",
+        action="store_const",
+        const=logging.DEBUG)
+
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+
+    entries = TableEntries.load(args.bfshell) if args.bfshell else None
+
+    start = time.time()
+    report = ResourceEstimator(args.p4, entries=entries).estimate()
+    for line in format_report(report):
+        log.info(line)
+    log.info("estimated in %.2fs" % (time.time() - start))
+
+    for problem in report["problems"]:
+        log.error(problem)
+    if report["problems"]:
+        sys.exit(1)
+
+
+def run():
+    """Entry point for console_scripts
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,382 @@
+"""
+incremental update of the table entries and shaping rates when the pattern changes.
+usage:
+python table_delta.py --old bfshell_input_tofino1_old.txt --new ../../p4/traffic_pattern_tofino/bfshell_input_tofino1.txt --stub -v
+python table_delta.py --plan ../../p4/traffic_pattern_tofino/update_plan.json -v
+
+The delta between the installed entries and a new set of entries of a switch consists of
+- add: entries with new match fields/priority,
+- modify: entries with the same match fields and priority but a different action or action data,
+- delete: installed entries which are not in the new set.
+Entries which did not change are not touched.
+
+The update of both ends of a link (plan_update) has three steps:
+1. prepare: add/modify the entries of the deobfuscation path on all switches. The
+   deobfuscation does not depend on the pattern, so both ends accept packets of the
+   old and the new pattern afterwards.
+2. switch: on one switch after the other, lower the shaping rates which decrease,
+   replace the obfuscation entries in one atomic transaction and raise the shaping rates which increase (the entries of the
+   old and the new pattern overlap with the same priorities, so every packet matches
+   the entries of either the old or the new pattern, never a mix of both).
+3. cleanup: delete the old entries of the deobfuscation path on all switches.
+This only works if the P4 program stays the same (e.g., the pattern keeps its length
+or the program was generated with --runtime-pattern-length; constants which only
+parameterize table entries, like MAX_PACKET_SIZE, may change).
+Otherwise, the plan reports that the switches need to be restarted with the new program.
+"""
+
+import os, sys, time
+import argparse
+import json
+import logging
+from multiprocessing import Process
+
+from table_entries import TableEntries
+from table_installer import match_key, entry_key, StubSession, serve_stub, verify, STUB_ADDRESS, STUB_AUTHKEY
+from queue_simulator import SHAPING_MARGIN
+
+
+def setup_logging(loglevel="DEBUG"):
+    """Setup basic logging
+
+    Args:
+      loglevel (int): minimum loglevel for emitting messages
+    """
+    logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
+    logging.basicConfig(level=loglevel, stream=sys.stdout,
+                        format=logformat, datefmt="%Y-%m-%d %H:%M:%S")
+
+log = logging.getLogger(__name__)
+
+STEPS = ["prepare", "switch", "cleanup"]
+# constants of the generated P4 code which are only used by table entries
+ENTRY_CONSTANTS = ["MAX_PACKET_SIZE"]
+
+
+def is_deobfuscation(entry):
+    """returns True for the entries of the deobfuscation path (independent of the pattern)"""
+    return entry["table"].startswith("deobfuscation_") or entry["action"] == "forward_and_deobfuscate"
+
+
+def compute_delta(old, new):
+    """
+    Args:
+        old (iterable): installed entries (dicts, see parse_bfshell)
+        new (iterable): new entries
+
+    Returns:
+        dict: lists of entries to add, modify and delete
+    """
+    old_entries = {match_key(e): e for e in old}
+    new_keys = set()
+    delta = {"add": [], "modify": [], "delete": []}
+    for entry in new:
+        key = match_key(entry)
+        new_keys.add(key)
+        if key not in old_entries:
+            delta["add"].append(entry)
+        elif entry_key(entry) != entry_key(old_entries[key]):
+            delta["modify"].append(entry)
+    delta["delete"] = [e for e in old if match_key(e) not in new_keys]
+    return delta
+
+
+def links(info):
+    """returns the links of a device (the top level fields for devices with a single link, without link_id)"""
+    if "links" in info:
+        return info["links"]
+    link = {
+        "pattern_sequence": info["config"]["pattern_sequence"],
+        "target_bw": info["constants"].get("TARGET_BW", 100),
+        "state_index_to_port": info["state_index_to_port"],
+    }
+    if "traffic_classes" in info:
+        link["traffic_classes"] = info["traffic_classes"]
+    return [link]
+
+
+def shaping_rates(info):
+    """
+    returns the shaping rate (kbps) of each priority queuing port (see init_pd_rpc.py)
+
+    Args:
+        info (dict): pd_rpc_info_X.json
+    """
+    rates = {}
+    for traffic_class in sum([link.get("traffic_classes", [link]) for link in links(info)], []):
+        pattern = traffic_class["pattern_sequence"]
+        bandwidth = traffic_class["target_bw"] * 1e6
+        rates.update({int(port): bandwidth / sum(pattern) * pattern[int(state_index)] * (1 - SHAPING_MARGIN)
+                      for (state_index, port) in traffic_class["state_index_to_port"].items()})
+    return rates
+
+
+def program_sections(lines):
+    """returns the (non-empty, right-stripped) lines of each section of a generated P4 file"""
+    sections = {}
+    part = None
+    for line in lines:
+        if line.startswith("#ifdef IN_SECTION_"):
+            part = line[len("#ifdef IN_SECTION_"):].strip()
+            sections[part] = []
+        elif line.startswith("#endif") and part is not None:
+            part = None
+        elif part is not None and line.strip() and not line.startswith("// ****"):
+            sections[part].append(line.rstrip())
+    return sections
+
+
+def program_changes(old_lines, new_lines):
+    """
+    returns the sections (except CLI) which differ between two generated P4 files
+    (the defines of ENTRY_CONSTANTS are ignored, they only parameterize table entries
+    which are part of the delta)
+    """
+    (old, new) = (program_sections(old_lines), program_sections(new_lines))
+    for sections in [old, new]:
+        for part in sections:
+            sections[part] = [l for l in sections[part] if not any([l.startswith("#define %s " % c) for c in ENTRY_CONSTANTS])]
+    return sorted([p for p in set(old) | set(new) if p != "CLI" and old.get(p) != new.get(p)])
+
+
+def plan_update(devices):
+    """
+    Args:
+        devices (dict): device -> dict with old/new entries, old/new info (pd_rpc_info) and program_changes
+
+    Returns:
+        dict: restart_required, reasons and steps (list of dicts with name and operations)
+    """
+    plan = {"restart_required": False, "reasons": [], "steps": []}
+    for (device, d) in sorted(devices.items()):
+        if d.get("program_changes"):
+            plan["restart_required"] = True
+            plan["reasons"].append("%s: generated P4 code changed (%s)" % (device, ", ".join(d["program_changes"])))
+
+    deltas = {device: compute_delta(list(d["old"]), list(d["new"])) for (device, d) in devices.items()}
+
+    prepare = []
+    cleanup = []
+    for device in sorted(devices):
+        delta = deltas[device]
+        prepare += [{"device": device, "op": op, "entry": e} for op in ["add", "modify"] for e in delta[op] if is_deobfuscation(e)]
+        cleanup += [{"device": device, "op": "delete", "entry": e} for e in delta["delete"] if is_deobfuscation(e)]
+
+    switch = []
+    for device in sorted(devices):
+        delta = deltas[device]
+        old_rates = shaping_rates(devices[device]["old_info"]) if devices[device].get("old_info") else {}
+        new_rates = shaping_rates(devices[device]["new_info"]) if devices[device].get("new_info") else {}
+        changed = [p for p in sorted(new_rates) if abs(new_rates[p] - old_rates.get(p, 0)) > 1e-6]
+
+        switch += [{"device": device, "op": "set_shaping_rate", "port": p, "rate": new_rates[p]} for p in changed if new_rates[p] < old_rates.get(p, 0)]
+        # the new entries overlap the old ones with the same priorities, so the
+        # obfuscation entries change in one transaction
+        transaction = [{"device": device, "op": op, "entry": e} for op in ["delete", "modify", "add"] for e in delta[op] if not is_deobfuscation(e)]
+        if transaction:
+            switch += [{"device": device, "op": "begin_transaction"}] + transaction + [{"device": device, "op": "commit_transaction"}]
+        switch += [{"device": device, "op": "set_shaping_rate", "port": p, "rate": new_rates[p]} for p in changed if new_rates[p] >= old_rates.get(p, 0)]
+
+    plan["steps"] = [{"name": "prepare", "operations": prepare}, {"name": "switch", "operations": switch}, {"name": "cleanup", "operations": cleanup}]
+    return plan
+
+
+def apply_plan(plan, sessions, steps=STEPS):
+    """
+    applies the operations of the given steps with one session per device
+    (PdRpcSession or StubSession, devices without session are skipped)
+
+    Returns:
+        dict: number of operations of each step
+    """
+    if plan["restart_required"]:
+        raise ValueError("the plan requires a restart: %s" % "; ".join(plan["reasons"]))
+
+    counts = {}
+    for step in plan["steps"]:
+        if step["name"] not in steps:
+            continue
+        start = time.time()
+        counts[step["name"]] = 0
+        for operation in step["operations"]:
+            session = sessions.get(operation["device"])
+            if session is None:
+                continue
+            if operation["op"] == "set_shaping_rate":
+                session.set_shaping_rate(operation["port"], operation["rate"])
+            elif operation["op"] in ["begin_transaction", "commit_transaction"]:
+                getattr(session, operation["op"])()
+            else:
+                getattr(session, operation["op"])(operation["entry"])
+            counts[step["name"]] += 1
+        for session in sessions.values():
+            session.complete_operations()
+        log.debug("%s: %i operations in %.3fs" % (step["name"], counts[step["name"]], time.time() - start))
+    return counts
+
+
+def format_plan(plan):
+    lines = []
+    for reason in plan["reasons"]:
+        lines.append("restart required: %s" % reason)
+    for step in plan["steps"]:
+        counts = {}
+        for operation in step["operations"]:
+            key = (operation["device"], operation["op"])
+            counts[key] = counts.get(key, 0) + 1
+        lines.append("%-8s %s" % (step["name"], ", ".join(["%s %s %i" % (d, op, c) for ((d, op), c) in sorted(counts.items())]) or "-"))
+    return lines
+
+
+def write_plan(plan, filepath):
+    with open(filepath, "w") as f:
+        json.dump(plan, f)
+
+
+def read_plan(filepath):
+    """reads a plan (range match fields are converted back to tuples)"""
+    with open(filepath) as f:
+        plan = json.load(f)
+    for step in plan["steps"]:
+        for operation in step["operations"]:
+            if "entry" in operation:
+                entry = operation["entry"]
+                entry["match"] = {str(k): tuple(v) if isinstance(v, list) else v for (k, v) in entry["match"].items()}
+                entry["data"] = {str(k): v for (k, v) in entry["data"].items()}
+                entry["table"] = str(entry["table"])
+                entry["action"] = str(entry["action"])
+    return plan
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args ([str]): command line parameters as list of strings
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="volume obfuscation incremental table update")
+
+    parser.add_argument(
+        "--old",
+        type=str,
+        default=None,
+        help="installed table entries (bfshell input, .json or .bin)")
+
+    parser.add_argument(
+        "--new",
+        type=str,
+        default=None,
+        help="new table entries")
+
+    parser.add_argument(
+        "--plan",
+        type=str,
+        default=None,
+        help="update plan written by generate_code.py --update-plan")
+
+    parser.add_argument(
+        "--stub",
+        dest="stub",
+        help="install the old entries on a stub server, apply the plan and compare the result with the new entries (with --old and --new)",
+        action="store_true")
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="store_const",
+        const=logging.INFO)
+
+    parser.add_argument(
+        "-vv",
+        "--very-verbose",
+        dest="loglevel",
+        help="set loglevel to DEBUG",
+        action="store_const",
+        const=logging.DEBUG)
+
+    return parser.parse_args(args)
+
+
+def stub_check(plan, old, new):
+    """
+    installs the old entries of each device on a stub server, applies the plan
+    step by step and compares the result with the new entries
+
+    Args:
+        old (dict): device -> installed entries
+        new (dict): device -> new entries
+
+    Returns:
+        list of strings: problems (operations rejected by the stub, tables without entries
+            during the update, wrong entries after it)
+    """
+    problems = []
+    for (i, device) in enumerate(sorted(old)):
+        address = (STUB_ADDRESS[0], STUB_ADDRESS[1] + i)
+        server = Process(target=serve_stub, args=(address, STUB_AUTHKEY, 0.))
+        server.start()
+        session = StubSession(address, STUB_AUTHKEY)
+
+        for entry in old[device]:
+            session.add(entry)
+
+        tables = set([e["table"] for e in old[device]]) & set([e["table"] for e in new[device]])
+        failed = False
+        for step in STEPS:
+            try:
+                apply_plan(plan, {device: session}, [step])
+            except RuntimeError as e:
+                problems.append("%s: %s failed: %s" % (device, step, e))
+                failed = True
+                break
+            empty = tables - set([e["table"] for e in session.installed_entries()])
+            if empty:
+                problems.append("%s: no entries in %s after %s" % (device, ", ".join(sorted(empty)), step))
+
+        if not failed:
+            problems += ["%s: %s" % (device, m) for m in verify(new[device], session.installed_entries())]
+        session.close()
+        server.join()
+    return problems
+
+
+def main(args):
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+
+    if args.plan:
+        plan = read_plan(args.plan)
+    elif args.old and args.new:
+        old = {"device": list(TableEntries.load(args.old))}
+        new = {"device": list(TableEntries.load(args.new))}
+        plan = plan_update({"device": {"old": old["device"], "new": new["device"]}})
+    else:
+        log.error("--plan or --old and --new are required")
+        sys.exit(1)
+
+    for line in format_plan(plan):
+        log.info(line)
+
+    if args.stub and not args.plan:
+        problems = stub_check(plan, old, new)
+        for problem in problems:
+            log.error(problem)
+        if problems:
+            sys.exit(1)
+        log.info("stub update ok")
+
+
+def run():
+    """Entry point for console_scripts
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
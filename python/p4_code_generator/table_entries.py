@@ -0,0 +1,401 @@
+"""
+table entries of the generated program and their file formats.
+usage:
+python table_entries.py --input ../../p4/traffic_pattern_tofino/bfshell_input_tofino1.txt --output table_entries_tofino1.bin -v
+
+PatternCodeGenerator collects the table entries in a TableEntries object instead of
+bfshell text. The entries are stored column-wise (one array per attribute, names are
+stored once in a string table), so adding an entry takes constant time and the
+entries can be emitted in any of the following formats:
+- bfshell: "pd <table> add_entry <action> <field> <value> ... priority <p> action_<name> <value>"
+- json: {"version": 1, "entries": [{"table", "action", "match", "priority", "data"}, ...]}
+  (match and data are lists of [name, value], range fields are [name, [start, end]])
+- binary: the columns as little endian arrays (see to_binary)
+Other tools can load any of these formats with TableEntries.load.
+"""
+
+import os, sys, time
+import argparse
+import json
+import struct
+import logging
+from array import array
+
+import numpy as np
+
+
+def setup_logging(loglevel="DEBUG"):
+    """Setup basic logging
+
+    Args:
+      loglevel (int): minimum loglevel for emitting messages
+    """
+    logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
+    logging.basicConfig(level=loglevel, stream=sys.stdout,
+                        format=logformat, datefmt="%Y-%m-%d %H:%M:%S")
+
+log = logging.getLogger(__name__)
+
+# kinds of values
+KIND_EXACT = 0
+KIND_RANGE_START = 1
+KIND_RANGE_END = 2
+KIND_DATA = 3
+
+# priority of entries without priority
+NO_PRIORITY = -1
+
+FORMATS = ["bfshell", "json", "binary"]
+FORMAT_EXTENSIONS = {".txt": "bfshell", ".json": "json", ".bin": "binary"}
+
+BINARY_MAGIC = "DTTE"
+BINARY_VERSION = 1
+JSON_VERSION = 1
+
+# columns of the binary format (name, dtype)
+ENTRY_COLUMNS = [("table", "<u2"), ("action", "<u2"), ("priority", "<i4"), ("offset", "<u4")]
+VALUE_COLUMNS = [("field", "<u2"), ("kind", "u1"), ("value", "<i8")]
+
+
+def parse_bfshell(lines):
+    """parses "pd <table> add_entry <action> <field> <value> ..." lines
+
+    Returns:
+        list of dicts: table, action, match (field -> value or (start, end)), priority, data
+                       and order (names of the match fields, priority and action data in the order of the line)
+    """
+    entries = []
+    for line in lines:
+        tokens = line.split()
+        if len(tokens) < 4 or tokens[0] != "pd" or tokens[2] != "add_entry":
+            continue
+
+        entry = {"table": tokens[1], "action": tokens[3], "match": {}, "priority": None, "data": {}, "order": []}
+        ranges = {}
+        for (name, value) in zip(tokens[4::2], tokens[5::2]):
+            value = int(value, 0)
+            order_name = name[:-len("_start")] if name.endswith("_start") else name
+            if not name.endswith("_end"):
+                entry["order"].append(order_name)
+            if name == "priority":
+                entry["priority"] = value
+            elif name.startswith("action_"):
+                entry["data"][name[len("action_"):]] = value
+            elif name.endswith("_start"):
+                ranges.setdefault(name[:-len("_start")], [None, None])[0] = value
+            elif name.endswith("_end"):
+                ranges.setdefault(name[:-len("_end")], [None, None])[1] = value
+            else:
+                entry["match"][name] = value
+        for (name, (start, end)) in ranges.items():
+            entry["match"][name] = (start, end)
+        entries.append(entry)
+    return entries
+
+
+class TableEntries(object):
+    """
+    table entries in insertion order.
+    Match fields and action data of an entry are stored in the value columns
+    (from offset[i] to offset[i+1]) in the order in which they were added.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.name_index = {}
+
+        self.table = array("H")
+        self.action = array("H")
+        self.priority = array("l")
+        self.offset = array("L", [0])
+
+        self.field = array("H")
+        self.kind = array("B")
+        self.value = array("l")
+
+    def __len__(self):
+        return len(self.table)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.entry(i)
+
+    def name_id(self, name):
+        if name not in self.name_index:
+            self.name_index[name] = len(self.names)
+            self.names.append(name)
+        return self.name_index[name]
+
+    def add(self, table, action, match=(), data=(), priority=None):
+        """adds an entry
+
+        Args:
+            table (string): table name
+            action (string): action name
+            match (list): (field, value) of exact fields or (field, (start, end)) of range fields
+            data (list): (name, value) of the action data (without "action_")
+            priority (int): priority of ternary/range tables (None for exact tables)
+        """
+        self.table.append(self.name_id(table))
+        self.action.append(self.name_id(action))
+        self.priority.append(NO_PRIORITY if priority is None else priority)
+
+        for (field, value) in match:
+            if isinstance(value, tuple):
+                self.__add_value(field, KIND_RANGE_START, value[0])
+                self.__add_value(field, KIND_RANGE_END, value[1])
+            else:
+                self.__add_value(field, KIND_EXACT, value)
+        for (name, value) in data:
+            self.__add_value(name, KIND_DATA, value)
+        self.offset.append(len(self.value))
+
+    def __add_value(self, name, kind, value):
+        self.field.append(self.name_id(name))
+        self.kind.append(kind)
+        self.value.append(int(value))
+
+    def entry(self, i):
+        """returns entry i as dict (like parse_bfshell)"""
+        entry = {"table": self.names[self.table[i]], "action": self.names[self.action[i]], "match": {},
+                 "priority": self.priority[i] if self.priority[i] != NO_PRIORITY else None, "data": {}, "order": []}
+        for j in range(self.offset[i], self.offset[i+1]):
+            (name, kind, value) = (self.names[self.field[j]], self.kind[j], self.value[j])
+            if kind == KIND_EXACT:
+                entry["match"][name] = value
+                entry["order"].append(name)
+            elif kind == KIND_RANGE_START:
+                entry["match"][name] = (value, self.value[j+1])
+                entry["order"].append(name)
+            elif kind == KIND_DATA:
+                entry["data"][name] = value
+                entry["order"].append("action_" + name)
+        if entry["priority"] is not None:
+            entry["order"].insert(len(entry["match"]), "priority")
+        return entry
+
+    def tables(self):
+        """returns the table names in the order of their first entry"""
+        ids, first = np.unique(np.asarray(self.table, dtype=np.int64), return_index=True)
+        return [self.names[t] for t in ids[np.argsort(first)]]
+
+    def counts(self):
+        """returns the number of entries of each table"""
+        ids, counts = np.unique(np.asarray(self.table, dtype=np.int64), return_counts=True)
+        return {self.names[t]: int(c) for (t, c) in zip(ids, counts)}
+
+    @classmethod
+    def from_entries(cls, entries):
+        """returns the entries of a list of dicts (see parse_bfshell)"""
+        table_entries = cls()
+        for entry in entries:
+            order = entry.get("order") or sorted(entry["match"]) + ["action_" + n for n in sorted(entry["data"])]
+            match = [(n, entry["match"][n]) for n in order if n in entry["match"]]
+            data = [(n[len("action_"):], entry["data"][n[len("action_"):]]) for n in order if n.startswith("action_")]
+            table_entries.add(entry["table"], entry["action"], match, data, entry["priority"])
+        return table_entries
+
+    @classmethod
+    def from_bfshell(cls, lines):
+        return cls.from_entries(parse_bfshell(lines))
+
+    def to_bfshell(self):
+        """
+        Returns:
+            list of strings: one bfshell command per entry (and an empty line after the entries of each table)
+        """
+        lines = []
+        for i in range(len(self)):
+            if i > 0 and self.table[i] != self.table[i-1]:
+                lines.append("")
+            line = "pd %s add_entry %s" % (self.names[self.table[i]], self.names[self.action[i]])
+            priority_written = self.priority[i] == NO_PRIORITY
+            for j in range(self.offset[i], self.offset[i+1]):
+                (name, kind, value) = (self.names[self.field[j]], self.kind[j], self.value[j])
+                if kind == KIND_DATA and not priority_written:
+                    line += " priority %s" % hex(self.priority[i])
+                    priority_written = True
+                if kind == KIND_EXACT:
+                    line += " %s %s" % (name, hex(value))
+                elif kind == KIND_RANGE_START:
+                    line += " %s_start %s" % (name, hex(value))
+                elif kind == KIND_RANGE_END:
+                    line += " %s_end %s" % (name, hex(value))
+                else:
+                    line += " action_%s %s" % (name, hex(value))
+            if not priority_written:
+                line += " priority %s" % hex(self.priority[i])
+            lines.append(line)
+        if lines:
+            lines.append("")
+        return lines
+
+    def to_json(self):
+        """
+        Returns:
+            dict: version and list of entries (match and data in the order in which they were added)
+        """
+        entries = []
+        for i in range(len(self)):
+            entry = {"table": self.names[self.table[i]], "action": self.names[self.action[i]], "match": [], "data": [],
+                     "priority": self.priority[i] if self.priority[i] != NO_PRIORITY else None}
+            for j in range(self.offset[i], self.offset[i+1]):
+                (name, kind, value) = (self.names[self.field[j]], self.kind[j], self.value[j])
+                if kind == KIND_EXACT:
+                    entry["match"].append([name, value])
+                elif kind == KIND_RANGE_START:
+                    entry["match"].append([name, [value, self.value[j+1]]])
+                elif kind == KIND_DATA:
+                    entry["data"].append([name, value])
+            entries.append(entry)
+        return {"version": JSON_VERSION, "entries": entries}
+
+    @classmethod
+    def from_json(cls, info):
+        if info.get("version") != JSON_VERSION:
+            raise ValueError("unsupported table entries version: %s" % info.get("version"))
+        table_entries = cls()
+        for entry in info["entries"]:
+            match = [(n, tuple(v) if isinstance(v, list) else v) for (n, v) in entry["match"]]
+            table_entries.add(entry["table"], entry["action"], match, [tuple(d) for d in entry["data"]], entry["priority"])
+        return table_entries
+
+    def columns(self):
+        """
+        Returns:
+            dict: numpy array of each entry and value column (see ENTRY_COLUMNS and VALUE_COLUMNS)
+        """
+        columns = {}
+        for (name, dtype) in ENTRY_COLUMNS + VALUE_COLUMNS:
+            columns[name] = np.asarray(getattr(self, name), dtype=dtype)
+        return columns
+
+    def to_binary(self):
+        """
+        Layout (little endian):
+            "DTTE", version (u16), number of names (u32), number of entries (u32), number of values (u32),
+            length of the names (u32), names (utf-8, separated by "\\n"),
+            columns table (u16), action (u16), priority (i32), offset (u32, one more than the entries),
+            field (u16), kind (u8) and value (i64)
+
+        Returns:
+            string: binary representation
+        """
+        names = "\n".join(self.names).encode("utf-8")
+        header = struct.pack("<4sHIIII", BINARY_MAGIC, BINARY_VERSION, len(self.names), len(self), len(self.value), len(names))
+        columns = self.columns()
+        return header + names + "".join([columns[name].tobytes() for (name, dtype) in ENTRY_COLUMNS + VALUE_COLUMNS])
+
+    @classmethod
+    def from_binary(cls, data):
+        header_len = struct.calcsize("<4sHIIII")
+        (magic, version, num_names, num_entries, num_values, names_len) = struct.unpack("<4sHIIII", data[:header_len])
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise ValueError("unsupported table entries file (magic %r, version %i)" % (magic, version))
+
+        table_entries = cls()
+        position = header_len + names_len
+        names = data[header_len:position].decode("utf-8").split("\n") if num_names > 0 else []
+        for name in names:
+            table_entries.name_id(name)
+
+        lengths = {"offset": num_entries + 1}
+        for (name, dtype) in ENTRY_COLUMNS + VALUE_COLUMNS:
+            count = lengths.get(name, num_entries if (name, dtype) in ENTRY_COLUMNS else num_values)
+            column = np.frombuffer(data, dtype=dtype, count=count, offset=position)
+            position += column.nbytes
+            setattr(table_entries, name, array(getattr(table_entries, name).typecode, column.tolist()))
+        return table_entries
+
+    def write(self, filepath, format=None):
+        """writes the entries to a file (the format is derived from the extension if it is None)"""
+        format = format or FORMAT_EXTENSIONS.get(os.path.splitext(filepath)[1], "bfshell")
+        with open(filepath, "wb" if format == "binary" else "w") as f:
+            if format == "bfshell":
+                f.write("\n".join(self.to_bfshell()))
+            elif format == "json":
+                json.dump(self.to_json(), f)
+            else:
+                f.write(self.to_binary())
+
+    @classmethod
+    def load(cls, filepath, format=None):
+        """reads the entries from a file in any format (see write)"""
+        format = format or FORMAT_EXTENSIONS.get(os.path.splitext(filepath)[1], "bfshell")
+        with open(filepath, "rb" if format == "binary" else "r") as f:
+            if format == "bfshell":
+                return cls.from_bfshell(f)
+            elif format == "json":
+                return cls.from_json(json.load(f))
+            else:
+                return cls.from_binary(f.read())
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args ([str]): command line parameters as list of strings
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="volume obfuscation table entry converter")
+
+    parser.add_argument(
+        "--input",
+        type=str,
+        required=True,
+        help="table entries (bfshell input .txt, .json or .bin)")
+
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="write the entries to this file (format from the extension)")
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="store_const",
+        const=logging.INFO)
+
+    parser.add_argument(
+        "-vv",
+        "--very-verbose",
+        dest="loglevel",
+        help="set loglevel to DEBUG",
+        action="store_const",
+        const=logging.DEBUG)
+
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+
+    start = time.time()
+    entries = TableEntries.load(args.input)
+    log.info("loaded %i entries in %.3fs" % (len(entries), time.time() - start))
+
+    counts = entries.counts()
+    for table in entries.tables():
+        log.info("%-40s %5i entries" % (table, counts[table]))
+
+    if args.output:
+        entries.write(args.output)
+        log.info("wrote %s (%i bytes)" % (args.output, os.path.getsize(args.output)))
+
+
+def run():
+    """Entry point for console_scripts
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
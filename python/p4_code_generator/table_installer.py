@@ -0,0 +1,527 @@
+"""
+installs the generated table entries through a PD RPC session (instead of replaying the bfshell input).
+usage:
+python table_installer.py --entries ../../p4/traffic_pattern_tofino/bfshell_input_tofino1.txt --stub -v
+~/tools/run_pd_rpc.py -p traffic_pattern_tofino ~/ditto/p4/traffic_pattern_tofino/install_entries_pd_rpc.py
+
+The entries (any format of table_entries.py) are installed table by table with the
+<table>_table_add_with_<action> functions of the PD client. The entries of each table
+are added in a batch of the connection manager (flushed every --batch-size entries),
+so the driver writes them to the hardware in bulk instead of entry by entry. The
+installer reports the time of each table.
+
+PdRpcSession uses the PD client in the namespace of run_pd_rpc.py (see
+install_entries_pd_rpc.py). Besides adding entries, the sessions can modify and
+delete entries in atomic transactions and set shaping rates (see table_delta.py). For tests without a switch, StubServer records the calls
+of StubSession (with an optional latency per call) and --stub compares the recorded
+entries with the installed ones.
+"""
+
+import os, sys, time
+import argparse
+import itertools
+import logging
+import importlib
+from collections import OrderedDict
+from multiprocessing import Process
+from multiprocessing.connection import Listener, Client
+
+from table_entries import TableEntries
+
+
+def setup_logging(loglevel="DEBUG"):
+    """Setup basic logging
+
+    Args:
+      loglevel (int): minimum loglevel for emitting messages
+    """
+    logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
+    logging.basicConfig(level=loglevel, stream=sys.stdout,
+                        format=logformat, datefmt="%Y-%m-%d %H:%M:%S")
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+STUB_ADDRESS = ("localhost", 9191)
+STUB_AUTHKEY = "ditto"
+
+# thrift types of the fields of match and action specs (-> width of the signed thrift integer)
+THRIFT_INT_BITS = {3: 8, 6: 16, 8: 32, 10: 64}
+
+
+def to_thrift_int(value, ttype):
+    """returns value as signed thrift integer (e.g., 0xffff as i16 is -1, like hex_to_i16)"""
+    bits = THRIFT_INT_BITS.get(ttype)
+    if bits is not None and value >= 1 << (bits - 1):
+        value -= 1 << bits
+    return value
+
+
+def entry_key(entry):
+    """match fields, priority and action of an entry (to compare installed entries)"""
+    return (entry["table"], entry["action"], tuple(sorted(entry["match"].items())), entry["priority"], tuple(sorted(entry["data"].items())))
+
+
+def match_key(entry):
+    """match fields and priority of an entry (which identify an installed entry)"""
+    return (entry["table"], tuple(sorted(entry["match"].items())), entry["priority"])
+
+
+class PdRpcSession(object):
+    """
+    adds entries with the PD client of a P4 program
+    (in the namespace of run_pd_rpc.py: p4_pd, conn_mgr, sess_hdl, DevTarget_t)
+    """
+
+    def __init__(self, namespace, program, dev_id=0):
+        self.namespace = namespace
+        self.program = program
+        self.p4_pd = namespace["p4_pd"]
+        self.conn_mgr = namespace["conn_mgr"]
+        self.sess_hdl = namespace["sess_hdl"]
+        self.dev_tgt = namespace["DevTarget_t"](dev_id, to_thrift_int(0xFFFF, 6))
+
+        try:
+            self.ttypes = importlib.import_module("%s.p4_pd_rpc.ttypes" % program)
+        except ImportError:
+            self.ttypes = None
+
+    def spec_type(self, name):
+        if name in self.namespace:
+            return self.namespace[name]
+        if self.ttypes is not None and hasattr(self.ttypes, name):
+            return getattr(self.ttypes, name)
+        raise KeyError("PD type %s not found" % name)
+
+    def spec(self, name, values):
+        """returns a match or action spec with the given fields (converted to the thrift type of each field)"""
+        spec_type = self.spec_type(name)
+        ttypes = {s[2]: s[1] for s in getattr(spec_type, "thrift_spec", ()) or () if s is not None}
+        return spec_type(**{k: to_thrift_int(v, ttypes.get(k)) for (k, v) in values.items()})
+
+    def match_args(self, entry):
+        """returns the match spec and the priority (if any) of an entry"""
+        match = {}
+        for (field, value) in entry["match"].items():
+            if isinstance(value, tuple):
+                match["%s_start" % field] = value[0]
+                match["%s_end" % field] = value[1]
+            else:
+                match[field] = value
+
+        args = [self.spec("%s_%s_match_spec_t" % (self.program, entry["table"]), match)]
+        if entry["priority"] is not None:
+            args.append(entry["priority"])
+        return args
+
+    def action_args(self, entry):
+        """returns the action spec of an entry (if the action has data)"""
+        if not entry["data"]:
+            return []
+        data = {"action_%s" % k: v for (k, v) in entry["data"].items()}
+        return [self.spec("%s_%s_action_spec_t" % (self.program, entry["action"]), data)]
+
+    def entry_handle(self, entry):
+        function = getattr(self.p4_pd, "%s_match_spec_to_entry_hdl" % entry["table"])
+        return function(self.sess_hdl, self.dev_tgt, *self.match_args(entry))
+
+    def add(self, entry):
+        args = [self.sess_hdl, self.dev_tgt] + self.match_args(entry) + self.action_args(entry)
+        return getattr(self.p4_pd, "%s_table_add_with_%s" % (entry["table"], entry["action"]))(*args)
+
+    def modify(self, entry):
+        """changes the action (data) of the installed entry with the same match fields and priority"""
+        args = [self.sess_hdl, self.dev_tgt.dev_id, self.entry_handle(entry)] + self.action_args(entry)
+        return getattr(self.p4_pd, "%s_table_modify_with_%s" % (entry["table"], entry["action"]))(*args)
+
+    def delete(self, entry):
+        """deletes the installed entry with the same match fields and priority"""
+        return getattr(self.p4_pd, "%s_table_delete" % entry["table"])(self.sess_hdl, self.dev_tgt.dev_id, self.entry_handle(entry))
+
+    def set_shaping_rate(self, port, rate):
+        """sets the shaping rate (kbps) of a port (see init_pd_rpc.py)"""
+        tm = self.namespace["tm"]
+        tm.thrift.tm_enable_port_shaping(self.dev_tgt.dev_id, port)
+        tm.thrift.tm_set_port_shaping_rate(self.dev_tgt.dev_id, port, pps=False, rate=rate, burstsize=10000)
+
+    def begin_transaction(self):
+        """the following operations take effect at once with commit_transaction (atomic transaction)"""
+        self.conn_mgr.begin_txn(self.sess_hdl, True, False)
+
+    def commit_transaction(self):
+        self.conn_mgr.commit_txn(self.sess_hdl, True)
+
+    def begin_batch(self):
+        self.conn_mgr.begin_batch(self.sess_hdl)
+
+    def flush_batch(self):
+        self.conn_mgr.flush_batch(self.sess_hdl)
+
+    def end_batch(self):
+        self.conn_mgr.end_batch(self.sess_hdl, True)
+
+    def complete_operations(self):
+        self.conn_mgr.complete_operations(self.sess_hdl)
+
+
+class StubServer(object):
+    """
+    records the calls of StubSession like a switch
+    (tables reject duplicate keys, overlapping entries with the same priority and
+    modifications/deletions of missing entries; the operations of a transaction are
+    applied at once with commit_transaction; every call waits latency seconds)
+    """
+
+    def __init__(self, address=STUB_ADDRESS, authkey=STUB_AUTHKEY, latency=0.):
+        self.listener = Listener(address, authkey=authkey)
+        self.latency = latency
+        self.entries = OrderedDict()
+        self.shaping_rates = {}
+        self.in_batch = False
+        self.transaction = None
+        self.calls = {}
+
+    def apply(self, entries, call, entry):
+        """applies add/modify/delete to entries (dict match_key -> entry)"""
+        key = match_key(entry)
+        if call == "add" and key in entries:
+            raise ValueError("duplicate entry in %s: %s" % (entry["table"], entry["match"]))
+        if call != "add" and key not in entries:
+            raise ValueError("no entry in %s: %s" % (entry["table"], entry["match"]))
+        if call == "delete":
+            del entries[key]
+        else:
+            entries[key] = entry
+
+    def check_overlap(self, entries, entry):
+        """raises an error if another entry with the same priority matches some of the packets of entry"""
+        if entry["priority"] is None:
+            return
+        for other in entries.values():
+            if other is entry or other["table"] != entry["table"] or other["priority"] != entry["priority"]:
+                continue
+            if all([overlap(entry["match"][f], other["match"].get(f)) for f in entry["match"]]):
+                raise ValueError("overlapping entries with priority %i in %s: %s and %s" \
+                    % (entry["priority"], entry["table"], entry["match"], other["match"]))
+
+    def handle(self, call, args):
+        self.calls[call] = self.calls.get(call, 0) + 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        if call in ["add", "modify", "delete"] and self.transaction is not None:
+            self.transaction.append((call, args))
+        elif call in ["add", "modify", "delete"]:
+            self.apply(self.entries, call, args[0])
+            if call == "add":
+                self.check_overlap(self.entries, self.entries[match_key(args[0])])
+        elif call == "begin_transaction":
+            if self.transaction is not None:
+                raise ValueError("transaction already started")
+            self.transaction = []
+        elif call == "commit_transaction":
+            if self.transaction is None:
+                raise ValueError("no transaction")
+            (transaction, self.transaction) = (self.transaction, None)
+            entries = OrderedDict(self.entries)
+            for (c, a) in transaction:
+                self.apply(entries, c, a[0])
+            for (c, a) in transaction:
+                if c == "add":
+                    self.check_overlap(entries, entries[match_key(a[0])])
+            self.entries = entries
+        elif call == "set_shaping_rate":
+            self.shaping_rates[args[0]] = args[1]
+        elif call == "begin_batch":
+            self.in_batch = True
+        elif call == "end_batch":
+            self.in_batch = False
+        elif call in ["flush_batch", "complete_operations"]:
+            pass
+        elif call == "entries":
+            return self.entries.values()
+        elif call == "shaping_rates":
+            return self.shaping_rates
+        elif call == "calls":
+            return self.calls
+        else:
+            raise ValueError("unknown call %s" % call)
+
+    def serve(self, connections=1):
+        """handles the calls of the given number of connections (one after the other)"""
+        for _ in range(connections):
+            connection = self.listener.accept()
+            while True:
+                try:
+                    (call, args) = connection.recv()
+                except EOFError:
+                    break
+                if call == "close":
+                    break
+                try:
+                    connection.send(("ok", self.handle(call, args)))
+                except Exception as e:
+                    connection.send(("error", str(e)))
+            connection.close()
+        self.listener.close()
+
+
+def overlap(a, b):
+    """returns True if two match values (int or range tuple) match a common value"""
+    if b is None:
+        return True
+    (a, b) = [v if isinstance(v, tuple) else (v, v) for v in [a, b]]
+    return a[0] <= b[1] and b[0] <= a[1]
+
+
+def serve_stub(address, authkey, latency, connections=1):
+    StubServer(address, authkey, latency).serve(connections)
+
+
+class StubSession(object):
+    """session with the interface of PdRpcSession which sends all calls to a StubServer"""
+
+    def __init__(self, address=STUB_ADDRESS, authkey=STUB_AUTHKEY, timeout=5.):
+        start = time.time()
+        while True:
+            try:
+                self.connection = Client(address, authkey=authkey)
+                break
+            except IOError:
+                # the server is not listening yet
+                if time.time() - start > timeout:
+                    raise
+                time.sleep(.05)
+
+    def call(self, name, *args):
+        self.connection.send((name, args))
+        (status, result) = self.connection.recv()
+        if status != "ok":
+            raise RuntimeError(result)
+        return result
+
+    def add(self, entry):
+        return self.call("add", {k: entry[k] for k in "table action match priority data".split()})
+
+    def modify(self, entry):
+        return self.call("modify", {k: entry[k] for k in "table action match priority data".split()})
+
+    def delete(self, entry):
+        return self.call("delete", {k: entry[k] for k in "table action match priority data".split()})
+
+    def set_shaping_rate(self, port, rate):
+        self.call("set_shaping_rate", port, rate)
+
+    def begin_transaction(self):
+        self.call("begin_transaction")
+
+    def commit_transaction(self):
+        self.call("commit_transaction")
+
+    def begin_batch(self):
+        self.call("begin_batch")
+
+    def flush_batch(self):
+        self.call("flush_batch")
+
+    def end_batch(self):
+        self.call("end_batch")
+
+    def complete_operations(self):
+        self.call("complete_operations")
+
+    def installed_entries(self):
+        return self.call("entries")
+
+    def shaping_rates(self):
+        return self.call("shaping_rates")
+
+    def close(self):
+        self.connection.send(("close", ()))
+        self.connection.close()
+
+
+class TableInstaller(object):
+
+    def __init__(self, session, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Args:
+            session: PdRpcSession or StubSession
+            batch_size (int): number of entries after which a batch is flushed
+        """
+        self.session = session
+        self.batch_size = batch_size
+
+    def install(self, entries):
+        """
+        installs the entries (in their order) with one batch per table
+
+        Returns:
+            list of dicts: table, entries, batches and seconds of each table (in the order of installation)
+        """
+        report = []
+        for (table, table_entries) in itertools.groupby(entries, key=lambda e: e["table"]):
+            start = time.time()
+            count = 0
+
+            self.session.begin_batch()
+            for entry in table_entries:
+                self.session.add(entry)
+                count += 1
+                if count % self.batch_size == 0:
+                    self.session.flush_batch()
+            self.session.end_batch()
+
+            batches = max((count + self.batch_size - 1) // self.batch_size, 1)
+            report.append({"table": table, "entries": count, "batches": batches, "seconds": time.time() - start})
+            log.debug("%s: %i entries in %.3fs" % (table, count, report[-1]["seconds"]))
+
+        self.session.complete_operations()
+        return report
+
+
+def format_report(report):
+    lines = []
+    for r in report:
+        lines.append("%-40s %5i entries %3i batches %8.3fs (%8.0f entries/s)" \
+            % (r["table"], r["entries"], r["batches"], r["seconds"], r["entries"] / max(r["seconds"], 1e-9)))
+    total = sum([r["seconds"] for r in report])
+    num_entries = sum([r["entries"] for r in report])
+    lines.append("%-40s %5i entries %3i batches %8.3fs (%8.0f entries/s)" \
+        % ("total", num_entries, sum([r["batches"] for r in report]), total, num_entries / max(total, 1e-9)))
+    return lines
+
+
+def verify(entries, installed):
+    """
+    Returns:
+        list of strings: entries which are missing or were installed additionally
+    """
+    expected = [entry_key(e) for e in entries]
+    actual = [entry_key(e) for e in installed]
+    (expected_set, actual_set) = (set(expected), set(actual))
+    missing = [e for e in expected if e not in actual_set]
+    additional = [e for e in actual if e not in expected_set]
+    return ["missing: %s" % (e,) for e in missing] + ["additional: %s" % (e,) for e in additional]
+
+
+def parse_address(address):
+    (host, port) = address.rsplit(":", 1)
+    return (host, int(port))
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args ([str]): command line parameters as list of strings
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="volume obfuscation table entry installer")
+
+    parser.add_argument(
+        "--entries",
+        type=str,
+        default=None,
+        help="table entries written by generate_code.py (bfshell input, .json or .bin)")
+
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="flush the batch after this many entries")
+
+    parser.add_argument(
+        "--stub",
+        dest="stub",
+        help="install the entries on a local stub server and compare the installed entries",
+        action="store_true")
+
+    parser.add_argument(
+        "--serve",
+        type=str,
+        default=None,
+        help="only run a stub server on this address (host:port)")
+
+    parser.add_argument(
+        "--connect",
+        type=str,
+        default=None,
+        help="install the entries on the stub server with this address (host:port)")
+
+    parser.add_argument(
+        "--stub-latency",
+        type=float,
+        default=0.,
+        help="latency of each call to the stub server (s)")
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="store_const",
+        const=logging.INFO)
+
+    parser.add_argument(
+        "-vv",
+        "--very-verbose",
+        dest="loglevel",
+        help="set loglevel to DEBUG",
+        action="store_const",
+        const=logging.DEBUG)
+
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+
+    if args.serve:
+        log.info("stub server on %s" % args.serve)
+        while True:
+            serve_stub(parse_address(args.serve), STUB_AUTHKEY, args.stub_latency)
+
+    if not args.entries or not (args.stub or args.connect):
+        log.error("--entries and --stub or --connect are required (use install_entries_pd_rpc.py on the switch)")
+        sys.exit(1)
+
+    entries = list(TableEntries.load(args.entries))
+
+    address = parse_address(args.connect) if args.connect else STUB_ADDRESS
+    server = None
+    if args.stub:
+        server = Process(target=serve_stub, args=(address, STUB_AUTHKEY, args.stub_latency))
+        server.start()
+
+    session = StubSession(address, STUB_AUTHKEY)
+    report = TableInstaller(session, args.batch_size).install(entries)
+    for line in format_report(report):
+        log.info(line)
+
+    mismatches = verify(entries, session.installed_entries())
+    session.close()
+    if server is not None:
+        server.join()
+
+    for mismatch in mismatches:
+        log.error(mismatch)
+    if mismatches:
+        sys.exit(1)
+    log.info("installed %i entries" % len(entries))
+
+
+def run():
+    """Entry point for console_scripts
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
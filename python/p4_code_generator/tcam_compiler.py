@@ -0,0 +1,393 @@
+"""
+compiler for the range-matched table entries in the generated bfshell input.
+usage:
+python tcam_compiler.py --bfshell ../../p4/traffic_pattern_tofino/bfshell_input_tofino1.txt -v
+
+The generator writes overlapping, priority-ordered ranges (e.g., one entry per pad count
+and smaller next pad in add_padding_*, all ending at MTU). For each group of entries with
+the same exact-match key, the compiler splits the range field into elementary intervals
+(between consecutive range boundaries), determines the winning entry of each interval,
+and merges neighbouring intervals with the same action and action data. The result is
+the smallest set of non-overlapping ranges with the same lookup result for every key.
+
+Ranges are stored in TCAM as prefixes; the cost of a table is estimated with the
+binary range-to-prefix expansion (an upper bound for the range encoding of Tofino).
+"""
+
+import os, sys, time
+import argparse
+import logging
+
+import numpy as np
+
+from table_entries import parse_bfshell
+from bfshell_interpreter import Table
+
+
+def setup_logging(loglevel="DEBUG"):
+    """Setup basic logging
+
+    Args:
+      loglevel (int): minimum loglevel for emitting messages
+    """
+    logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
+    logging.basicConfig(level=loglevel, stream=sys.stdout,
+                        format=logformat, datefmt="%Y-%m-%d %H:%M:%S")
+
+log = logging.getLogger(__name__)
+
+# widths (in bits) of the match fields (see headers.p4 and traffic_pattern_tofino.p4)
+FIELD_WIDTHS = {
+    "custom_metadata_bytes_to_add"      : 12,
+    "custom_metadata_packet_iterator"   : 8,
+    "padding_meta_totalLen"             : 16,
+    "padding_meta_origLen"              : 16,
+    "padding_meta_traffic_type"         : 4,
+    "padding_meta_instance_type"        : 4,
+    "ig_intr_md_ingress_port"           : 9,
+}
+
+# TCAM blocks of Tofino: 512 entries x 44 bits
+TCAM_BLOCK_ENTRIES = 512
+TCAM_BLOCK_WIDTH = 44
+
+
+def range_to_prefixes(start, end, width):
+    """splits [start, end] into the smallest set of prefixes
+
+    Returns:
+        list of (int, int): value and prefix length of each prefix
+    """
+    prefixes = []
+    while start <= end:
+        # largest aligned block starting at start which fits into [start, end]
+        size = start & -start if start > 0 else 1 << width
+        while size > end - start + 1:
+            size >>= 1
+        prefixes.append((start, width - size.bit_length() + 1))
+        start += size
+    return prefixes
+
+
+def prefix_expansion(start, end, width):
+    """returns the number of TCAM entries needed for the range [start, end]"""
+    return len(range_to_prefixes(start, end, width))
+
+
+def range_field(entries):
+    """returns the name of the range field of a table (None if it has none or more than one)"""
+    fields = set()
+    for entry in entries:
+        fields |= set([k for (k,v) in entry["match"].items() if isinstance(v, tuple)])
+    return fields.pop() if len(fields) == 1 else None
+
+
+def signature(entry):
+    """action and action data of an entry"""
+    return (entry["action"],) + tuple(sorted(entry["data"].items()))
+
+
+def exact_key(entry):
+    return tuple(sorted([(k,v) for (k,v) in entry["match"].items() if not isinstance(v, tuple)]))
+
+
+def table_cost(entries):
+    """
+    estimates the TCAM usage of a table
+
+    Returns:
+        dict: entries, tcam_entries, key_width, tcam_blocks
+    """
+    tcam_entries = 0
+    key_width = 0
+    for entry in entries:
+        expansion = 1
+        width = 0
+        for (field, value) in entry["match"].items():
+            width += FIELD_WIDTHS.get(field, 16)
+            if isinstance(value, tuple):
+                expansion *= prefix_expansion(value[0], value[1], FIELD_WIDTHS.get(field, 16))
+        tcam_entries += expansion
+        key_width = max(key_width, width)
+
+    blocks = int(np.ceil(tcam_entries * 1. / TCAM_BLOCK_ENTRIES)) * int(np.ceil(key_width * 1. / TCAM_BLOCK_WIDTH)) if tcam_entries > 0 else 0
+    return {
+        "entries"       : len(entries),
+        "tcam_entries"  : tcam_entries,
+        "key_width"     : key_width,
+        "tcam_blocks"   : blocks,
+    }
+
+
+def compile_table(entries):
+    """
+    replaces the (overlapping, priority-ordered) entries of one table
+    by the smallest set of non-overlapping entries with the same lookup result
+
+    Returns:
+        list of entries (entries of tables without a single range field are returned unchanged)
+    """
+    field = range_field(entries)
+    if field is None:
+        return entries
+    width = FIELD_WIDTHS.get(field, 16)
+
+    groups = []
+    by_key = {}
+    for entry in entries:
+        key = exact_key(entry)
+        if key not in by_key:
+            by_key[key] = []
+            groups.append(key)
+        by_key[key].append(entry)
+
+    compiled = []
+    for key in groups:
+        table = Table(None, by_key[key])
+
+        # elementary intervals: [boundaries[k], boundaries[k+1]-1]
+        boundaries = set([0, 1 << width])
+        for entry in table.entries:
+            (start, end) = entry["match"][field]
+            boundaries.add(start)
+            boundaries.add(end + 1)
+        boundaries = np.array(sorted([b for b in boundaries if 0 <= b <= 1 << width]), dtype=np.int64)
+
+        keys = {k: np.full(len(boundaries) - 1, v, dtype=np.int64) for (k,v) in key}
+        keys[field] = boundaries[:-1]
+        hit = table.lookup(keys)
+
+        intervals = []
+        for (k, i) in enumerate(hit):
+            if i < 0:
+                continue
+            (start, end) = (int(boundaries[k]), int(boundaries[k+1]) - 1)
+            winner = table.entries[i]
+            if intervals and intervals[-1][1] == start - 1 and signature(intervals[-1][2]) == signature(winner):
+                intervals[-1][1] = end
+            else:
+                intervals.append([start, end, winner])
+
+        for (start, end, winner) in intervals:
+            entry = dict(winner)
+            entry["match"] = dict(winner["match"])
+            entry["match"][field] = (start, end)
+            entry["data"] = dict(winner["data"])
+            compiled.append(entry)
+
+    for (priority, entry) in enumerate(compiled):
+        entry["priority"] = priority + 1
+    return compiled
+
+
+def verify(original, compiled):
+    """
+    checks that both entry sets have the same lookup result for every value of the range field
+    (for each exact-match key of the original entries)
+
+    Returns:
+        list of strings: mismatches
+    """
+    field = range_field(original)
+    if field is None:
+        return []
+    domain = np.arange(1 << FIELD_WIDTHS.get(field, 16), dtype=np.int64)
+
+    original_table = Table(None, original)
+    compiled_table = Table(None, compiled)
+    original_signatures = np.array([str(signature(e)) for e in original_table.entries] + ["miss"])
+    compiled_signatures = np.array([str(signature(e)) for e in compiled_table.entries] + ["miss"])
+
+    mismatches = []
+    for key in sorted(set([exact_key(e) for e in original])):
+        keys = {k: np.full(len(domain), v, dtype=np.int64) for (k,v) in key}
+        keys[field] = domain
+        a = original_signatures[original_table.lookup(keys)]
+        b = compiled_signatures[compiled_table.lookup(keys)]
+        different = np.nonzero(a != b)[0]
+        if len(different) > 0:
+            mismatches.append("%s %s: %s=%i maps to %s instead of %s" \
+                % (original[0]["table"], dict(key), field, different[0], b[different[0]], a[different[0]]))
+    return mismatches
+
+
+def format_entry(entry):
+    """returns the bfshell line of an entry"""
+    line = "pd %s add_entry %s" % (entry["table"], entry["action"])
+    for name in entry["order"]:
+        if name == "priority":
+            line += " priority %s" % hex(entry["priority"])
+        elif name.startswith("action_"):
+            line += " %s %s" % (name, hex(entry["data"][name[len("action_"):]]))
+        elif isinstance(entry["match"][name], tuple):
+            line += " %s_start %s %s_end %s" % (name, hex(entry["match"][name][0]), name, hex(entry["match"][name][1]))
+        else:
+            line += " %s %s" % (name, hex(entry["match"][name]))
+    return line
+
+
+def compile_tables(entries):
+    """
+    compiles the entries of each range-matched table
+    (tables keep their original entries if compiling does not reduce the number of TCAM entries)
+
+    Args:
+        entries (dict): table name -> list of entries
+
+    Returns:
+        (dict, dict): compiled entries and the cost of each table before and after compilation
+    """
+    report = {}
+    compiled = {}
+    for (table, table_entries) in entries.items():
+        compiled[table] = compile_table(table_entries)
+        mismatches = verify(table_entries, compiled[table])
+        if mismatches:
+            raise ValueError("compiled entries of %s differ: %s" % (table, "; ".join(mismatches)))
+        report[table] = {"before": table_cost(table_entries), "after": table_cost(compiled[table])}
+
+        # overlapping ranges can be cheaper in TCAM (e.g., ranges which end at the largest value)
+        if report[table]["after"]["tcam_entries"] > report[table]["before"]["tcam_entries"]:
+            compiled[table] = table_entries
+            report[table]["after"] = report[table]["before"]
+    return compiled, report
+
+
+def compact_entries(entries):
+    """
+    compiles the range-matched tables of a list of entries
+    (the compiled entries of a table replace its first entry)
+
+    Returns:
+        (list, dict): entries and the cost of each compiled table before and after compilation
+    """
+    tables = {}
+    output = []
+    for entry in entries:
+        if range_field([entry]) is not None:
+            if entry["table"] not in tables:
+                tables[entry["table"]] = []
+                output.append(entry["table"])
+            tables[entry["table"]].append(entry)
+        else:
+            output.append(entry)
+
+    compiled, report = compile_tables(tables)
+
+    entries = []
+    for item in output:
+        if isinstance(item, dict):
+            entries.append(item)
+        else:
+            entries += compiled[item]
+    return entries, report
+
+
+def compact_cli(lines):
+    """
+    compiles the range-matched tables of a bfshell input
+    (the compiled entries of a table replace the line of its first entry)
+
+    Returns:
+        (list, dict): lines and the cost of each compiled table before and after compilation
+    """
+    entries = {}
+    output = []
+    for line in lines:
+        parsed = parse_bfshell([line])
+        if parsed and range_field([parsed[0]]) is not None:
+            table = parsed[0]["table"]
+            if table not in entries:
+                entries[table] = []
+                output.append(table)
+            entries[table].append(parsed[0])
+        else:
+            output.append(line)
+
+    compiled, report = compile_tables(entries)
+
+    lines = []
+    for line in output:
+        if line in compiled:
+            lines += [format_entry(e) for e in compiled[line]]
+        else:
+            lines.append(line)
+    return lines, report
+
+
+def format_report(report):
+    lines = []
+    for table in sorted(report):
+        (before, after) = (report[table]["before"], report[table]["after"])
+        lines.append("%-40s entries %3i -> %3i, TCAM entries %4i -> %4i, TCAM blocks %i -> %i" \
+            % (table, before["entries"], after["entries"], before["tcam_entries"], after["tcam_entries"], before["tcam_blocks"], after["tcam_blocks"]))
+    return lines
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args ([str]): command line parameters as list of strings
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="volume obfuscation range table compiler")
+
+    parser.add_argument(
+        "--bfshell",
+        type=str,
+        required=True,
+        help="bfshell input file written by generate_code.py")
+
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="write the bfshell input with the compiled entries to this file")
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="store_const",
+        const=logging.INFO)
+
+    parser.add_argument(
+        "-vv",
+        "--very-verbose",
+        dest="loglevel",
+        help="set loglevel to DEBUG",
+        action="store_const",
+        const=logging.DEBUG)
+
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+
+    with open(args.bfshell) as f:
+        lines = f.read().split("\n")
+
+    compacted, report = compact_cli(lines)
+    for line in format_report(report):
+        log.info(line)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write("\n".join(compacted))
+
+
+def run():
+    """Entry point for console_scripts
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,168 @@
+"""
+helpers to read production traffic traces (pcap files or packet size histograms).
+
+Packet sizes are frame sizes without FCS (i.e. IPv4 total length + 14 bytes),
+which is what the switch stores in padding_meta.totalLen.
+"""
+
+import os
+import json
+import struct
+import logging
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# pcap magic numbers (microsecond and nanosecond resolution)
+PCAP_MAGIC_US = 0xa1b2c3d4
+PCAP_MAGIC_NS = 0xa1b23c4d
+
+
+def read_pcap(filepath, max_packets=None):
+    """reads a (classic libpcap) pcap file
+
+    Args:
+        filepath (string): path to the pcap file
+        max_packets (int): stop after this many packets (None: read everything)
+
+    Returns:
+        (numpy.ndarray, numpy.ndarray): timestamps in seconds and frame sizes in bytes
+    """
+    timestamps = []
+    sizes = []
+
+    with open(filepath, "rb") as f:
+        global_header = f.read(24)
+        if len(global_header) < 24:
+            raise ValueError("%s is not a pcap file" % filepath)
+
+        for endianness in "<>":
+            magic = struct.unpack(endianness + "I", global_header[:4])[0]
+            if magic in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+                break
+        else:
+            raise ValueError("%s is not a pcap file (pcapng is not supported)" % filepath)
+
+        ts_resolution = 1e-9 if magic == PCAP_MAGIC_NS else 1e-6
+        record_header = struct.Struct(endianness + "IIII")
+
+        while max_packets is None or len(sizes) < max_packets:
+            header = f.read(record_header.size)
+            if len(header) < record_header.size:
+                break
+            (ts_sec, ts_frac, incl_len, orig_len) = record_header.unpack(header)
+            timestamps.append(ts_sec + ts_frac * ts_resolution)
+            sizes.append(orig_len)
+            f.seek(incl_len, os.SEEK_CUR)
+
+    log.info("read %i packets from %s" % (len(sizes), filepath))
+
+    return np.array(timestamps, dtype=np.float64), np.array(sizes, dtype=np.int64)
+
+
+def read_histogram(filepath):
+    """reads a packet size histogram
+
+    Supported formats:
+    - JSON: {"<size>": <count>, ...}
+    - CSV: one "<size>,<count>" pair per line (lines starting with # and a header line are ignored)
+
+    Args:
+        filepath (string): path to the histogram file
+
+    Returns:
+        (numpy.ndarray, numpy.ndarray): packet sizes and their counts
+    """
+    if filepath.endswith(".json"):
+        with open(filepath) as f:
+            histogram = json.load(f)
+        items = [(int(k), float(v)) for (k,v) in histogram.items()]
+    else:
+        items = []
+        with open(filepath) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                fields = line.replace(";", ",").split(",")
+                try:
+                    items.append((int(fields[0]), float(fields[1])))
+                except ValueError:
+                    # header line
+                    continue
+
+    if not items:
+        raise ValueError("no histogram entries in %s" % filepath)
+
+    items.sort()
+    return np.array([s for (s,_) in items], dtype=np.int64), np.array([c for (_,c) in items], dtype=np.float64)
+
+
+def size_histogram(sizes, counts=None, max_size=None):
+    """returns a dense histogram (index = packet size)
+
+    Args:
+        sizes (numpy.ndarray): packet sizes
+        counts (numpy.ndarray): number of packets per entry in sizes (None: one packet each)
+        max_size (int): length of the histogram - 1 (None: largest packet size)
+
+    Returns:
+        numpy.ndarray: number of packets for each size in [0, max_size]
+    """
+    sizes = np.asarray(sizes, dtype=np.int64)
+    if max_size is None:
+        max_size = int(sizes.max())
+    return np.bincount(sizes, weights=counts, minlength=max_size+1).astype(np.float64)
+
+
+def load_packet_sizes(filepath):
+    """reads packet sizes from a pcap file or a histogram file
+
+    Returns:
+        (numpy.ndarray, numpy.ndarray): packet sizes and their counts
+    """
+    if filepath.endswith(".pcap") or filepath.endswith(".cap"):
+        _, sizes = read_pcap(filepath)
+        return np.unique(sizes, return_counts=True)
+    else:
+        return read_histogram(filepath)
+
+
+def read_trace_csv(filepath):
+    """reads a packet trace from a CSV file with one "<timestamp>,<size>" pair per line
+    (timestamps in seconds, lines starting with # and a header line are ignored)
+
+    Returns:
+        (numpy.ndarray, numpy.ndarray): timestamps in seconds and frame sizes in bytes
+    """
+    timestamps = []
+    sizes = []
+    with open(filepath) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = line.replace(";", ",").split(",")
+            try:
+                timestamps.append(float(fields[0]))
+                sizes.append(int(fields[1]))
+            except ValueError:
+                # header line
+                continue
+
+    log.info("read %i packets from %s" % (len(sizes), filepath))
+
+    return np.array(timestamps, dtype=np.float64), np.array(sizes, dtype=np.int64)
+
+
+def load_trace(filepath):
+    """reads a packet trace (timestamps and sizes) from a pcap file or a CSV file
+
+    Returns:
+        (numpy.ndarray, numpy.ndarray): timestamps in seconds and frame sizes in bytes
+    """
+    if filepath.endswith(".pcap") or filepath.endswith(".cap"):
+        return read_pcap(filepath)
+    else:
+        return read_trace_csv(filepath)
@@ -0,0 +1,441 @@
+"""
+daemon which keeps the chaff pools of the clone loops at the injection plan.
+Requires python 3.7 or later (asyncio.run), unlike the other tools of this repository (python 2.7).
+usage:
+sudo python3 chaff_daemon.py --interface ens785f0 \
+    --plan ../../p4/traffic_pattern_tofino/chaff_plan_tofino1.json ../../p4/traffic_pattern_tofino/chaff_plan_tofino2.json -v
+python3 chaff_daemon.py --stub --stub-loss .05 --duration 10 \
+    --plan ../../p4/traffic_pattern_tofino/chaff_plan_tofino1.json ../../p4/traffic_pattern_tofino/chaff_plan_tofino2.json -v
+
+Chaff packets leave the clone loops of the fake traffic ports with drops, port flaps and
+restarts of the switch. The daemon polls the transmitted frames of the fake traffic ports of
+every device in the plans (see chaff_pool.py) from one process. A chaff packet in a loop is
+sent once per loop RTT, so a port which sent frames at rate r in the last poll interval carries
+    population = r * loop_rtt
+chaff packets. The population of a port is split among its states by their planned packets
+(exact for one state per fake traffic port, the default). A state with less than --threshold
+of its planned packets is topped up with its missing chaff, which is sent in batches over a raw
+socket (see raw_injector.py) and paced by a token bucket at the injection rate of the plans.
+After a top-up, the next poll interval of the device starts anew, so that the estimate does not
+mix frames from before and after the injection.
+
+The counters are read through a backend:
+    PdRpcCounters   chaff_counters_pd_rpc.py on the switch (run_pd_rpc.py, JSON lines over TCP,
+                    the switch is reached by its device name unless --switch is given)
+    StubLoops       simulated clone loops (with --stub-loss, a chaff packet is lost with this
+                    rate per second), which also receive the injected chaff; for tests without
+                    a switch or a raw socket
+"""
+
+import os, sys, time
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import signal
+
+from raw_injector import RawInjector, TokenBucket, chaff_frame, MIN_FRAME_SIZE, WIRE_OVERHEAD
+from inject_chaff_packets import DEVICE_MAC_PREFIX
+
+
+def setup_logging(loglevel="DEBUG"):
+    """Setup basic logging
+
+    Args:
+      loglevel (int): minimum loglevel for emitting messages
+    """
+    logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
+    logging.basicConfig(level=loglevel, stream=sys.stdout,
+                        format=logformat, datefmt="%Y-%m-%d %H:%M:%S")
+
+log = logging.getLogger(__name__)
+
+# see chaff_counters_pd_rpc.py
+DEFAULT_COUNTER_PORT = 9192
+DEFAULT_POLL_INTERVAL = 1.
+# top up a state below this share of its planned packets
+DEFAULT_THRESHOLD = .9
+
+
+class PdRpcCounters(object):
+    """reads the transmitted frames and bytes of ports from chaff_counters_pd_rpc.py on a switch"""
+
+    def __init__(self, host, port=DEFAULT_COUNTER_PORT, timeout=5.):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    async def counters(self, ports):
+        """returns port -> (frames, bytes) (reconnects after errors)"""
+        try:
+            if self.writer is None:
+                (self.reader, self.writer) = await asyncio.wait_for(asyncio.open_connection(*self.address), self.timeout)
+            self.writer.write((json.dumps({"ports": ports}) + "\n").encode())
+            await self.writer.drain()
+            line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+            if not line:
+                raise ConnectionError("connection closed by %s:%i" % self.address)
+        except (OSError, asyncio.TimeoutError):
+            await self.close()
+            raise
+        response = json.loads(line)
+        if "error" in response:
+            raise ValueError(response["error"])
+        return {int(port): tuple(values) for (port, values) in response.items()}
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        (self.reader, self.writer) = (None, None)
+
+
+def binomial(rng, n, p):
+    """
+    returns the number of successes of n trials with probability p, drawn with one random number
+    (inversion of the distribution function, normal approximation for large variances)
+    """
+    if n <= 0 or p <= 0.:
+        return 0
+    if p >= 1.:
+        return n
+    if n * p * (1 - p) > 100:
+        return min(max(int(round(rng.gauss(n * p, math.sqrt(n * p * (1 - p))))), 0), n)
+    u = rng.random()
+    k = 0
+    pmf = (1 - p) ** n
+    cdf = pmf
+    while cdf < u and k < n:
+        pmf *= (n - k) / (k + 1.) * p / (1 - p)
+        k += 1
+        cdf += pmf
+    return k
+
+
+class StubLoops(object):
+    """
+    simulated clone loops of a device: every chaff packet is sent once per loop RTT on its fake
+    traffic port and lost with loss_rate per second
+    """
+
+    def __init__(self, loop_rtt, loss_rate=0., seed=None):
+        self.loop_rtt = loop_rtt
+        self.loss_rate = loss_rate
+        self.random = random.Random(seed)
+        self.population = {}
+        self.frames = {}
+        self.bytes = {}
+        self.last = time.time()
+
+    def advance(self):
+        now = time.time()
+        seconds = now - self.last
+        self.last = now
+        loss = 1 - math.exp(-self.loss_rate * seconds)
+        for (port, sizes) in self.population.items():
+            for (size, count) in list(sizes.items()):
+                # (packets which are lost in this interval are counted for the whole interval)
+                self.frames[port] = self.frames.get(port, 0) + count * seconds / self.loop_rtt
+                self.bytes[port] = self.bytes.get(port, 0) + count * size * seconds / self.loop_rtt
+                sizes[size] = count - binomial(self.random, count, loss)
+
+    def inject(self, port, size, count):
+        self.advance()
+        sizes = self.population.setdefault(port, {})
+        sizes[size] = sizes.get(size, 0) + count
+
+    async def counters(self, ports):
+        self.advance()
+        return {port: (int(self.frames.get(port, 0)), int(self.bytes.get(port, 0))) for port in ports}
+
+    async def close(self):
+        pass
+
+
+class ChaffPool(object):
+    """chaff pool of one device: its injection plan, counter backend and last counters"""
+
+    def __init__(self, plan, backend, loop_rtt=None):
+        """
+        Args:
+            plan (dict): chaff_plan_X.json (see chaff_pool.py)
+            backend: PdRpcCounters or StubLoops
+            loop_rtt (float): loop RTT of the estimate (default: the RTT of the plan)
+        """
+        if plan["device"] not in DEVICE_MAC_PREFIX:
+            raise ValueError("no source MAC prefix for the chaff of %s (see DEVICE_MAC_PREFIX)" % plan["device"])
+        self.device = plan["device"]
+        self.states = plan["states"]
+        self.backend = backend
+        self.loop_rtt = loop_rtt or plan["loop_rtt"]
+        self.ports = sorted(set([s["fake_port"] for s in self.states]))
+        self.last = None
+        self.top_ups = 0
+        self.injected = 0
+
+    def frame(self, state):
+        fields = {"ETH_src": "%i:0:0:0:0:%i" % (DEVICE_MAC_PREFIX[self.device], state["fake_port_index"])}
+        return chaff_frame(max(state["chaff_size"], MIN_FRAME_SIZE), fields)
+
+    def estimate(self, previous, current, seconds):
+        """
+        returns the estimated chaff packets of each state (None if the counters of a port went
+        back, e.g., after a restart of the switch)
+        """
+        populations = {}
+        for port in self.ports:
+            frames = current[port][0] - previous[port][0]
+            if frames < 0:
+                return None
+            populations[port] = frames / seconds * self.loop_rtt
+
+        estimates = []
+        for state in self.states:
+            planned = sum([s["packets"] for s in self.states if s["fake_port"] == state["fake_port"]])
+            estimates.append(populations[state["fake_port"]] * state["packets"] / planned if planned else 0)
+        return estimates
+
+
+class ChaffDaemon(object):
+
+    def __init__(self, pools, injector, bucket=None, interval=DEFAULT_POLL_INTERVAL, threshold=DEFAULT_THRESHOLD):
+        """
+        Args:
+            pools (list): ChaffPool of each device
+            injector: RawInjector (None: inject into the StubLoops backends)
+            bucket (TokenBucket): pacing of the injection
+            interval (float): seconds between two polls of a device
+            threshold (float): top up a state below this share of its planned packets
+        """
+        self.pools = pools
+        self.injector = injector
+        self.bucket = bucket
+        self.interval = interval
+        self.threshold = threshold
+        # all devices share the interface (behind the evaluation proxy)
+        self.lock = asyncio.Lock()
+
+    async def inject(self, pool, state, count):
+        if self.injector is None:
+            pool.backend.inject(state["fake_port"], state["chaff_size"], count)
+            return
+        frames = [pool.frame(state)]
+        async with self.lock:
+            result = await asyncio.get_running_loop().run_in_executor(None, self.injector.send, frames, count, self.bucket)
+        log.debug("%s: sent %i packets in %.3fs" % (pool.device, result["packets"], result["seconds"]))
+
+    async def top_up(self, pool, estimates):
+        """injects the missing chaff of the states below the threshold, returns the injected packets"""
+        injected = 0
+        for (state, estimate) in zip(pool.states, estimates):
+            missing = int(math.ceil(state["packets"] - estimate))
+            if estimate >= self.threshold * state["packets"] or missing <= 0:
+                continue
+            log.info("%s: state %i (fake traffic port %i) has %.1f of %i chaff packets, injecting %i" % (
+                pool.device, state["state"], state["fake_port"], estimate, state["packets"], missing))
+            await self.inject(pool, state, missing)
+            injected += missing
+        if injected:
+            pool.top_ups += 1
+            pool.injected += injected
+        return injected
+
+    async def watch(self, pool):
+        """polls the counters of a device and tops up its states"""
+        while True:
+            try:
+                counters = await pool.backend.counters(pool.ports)
+            except (OSError, asyncio.TimeoutError, ValueError) as e:
+                log.warning("%s: cannot read the counters (%s)" % (pool.device, e))
+                pool.last = None
+                await asyncio.sleep(self.interval)
+                continue
+            now = time.time()
+            if pool.last is not None:
+                estimates = pool.estimate(pool.last[1], counters, now - pool.last[0])
+                if estimates is None:
+                    log.warning("%s: counters went back, skipping the interval" % pool.device)
+                else:
+                    log.debug("%s: chaff packets per state %s" % (pool.device, " ".join(["%.1f" % e for e in estimates])))
+                    if await self.top_up(pool, estimates):
+                        # start a new interval after the injection
+                        counters = await pool.backend.counters(pool.ports)
+                        now = time.time()
+            pool.last = (now, counters)
+            await asyncio.sleep(self.interval)
+
+    async def run(self, duration=None):
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in [signal.SIGINT, signal.SIGTERM]:
+            loop.add_signal_handler(signum, stop.set)
+        tasks = [asyncio.ensure_future(self.watch(pool)) for pool in self.pools]
+        try:
+            await asyncio.wait_for(stop.wait(), duration)
+        except asyncio.TimeoutError:
+            pass
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for pool in self.pools:
+            await pool.backend.close()
+
+
+def parse_switches(switches):
+    """returns device -> (host, port) of --switch device=host[:port]"""
+    addresses = {}
+    for switch in switches or []:
+        (device, address) = switch.split("=")
+        (host, _, port) = address.partition(":")
+        addresses[device] = (host, int(port) if port else DEFAULT_COUNTER_PORT)
+    return addresses
+
+
+def parse_args(args):
+    """Parse command line parameters
+
+    Args:
+      args ([str]): command line parameters as list of strings
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="volume obfuscation chaff pool daemon")
+
+    parser.add_argument(
+        "--plan",
+        type=str,
+        nargs="+",
+        required=True,
+        help="injection plans of the devices (chaff_plan_X.json, see chaff_pool.py)")
+
+    parser.add_argument(
+        "--interface",
+        type=str,
+        default=None,
+        help="send the chaff over this interface (required without --stub)")
+
+    parser.add_argument(
+        "--switch",
+        type=str,
+        nargs="+",
+        default=None,
+        help="counter servers as device=host[:port] (default: the device name and port %i)" % DEFAULT_COUNTER_PORT)
+
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=DEFAULT_POLL_INTERVAL,
+        help="seconds between two polls of the counters of a device")
+
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="top up a state below this share of its planned chaff packets")
+
+    parser.add_argument(
+        "--loop-rtt",
+        type=float,
+        default=None,
+        help="round trip time of the clone loops in seconds (default: the RTT of the plans)")
+
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=None,
+        help="injection rate on the wire in Gbps (default: the rate of the plans)")
+
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=256,
+        help="number of frames per sendmmsg call")
+
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=None,
+        help="stop after this many seconds (default: run until SIGINT or SIGTERM)")
+
+    parser.add_argument(
+        "--stub",
+        dest="stub",
+        help="simulate the clone loops (no switch and no raw socket)",
+        action="store_true")
+
+    parser.add_argument(
+        "--stub-loss",
+        type=float,
+        default=0.,
+        help="loss rate of the simulated chaff packets per second")
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="store_const",
+        const=logging.INFO)
+
+    parser.add_argument(
+        "-vv",
+        "--very-verbose",
+        dest="loglevel",
+        help="set loglevel to DEBUG",
+        action="store_const",
+        const=logging.DEBUG)
+
+    return parser.parse_args(args)
+
+
+def main(args):
+    args = parse_args(args)
+    setup_logging(args.loglevel)
+
+    if not args.stub and args.interface is None:
+        log.error("--interface is required without --stub")
+        sys.exit(1)
+
+    plans = []
+    for filepath in args.plan:
+        with open(filepath) as f:
+            plans.append(json.load(f))
+
+    addresses = parse_switches(args.switch)
+    pools = []
+    for plan in plans:
+        if args.stub:
+            backend = StubLoops(args.loop_rtt or plan["loop_rtt"], args.stub_loss)
+        else:
+            backend = PdRpcCounters(*addresses.get(plan["device"], (plan["device"], DEFAULT_COUNTER_PORT)))
+        pools.append(ChaffPool(plan, backend, args.loop_rtt))
+        log.info("%s: %i chaff packets on fake traffic ports %s" % (plan["device"], plan["packets"], pools[-1].ports))
+
+    rate = args.rate or min([plan["rate_gbps"] for plan in plans])
+    if rate <= 0:
+        log.error("the fake traffic ports cannot carry the planned chaff (see chaff_pool.py)")
+        sys.exit(1)
+    bucket = TokenBucket(rate * 1e9 / 8, args.batch_size * (max([s["chaff_size"] for p in plans for s in p["states"]]) + WIRE_OVERHEAD))
+    injector = None if args.stub else RawInjector(args.interface, args.batch_size)
+
+    asyncio.run(ChaffDaemon(pools, injector, bucket, args.interval, args.threshold).run(args.duration))
+    if injector is not None:
+        injector.close()
+
+    for pool in pools:
+        log.info("%s: %i top-ups with %i chaff packets" % (pool.device, pool.top_ups, pool.injected))
+    log.info("done")
+
+
+def run():
+    """Entry point for console_scripts
+    """
+    main(sys.argv[1:])
+
+
+if __name__ == "__main__":
+    run()
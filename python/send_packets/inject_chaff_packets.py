@@ -3,6 +3,34 @@
 script to automatically inject chaff packets of the right size.
 usage: 
 sudo python inject_chaff_packets.py --interface ens785f0 -vv 
+sudo python inject_chaff_packets.py --interface ens785f0 --raw --repeat 100000 -v
+sudo python inject_chaff_packets.py --interface ens785f0 --raw --repeat 100000 --rate 1 \
+    --info ../../p4/traffic_pattern_tofino/pd_rpc_info_tofino1.json ../../p4/traffic_pattern_tofino/pd_rpc_info_tofino2.json -v
+python inject_chaff_packets.py --pcap benchmark.pcap --plan ../../p4/traffic_pattern_tofino/chaff_plan_tofino1.json \
+    --traffic production.pcap --load 40 --packets 100000000 -v
+
+With --raw, the frames are built once and sent in batches over a raw socket (see
+raw_injector.py), which is much faster than one scapy packet and sendp call per packet.
+
+The evaluation proxy (tofino3) forwards a chaff packet with the source MAC
+<device prefix>:0:0:0:0:<k> to the k-th fake traffic port of the device, where it is
+cloned in a loop (clone sessions of ports_cloning, see init_pd_rpc.py). With --info, the
+pattern, the fake traffic ports and PADDING_META_LEN are read from pd_rpc_info_X.json.
+The chaff of a state is as large as possible without padding (the largest packet which
+assign_to_queue maps to the state). --rate paces the injection with a token bucket so that
+the chaff loops are not overrun.
+
+--plan executes the injection plans of generate_code.py --chaff-plan (see chaff_pool.py):
+it sends exactly the planned number of chaff packets of each state (at the planned rate
+unless --rate is given).
+
+--pcap writes the chaff into a pcap file instead of sending it, spaced at --rate (default:
+--link-speed), for replay tools which send at line rate (e.g., tcpreplay). It is followed by
+production traffic with Poisson arrivals at --load and the packet sizes of --traffic (pcap file
+or packet size histogram, see traffic_trace.py), or by the arrivals of --trace (rescaled to
+--load if given). The frames are the ones of send_packet (production traffic with its default
+fields) and are built once per size; the arrivals are generated in chunks and the records are
+streamed into the file, so the memory does not grow with the number of packets.
 """
 
 import os, sys, time
@@ -12,7 +40,8 @@ import json
 import bisect
 import logging
 import random
-from scapy.all import *
+
+from raw_injector import TokenBucket, WIRE_OVERHEAD, MIN_FRAME_SIZE
 
 
 def setup_logging(loglevel="DEBUG"):
@@ -27,7 +56,162 @@ def setup_logging(loglevel="DEBUG"):
 
 log = logging.getLogger(__name__)
 
-def send_packet(interface, size, fields):
+# first byte of the source MAC of the chaff of each device (see fwd_srcmac_port of the evaluation proxy)
+DEVICE_MAC_PREFIX = {
+    "tofino1": 2,
+    "tofino2": 3,
+}
+
+# see PatternCodeGenerator.DEFAULT_CONSTANTS (without --info)
+DEFAULT_PADDING_META_LEN = 18
+
+# largest frame (without FCS) for an interface MTU of 1500 bytes
+DEFAULT_MAX_FRAME_SIZE = 1514
+
+# speed (Gbps) of the replaying interface, spaces the chaff in pcap files without --rate
+DEFAULT_LINK_SPEED = 100
+# production packets per chunk of arrivals in pcap files
+PCAP_CHUNK_SIZE = 100000
+
+
+def chaff_size(pattern, state, padding_meta_len, max_frame_size=DEFAULT_MAX_FRAME_SIZE):
+    """
+    returns the largest frame which the switch assigns to a state without padding
+    (None if the state only carries frames above max_frame_size, see generate_cli_assign_queue)
+    """
+    size = min(pattern[state] - padding_meta_len, max_frame_size)
+    lower_bound = max([s for s in pattern if s < pattern[state]] + [0]) - padding_meta_len
+    return size if size > lower_bound else None
+
+
+def chaff_packets(pattern, padding_meta_len=DEFAULT_PADDING_META_LEN, prefixes=sorted(DEVICE_MAC_PREFIX.values()), fake_ports=None, max_frame_size=DEFAULT_MAX_FRAME_SIZE):
+    """
+    returns the size and fields of the chaff packets of each state (one per device prefix)
+
+    Args:
+        pattern (list): pattern sizes
+        padding_meta_len (int): length of the padding_meta header
+        prefixes (list): first byte of the source MAC of each device
+        fake_ports (list): index of the fake traffic port (last byte of the source MAC) of each state
+            (default: the state index)
+        max_frame_size (int): largest frame of the interface
+    """
+    packets = []
+    for (i, size) in enumerate(pattern):
+        chaff = chaff_size(pattern, i, padding_meta_len, max_frame_size)
+        if chaff is None:
+            log.warning("state %i (%i bytes) cannot be filled with frames of at most %i bytes" % (i, size, max_frame_size))
+            continue
+        for prefix in prefixes:
+            packets.append((chaff, {"ETH_src": "%i:0:0:0:0:%i" % (prefix, fake_ports[i] if fake_ports else i)}))
+    return packets
+
+
+def info_chaff_packets(info, max_frame_size=DEFAULT_MAX_FRAME_SIZE):
+    """
+    returns the chaff packets of a device (see chaff_packets) from its pd_rpc_info_X.json
+    (each state of a traffic class of a link is mapped to one of the class's fake traffic ports in turn)
+    """
+    device = info["config"]["obfuscation_device"]
+    if device not in DEVICE_MAC_PREFIX:
+        raise ValueError("no source MAC prefix for the chaff of %s (see DEVICE_MAC_PREFIX)" % device)
+    packets = []
+    for (link, traffic_class) in [(l, c) for l in info.get("links") or [info] for c in l.get("traffic_classes") or [l]]:
+        pattern = traffic_class.get("pattern_sequence", info["config"]["pattern_sequence"])
+        ports = traffic_class.get("ports_cloning", link.get("ports_cloning", info["ports_cloning"]))
+        fake_ports = [info["ports_cloning"].index(ports[i % len(ports)]) for i in range(len(pattern))]
+        packets += chaff_packets(pattern, info["constants"]["PADDING_META_LEN"], [DEVICE_MAC_PREFIX[device]], fake_ports, max_frame_size)
+    return packets
+
+
+def plan_phases(plans):
+    """
+    returns the phases of the injection plans (chaff packets, repetitions): the packets of all
+    states are sent in turn, states with fewer planned packets drop out in later phases
+    """
+    packets = []
+    for plan in plans:
+        if plan["device"] not in DEVICE_MAC_PREFIX:
+            raise ValueError("no source MAC prefix for the chaff of %s (see DEVICE_MAC_PREFIX)" % plan["device"])
+        for s in plan["states"]:
+            fields = {"ETH_src": "%i:0:0:0:0:%i" % (DEVICE_MAC_PREFIX[plan["device"]], s["fake_port_index"])}
+            packets.append((s["packets"], (s["chaff_size"], fields)))
+
+    phases = []
+    sent = 0
+    for count in sorted(set([c for (c, packet) in packets if c > 0])):
+        phases.append(([packet for (c, packet) in packets if c >= count], count - sent))
+        sent = count
+    return phases
+
+
+def chaff_records(phases, rate_gbps, start=0.):
+    """yields (timestamp, frame) of the chaff packets of the phases, spaced at rate_gbps on the wire"""
+    from raw_injector import chaff_frame
+
+    now = start
+    for (packets, repeat) in phases:
+        frames = [chaff_frame(max(size, MIN_FRAME_SIZE), fields) for (size, fields) in packets]
+        gaps = [(len(frame) + WIRE_OVERHEAD) * 8. / (rate_gbps * 1e9) for frame in frames]
+        for _ in range(repeat):
+            for (frame, gap) in zip(frames, gaps):
+                yield (now, frame)
+                now += gap
+
+
+def production_records(chunks, start=0.):
+    """yields (timestamp, frame) of production packets (frames of send_packet without fields)
+    from chunks of arrivals (see queue_simulator.poisson_chunks)"""
+    from raw_injector import chaff_frame
+
+    frames = {}
+    for (timestamps, sizes) in chunks:
+        for (timestamp, size) in zip(timestamps.tolist(), sizes.tolist()):
+            if size not in frames:
+                frames[size] = chaff_frame(max(size, MIN_FRAME_SIZE))
+            yield (start + timestamp, frames[size])
+
+
+def write_pcap(filepath, phases, rate_gbps, args):
+    """
+    writes the chaff of the phases, followed by the production traffic of --traffic or --trace,
+    to a pcap file
+
+    Returns:
+        dict: packets, bytes and seconds (timestamp of the last packet)
+    """
+    from raw_injector import PcapWriter
+
+    writer = PcapWriter(filepath)
+    now = 0.
+    for (now, frame) in chaff_records(phases, rate_gbps):
+        writer.write(now, frame)
+    log.info("wrote %i chaff packets (%.6fs)" % (writer.packets, now))
+
+    if args.traffic or args.trace:
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../p4_code_generator"))
+        from traffic_trace import load_trace, load_packet_sizes
+        from queue_simulator import poisson_chunks, trace_chunks
+
+        if args.trace:
+            (timestamps, sizes) = load_trace(args.trace)
+            chunks = trace_chunks(timestamps, sizes, PCAP_CHUNK_SIZE, args.load)
+        else:
+            (sizes, counts) = load_packet_sizes(args.traffic)
+            chunks = poisson_chunks(sizes, counts, args.load or 1., args.packets, PCAP_CHUNK_SIZE)
+        chaff = writer.packets
+        # the production traffic starts after the chaff (the clone loops are filled)
+        for (now, frame) in production_records(chunks, now):
+            writer.write(now, frame)
+        log.info("wrote %i production packets" % (writer.packets - chaff))
+
+    writer.close()
+    return {"packets": writer.packets, "bytes": writer.bytes, "seconds": now}
+
+
+def send_packet(interface, size, fields, bucket=None):
+    from scapy.all import Ether, IP, TCP, sendp
+
     if size == 0:
         size = random.randint(50,1500)
 
@@ -44,6 +228,8 @@ def send_packet(interface, size, fields):
         / TCP(flags=fields.get("TCP_flags",0)) \
         / payload
 
+    if bucket is not None:
+        bucket.consume(len(pkt) + WIRE_OVERHEAD)
     sendp(pkt, iface=interface, verbose=False)
 
 def parse_args(args):
@@ -61,8 +247,8 @@ def parse_args(args):
     parser.add_argument(
         "--interface",
         type=str,
-        required=True,
-        help="send packet over this interface")
+        default=None,
+        help="send packet over this interface (required without --pcap)")
     
     parser.add_argument(
         "-l",
@@ -70,6 +256,93 @@ def parse_args(args):
         dest="loop",
         help="send packets in an infinite loop",
         action="store_true")
+
+    parser.add_argument(
+        "--pattern",
+        type=int,
+        nargs="+",
+        default=[533, 1066, 1600],
+        help="pattern sizes")
+
+    parser.add_argument(
+        "--info",
+        type=str,
+        nargs="+",
+        default=None,
+        help="take the pattern, sizes and fake traffic ports from these pd_rpc_info_X.json files (instead of --pattern)")
+
+    parser.add_argument(
+        "--plan",
+        type=str,
+        nargs="+",
+        default=None,
+        help="send the chaff packets of these injection plans (chaff_plan_X.json, see chaff_pool.py)")
+
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=None,
+        help="injection rate on the wire in Gbps (token bucket, default: back-to-back)")
+
+    parser.add_argument(
+        "--max-frame-size",
+        type=int,
+        default=DEFAULT_MAX_FRAME_SIZE,
+        help="largest frame (without FCS) of the interface")
+
+    parser.add_argument(
+        "--raw",
+        dest="raw",
+        help="send prebuilt frames in batches over a raw socket (no scapy)",
+        action="store_true")
+
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="send the chaff packets of all states this many times (without --plan)")
+
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=256,
+        help="number of frames per sendmmsg call (only with --raw)")
+
+    parser.add_argument(
+        "--pcap",
+        type=str,
+        default=None,
+        help="write the packets to this pcap file instead of sending them")
+
+    parser.add_argument(
+        "--link-speed",
+        type=float,
+        default=DEFAULT_LINK_SPEED,
+        help="speed of the replaying interface in Gbps (spaces the chaff in the pcap file without --rate)")
+
+    parser.add_argument(
+        "--traffic",
+        type=str,
+        default=None,
+        help="production packet sizes for the pcap file (pcap file or packet size histogram, Poisson arrivals at --load)")
+
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default=None,
+        help="production arrivals for the pcap file (pcap file or CSV file with timestamp,size)")
+
+    parser.add_argument(
+        "--load",
+        type=float,
+        default=None,
+        help="production load in Gbps (Poisson arrivals, default 1, or rescaled trace)")
+
+    parser.add_argument(
+        "--packets",
+        type=int,
+        default=1000000,
+        help="number of production packets with Poisson arrivals")
     
     parser.add_argument(
         "-v",
@@ -95,16 +368,61 @@ def main(args):
     args = parse_args(args)
     setup_logging(args.loglevel)
 
-    pattern = [533, 1066, 1600]
+    if args.interface is None and args.pcap is None:
+        log.error("--interface or --pcap is required")
+        sys.exit(1)
+
+    rate = args.rate
+    if args.plan:
+        plans = []
+        for filepath in args.plan:
+            with open(filepath) as f:
+                plans.append(json.load(f))
+        phases = plan_phases(plans)
+        if rate is None:
+            rate = min([plan["rate_gbps"] for plan in plans])
+            if rate <= 0:
+                log.error("the fake traffic ports cannot carry the planned chaff (see chaff_pool.py)")
+                sys.exit(1)
+        log.info("injecting %i chaff packets at %.2f Gbps" % (sum([len(p) * r for (p, r) in phases]), rate))
+    elif args.info:
+        packets = []
+        for filepath in args.info:
+            with open(filepath) as f:
+                packets += info_chaff_packets(json.load(f), args.max_frame_size)
+        phases = [(packets, args.repeat)]
+    else:
+        phases = [(chaff_packets(args.pattern, max_frame_size=args.max_frame_size), args.repeat)]
+    for (size, fields) in phases[0][0] if phases else []:
+        log.debug("chaff of %i bytes with src MAC %s" % (size, fields["ETH_src"]))
+
+    if args.pcap:
+        result = write_pcap(args.pcap, phases, rate or args.link_speed, args)
+        log.info("wrote %i packets (%.1f MB, %.6fs) to %s" % (result["packets"], result["bytes"] / 1e6, result["seconds"], args.pcap))
+        return
+
+    bucket = TokenBucket(rate * 1e9 / 8, args.batch_size * (args.max_frame_size + WIRE_OVERHEAD)) if rate else None
+
+    if args.raw:
+        from raw_injector import RawInjector, chaff_frame, MIN_FRAME_SIZE
+        injector = RawInjector(args.interface, args.batch_size)
+        while True:
+            for (packets, repeat) in phases:
+                frames = [chaff_frame(max(size, MIN_FRAME_SIZE), fields) for (size, fields) in packets]
+                result = injector.send(frames, repeat, bucket)
+                log.info("sent %i packets (%.1f MB) in %.3fs: %.0f pps, %.2f Gbps" % (
+                    result["packets"], result["bytes"] / 1e6, result["seconds"], result["pps"], result["bytes"] * 8 / result["seconds"] / 1e9))
+            if not args.loop or args.plan:
+                break
+        injector.close()
 
-    while True:
-        i = 0
-        for size in pattern:
-            send_packet(args.interface, min(size - 30, 1500), {"ETH_src": "2:0:0:0:0:%i" % i})
-            send_packet(args.interface, min(size - 30, 1500), {"ETH_src": "3:0:0:0:0:%i" % i})
-            i += 1
+    while not args.raw:
+        for (packets, repeat) in phases:
+            for _ in range(repeat):
+                for (size, fields) in packets:
+                    send_packet(args.interface, size, fields, bucket)
         
-        if not args.loop:
+        if not args.loop or args.plan:
             break
     
 
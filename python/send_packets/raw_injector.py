@@ -0,0 +1,265 @@
+"""
+raw socket injector and pcap writer for prebuilt chaff frames (without scapy).
+usage:
+sudo python inject_chaff_packets.py --interface ens785f0 --raw --repeat 100000 -v
+python inject_chaff_packets.py --pcap chaff.pcap --repeat 100000 -v
+
+Every distinct chaff frame (one per state of the pattern and ETH_src prefix, see
+inject_chaff_packets.py) is built once as raw bytes. The frames are sent in batches
+through an AF_PACKET socket with sendmmsg (one system call per batch). Without
+sendmmsg in the C library, each frame is sent with its own send call. PcapWriter streams
+timestamped frames into a pcap file (nanosecond resolution) for replay tools.
+
+To test without a switch, send over one end of a veth pair and capture on the other:
+sudo ip link add veth0 type veth peer name veth1
+sudo ip link set veth0 up && sudo ip link set veth1 up
+sudo tcpdump -i veth1 -c 6 -e &
+sudo python inject_chaff_packets.py --interface veth0 --raw -v
+"""
+
+import os, sys, time
+import ctypes
+import ctypes.util
+import errno
+import logging
+import socket
+import struct
+
+
+log = logging.getLogger(__name__)
+
+ETH_P_IP = 0x0800
+IPPROTO_TCP = 6
+
+# header lengths of a chaff frame (ethernet, IPv4 and TCP without options)
+ETH_HEADER_LEN = 14
+IP_HEADER_LEN = 20
+TCP_HEADER_LEN = 20
+MIN_FRAME_SIZE = ETH_HEADER_LEN + IP_HEADER_LEN + TCP_HEADER_LEN
+# bytes of a frame on the wire which are not sent by the host (FCS, preamble and inter-frame gap)
+WIRE_OVERHEAD = 4 + 8 + 12
+
+# pcap file format (see traffic_trace.py)
+PCAP_MAGIC_NS = 0xa1b23c4d
+LINKTYPE_ETHERNET = 1
+
+DEFAULT_FIELDS = {
+    "ETH_src"   : "11:01:02:03:04:05",
+    "ETH_dst"   : "00:01:02:03:04:05",
+    "IP_src"    : "1.1.1.1",
+    "IP_dst"    : "1.1.1.2",
+    "TCP_flags" : 0,
+}
+
+
+def mac_to_bytes(mac):
+    return struct.pack("!6B", *[int(b, 16) for b in mac.split(":")])
+
+
+def checksum(data):
+    """returns the internet checksum (RFC 1071) of data"""
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack("!%iH" % (len(data) // 2), data))
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+
+def chaff_frame(size, fields=None):
+    """
+    returns the frame (bytes) which is sent by inject_chaff_packets.send_packet
+    (Ether()/IP()/TCP()/payload with the defaults of scapy)
+
+    Args:
+        size (int): frame size (without FCS), at least MIN_FRAME_SIZE
+        fields (dict): ETH_src, ETH_dst, IP_src, IP_dst and TCP_flags (see DEFAULT_FIELDS)
+    """
+    assert size >= MIN_FRAME_SIZE, "a chaff frame needs at least %i bytes" % MIN_FRAME_SIZE
+    values = dict(DEFAULT_FIELDS)
+    values.update(fields or {})
+    (ip_src, ip_dst) = (socket.inet_aton(values["IP_src"]), socket.inet_aton(values["IP_dst"]))
+    payload = b"x" * (size - MIN_FRAME_SIZE)
+
+    ip_header = struct.pack("!BBHHHBBH4s4s", 0x45, 0, size - ETH_HEADER_LEN, 1, 0, 64, IPPROTO_TCP, 0, ip_src, ip_dst)
+    ip_header = ip_header[:10] + struct.pack("!H", checksum(ip_header)) + ip_header[12:]
+
+    tcp_header = struct.pack("!HHIIBBHHH", 20, 80, 0, 0, (TCP_HEADER_LEN // 4) << 4, values["TCP_flags"], 8192, 0, 0)
+    pseudo_header = struct.pack("!4s4sBBH", ip_src, ip_dst, 0, IPPROTO_TCP, TCP_HEADER_LEN + len(payload))
+    tcp_header = tcp_header[:16] + struct.pack("!H", checksum(pseudo_header + tcp_header + payload)) + tcp_header[18:]
+
+    ethernet_header = mac_to_bytes(values["ETH_dst"]) + mac_to_bytes(values["ETH_src"]) + struct.pack("!H", ETH_P_IP)
+    return ethernet_header + ip_header + tcp_header + payload
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst):
+        """
+        Args:
+            rate (float): bytes per second
+            burst (int): maximum number of tokens (bytes)
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.time()
+
+    def consume(self, amount):
+        """waits until the bucket has amount tokens (at most burst) and takes them"""
+        while True:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= min(amount, self.burst):
+                self.tokens -= amount
+                return
+            time.sleep((min(amount, self.burst) - self.tokens) / self.rate)
+
+
+class PcapWriter(object):
+
+    def __init__(self, filepath, batch_size=4096, snaplen=65535):
+        """
+        Args:
+            filepath (string): pcap file (overwritten)
+            batch_size (int): number of records per write call
+            snaplen (int): largest frame
+        """
+        self.file = open(filepath, "wb")
+        self.file.write(struct.pack("<IHHiIII", PCAP_MAGIC_NS, 2, 4, 0, 0, snaplen, LINKTYPE_ETHERNET))
+        self.record_header = struct.Struct("<IIII")
+        self.batch_size = batch_size
+        self.records = []
+        self.packets = 0
+        self.bytes = 0
+
+    def write(self, timestamp, frame):
+        """appends a frame with its timestamp (seconds)"""
+        nanoseconds = int(round(timestamp * 1e9))
+        self.records.append(self.record_header.pack(nanoseconds // 1000000000, nanoseconds % 1000000000, len(frame), len(frame)))
+        self.records.append(frame)
+        self.packets += 1
+        self.bytes += len(frame)
+        if len(self.records) >= 2 * self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.file.write(b"".join(self.records))
+        self.records = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", msghdr), ("msg_len", ctypes.c_uint)]
+
+
+def load_sendmmsg():
+    """returns sendmmsg of the C library (None if it is not available)"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+
+class RawInjector(object):
+
+    def __init__(self, interface, batch_size=64):
+        """
+        Args:
+            interface (string): send the frames over this interface
+            batch_size (int): number of frames per sendmmsg call
+        """
+        self.interface = interface
+        self.batch_size = batch_size
+        self.socket = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
+        self.socket.bind((interface, 0))
+        self.sendmmsg = load_sendmmsg()
+        if self.sendmmsg is None:
+            log.warning("sendmmsg is not available, sending one frame per system call")
+
+    def close(self):
+        self.socket.close()
+
+    def __batch(self, frames, batch_size):
+        """returns the message headers of a batch which cycles through the frames"""
+        self.buffers = [ctypes.create_string_buffer(frame, len(frame)) for frame in frames]
+        self.iovecs = (iovec * len(frames))(*[iovec(ctypes.cast(b, ctypes.c_void_p), len(f)) for (b, f) in zip(self.buffers, frames)])
+        messages = (mmsghdr * batch_size)()
+        for i in range(batch_size):
+            messages[i].msg_hdr.msg_iov = ctypes.pointer(self.iovecs[i % len(frames)])
+            messages[i].msg_hdr.msg_iovlen = 1
+        return messages
+
+    def __send_batch(self, messages, count):
+        """sends the first count messages of a batch (retries if the socket buffer is full)"""
+        sent = 0
+        size = ctypes.sizeof(mmsghdr)
+        while sent < count:
+            result = self.sendmmsg(self.socket.fileno(), ctypes.cast(ctypes.addressof(messages) + sent * size, ctypes.POINTER(mmsghdr)), count - sent, 0)
+            if result < 0:
+                error = ctypes.get_errno()
+                if error in [errno.ENOBUFS, errno.EAGAIN, errno.EINTR]:
+                    continue
+                raise OSError(error, os.strerror(error))
+            sent += result
+
+    def send(self, frames, repeat=1, bucket=None):
+        """
+        sends all frames repeat times (in the given order)
+
+        Args:
+            bucket (TokenBucket): optional pacing (bytes on the wire, see WIRE_OVERHEAD)
+
+        Returns:
+            dict: packets, bytes, seconds and pps
+        """
+        total = len(frames) * repeat
+        wire_bytes = [len(f) + WIRE_OVERHEAD for f in frames]
+        start = time.time()
+        if self.sendmmsg is None:
+            for _ in range(repeat):
+                for (frame, size) in zip(frames, wire_bytes):
+                    if bucket is not None:
+                        bucket.consume(size)
+                    self.socket.send(frame)
+        else:
+            # a batch starts with the first frame, so it is a multiple of the frames (except for the last one)
+            batch_size = max(len(frames), self.batch_size // len(frames) * len(frames))
+            messages = self.__batch(frames, batch_size)
+            batch_bytes = sum(wire_bytes) * (batch_size // len(frames))
+            for offset in range(0, total, batch_size):
+                count = min(batch_size, total - offset)
+                if bucket is not None:
+                    bucket.consume(batch_bytes if count == batch_size else sum([wire_bytes[i % len(frames)] for i in range(count)]))
+                self.__send_batch(messages, count)
+        seconds = max(time.time() - start, 1e-9)
+        return {
+            "packets" : total,
+            "bytes"   : sum([len(f) for f in frames]) * repeat,
+            "seconds" : seconds,
+            "pps"     : total / seconds,
+        }
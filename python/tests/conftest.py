@@ -0,0 +1,21 @@
+import os, sys
+
+import pytest
+
+# the tools import each other as top level modules (they are run from their directories)
+PYTHON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+for directory in ["p4_code_generator", "send_packets"]:
+    sys.path.insert(0, os.path.join(PYTHON_DIR, directory))
+
+# generated code of the prepared example
+P4_DIR = os.path.join(PYTHON_DIR, "../p4/traffic_pattern_tofino")
+
+
+def require_numpy():
+    """skips the calling test module without numpy (table_entries stores the entries in numpy arrays)"""
+    pytest.importorskip("numpy")
+
+
+def entry(table, match, priority=None, action="set_queue", **data):
+    """returns a table entry (like parse_bfshell)"""
+    return {"table": table, "action": action, "match": match, "priority": priority, "data": data}
@@ -0,0 +1,143 @@
+import os, sys
+import json
+import subprocess
+
+import pytest
+
+np = pytest.importorskip("numpy")
+yaml = pytest.importorskip("yaml")
+
+from conftest import P4_DIR, PYTHON_DIR
+from bfshell_interpreter import BfshellInterpreter, check_result, class_patterns
+from table_entries import TableEntries
+
+# a second protected link of tofino1 (see fleet.yaml)
+SECOND_LINK = {
+    "devices": ["tofino1", "tofino3"],
+    "ports": [3, 3],
+    "pattern": [400, 800, 1500],
+    "roles": {"tofino1": {"server": 6, "fake_traffic": [7], "recirculation": [9, 10]}},
+}
+VOICE = {"name": "voice", "dscp": [46], "pattern": [400, 800], "share": 0.1}
+
+
+def generate_fleet(directory, links, devices=None, args=()):
+    """generates the code of a fleet with the given links (and the port roles of fleet.yaml) into directory"""
+    with open(os.path.join(PYTHON_DIR, "p4_code_generator", "fleet.yaml")) as f:
+        configuration = yaml.safe_load(f)
+    configuration["links"] = links
+    configuration["devices"] = devices or {}
+    filepath = os.path.join(directory, "fleet.yaml")
+    with open(filepath, "w") as f:
+        yaml.safe_dump(configuration, f)
+    with open(os.devnull, "w") as devnull:
+        subprocess.check_call([sys.executable, "generate_code.py", "--fleet", filepath, "--output", directory] + list(args),
+            cwd=os.path.join(PYTHON_DIR, "p4_code_generator"), stdout=devnull, stderr=devnull)
+    return directory
+
+
+def load(directory, device="tofino1"):
+    """returns the interpreter and pd_rpc_info of a device"""
+    info_filepath = os.path.join(directory, "pd_rpc_info_%s.json" % device)
+    with open(info_filepath) as f:
+        info = json.load(f)
+    return (BfshellInterpreter.from_files(os.path.join(directory, "bfshell_input_%s.txt" % device), info_filepath), info)
+
+
+def production_packets(interpreter, info, n=20000):
+    """returns ingress port and frame size of packets on the input ports of all links"""
+    rng = np.random.RandomState(0)
+    ports = [p for p in interpreter.ports() if p not in info["ports_cloning"]]
+    return (rng.choice(ports, size=n), rng.randint(14 + 20, interpreter.constants["MTU"] + 1, size=n))
+
+
+@pytest.fixture(scope="module")
+def interpreter():
+    return load(P4_DIR)[0]
+
+
+def test_production_packets_get_the_size_of_their_state(interpreter):
+    rng = np.random.RandomState(0)
+    frame_size = rng.randint(14 + 20, interpreter.constants["MTU"] + 1, size=10000)
+    ingress_port = rng.choice(interpreter.ports(1), size=len(frame_size))
+
+    result = interpreter.simulate(ingress_port, frame_size)
+
+    assert result["obfuscated"].all()
+    assert check_result(interpreter, frame_size, result) == []
+    ok = ~result["dropped"]
+    assert ok.any()
+    assert (result["final_size"][ok] >= frame_size[ok]).all()
+
+
+def test_packets_of_other_ports_are_not_obfuscated(interpreter):
+    frame_size = np.array([100, 500, 1000])
+    ingress_port = np.full(len(frame_size), 511)
+
+    result = interpreter.simulate(ingress_port, frame_size)
+
+    assert not result["obfuscated"].any()
+    assert (result["final_size"] == frame_size).all()
+
+
+def test_deobfuscation_parses_the_added_pads(interpreter):
+    frame_size = np.arange(100, 1400, 100)
+    result = interpreter.simulate(np.full(len(frame_size), interpreter.ports(1)[0]), frame_size)
+    ok = ~result["dropped"]
+    bytes_added = result["final_size"] - interpreter.constants["PADDING_META_LEN"] - frame_size
+
+    assert (interpreter.deobfuscation_next_ethertype(bytes_added[ok]) == result["next_etherType"][ok]).all()
+
+
+def test_links_get_the_sizes_of_their_own_pattern(tmpdir):
+    directory = generate_fleet(str(tmpdir), [["tofino1", "tofino2"], SECOND_LINK], {"tofino1": {"fake_traffic": [4]}})
+    (interpreter, info) = load(os.path.join(directory, "tofino1"))
+    (ingress_port, frame_size) = production_packets(interpreter, info)
+
+    result = interpreter.simulate(ingress_port, frame_size)
+
+    assert check_result(interpreter, frame_size, result) == []
+    ok = ~result["dropped"]
+    for link in info["links"]:
+        in_link = ok & (result["link_id"] == link["link_id"])
+        assert in_link.any()
+        assert set(np.unique(result["final_size"][in_link])) == set(link["pattern_sequence"])
+
+
+def test_traffic_classes_are_selected_by_dscp(tmpdir):
+    directory = generate_fleet(str(tmpdir), [{"devices": ["tofino1", "tofino2"], "traffic_classes": [VOICE]}])
+    (interpreter, info) = load(os.path.join(directory, "tofino1"))
+    (ingress_port, frame_size) = production_packets(interpreter, info)
+    dscp = np.where(np.arange(len(frame_size)) % 2, 46, 0)
+
+    result = interpreter.simulate(ingress_port, frame_size, dscp)
+
+    assert check_result(interpreter, frame_size, result) == []
+    ok = ~result["dropped"]
+    voice = [c for c in info["traffic_classes"] if c["name"] == "voice"][0]
+    assert (result["traffic_type"][dscp == 46] == voice["traffic_type"]).all()
+    assert set(np.unique(result["final_size"][ok & (dscp == 46)])) == set(VOICE["pattern"])
+    assert set(np.unique(result["final_size"][ok & (dscp == 0)])) == set(info["config"]["pattern_sequence"])
+
+
+def test_single_lookup_padding_headers_add_the_bytes_of_add_padding(tmpdir):
+    directory = generate_fleet(str(tmpdir), [["tofino1", "tofino2"]], args=("--padding-mode", "single_lookup"))
+    (interpreter, info) = load(os.path.join(directory, "tofino1"))
+    (ingress_port, frame_size) = production_packets(interpreter, info, n=5000)
+    assert check_result(interpreter, frame_size, interpreter.simulate(ingress_port, frame_size)) == []
+
+    def padding_errors(change):
+        entries = list(TableEntries.load(os.path.join(directory, "tofino1", "bfshell_input_tofino1.txt")))
+        change([e for e in entries if e["table"].startswith("pad_headers_") and e["action"] != "_NoAction"])
+        broken = BfshellInterpreter(entries, info["constants"], class_patterns(info))
+        return [e for e in check_result(broken, frame_size, broken.simulate(ingress_port, frame_size)) if "padding headers" in e]
+
+    def break_chain(pad_entries):
+        pad_entries[0]["data"]["next_etherType"] += 1
+
+    def add_other_pads(pad_entries):
+        other = [e["action"] for e in pad_entries if e["action"] != pad_entries[0]["action"]][0]
+        pad_entries[0]["action"] = other
+
+    assert padding_errors(break_chain)
+    assert padding_errors(add_other_pads)
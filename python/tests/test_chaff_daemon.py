@@ -0,0 +1,92 @@
+import sys
+import random
+import time
+
+import pytest
+
+if sys.version_info < (3, 7):
+    pytest.skip("chaff_daemon.py requires python 3.7 or later", allow_module_level=True)
+
+import asyncio
+
+from chaff_daemon import binomial, StubLoops, ChaffPool, ChaffDaemon
+
+
+def plan():
+    states = [
+        {"state": 0, "chaff_size": 515, "fake_port": 144, "fake_port_index": 0, "packets": 40},
+        {"state": 1, "chaff_size": 1048, "fake_port": 144, "fake_port_index": 0, "packets": 20},
+        {"state": 2, "chaff_size": 1514, "fake_port": 152, "fake_port_index": 1, "packets": 30},
+    ]
+    return {"device": "tofino1", "loop_rtt": 10e-6, "states": states, "packets": 90}
+
+
+@pytest.mark.parametrize("n,p", [(43, .05), (43, .5), (1000, .3)])
+def test_binomial_has_the_mean_and_variance_of_the_distribution(n, p):
+    rng = random.Random(0)
+    draws = [binomial(rng, n, p) for _ in range(20000)]
+    mean = sum(draws) / len(draws)
+    variance = sum([(d - mean) ** 2 for d in draws]) / len(draws)
+
+    assert min(draws) >= 0 and max(draws) <= n
+    assert mean == pytest.approx(n * p, rel=.05)
+    assert variance == pytest.approx(n * p * (1 - p), rel=.1)
+
+
+def test_binomial_bounds():
+    rng = random.Random(0)
+    assert binomial(rng, 0, .5) == 0
+    assert binomial(rng, 10, 0.) == 0
+    assert binomial(rng, 10, 1.) == 10
+
+
+def test_stub_loops_send_every_packet_once_per_rtt():
+    loops = StubLoops(10e-6)
+    loops.inject(144, 100, 5)
+    loops.last -= 1.
+
+    (frames, octets) = asyncio.run(loops.counters([144]))[144]
+
+    assert frames == pytest.approx(5 / 10e-6, rel=.01)
+    assert octets == pytest.approx(100 * 5 / 10e-6, rel=.01)
+    assert loops.population[144][100] == 5
+
+
+def test_stub_loops_lose_packets():
+    loops = StubLoops(10e-6, loss_rate=1., seed=0)
+    loops.inject(144, 100, 10000)
+    loops.last -= 1.
+    loops.advance()
+
+    # a share of 1 - exp(-1) is lost in one second
+    assert loops.population[144][100] == pytest.approx(10000 * 0.368, rel=.05)
+
+
+def test_estimate_splits_the_population_of_a_port_by_the_planned_packets():
+    pool = ChaffPool(plan(), StubLoops(10e-6))
+    previous = {144: (0, 0), 152: (0, 0)}
+    current = {144: (int(30 / 10e-6), 0), 152: (int(30 / 10e-6), 0)}
+
+    assert pool.estimate(previous, current, 1.) == pytest.approx([20, 10, 30])
+    # counters of a restarted switch
+    assert pool.estimate(current, previous, 1.) is None
+
+
+def test_top_up_injects_the_missing_chaff_of_the_states_below_the_threshold():
+    pool = ChaffPool(plan(), StubLoops(10e-6))
+    daemon = ChaffDaemon([pool], None, threshold=.9)
+
+    injected = asyncio.run(daemon.top_up(pool, [20, 17, 29.5]))
+
+    assert injected == 20 + 3
+    assert pool.backend.population == {144: {515: 20, 1048: 3}}
+    assert (pool.top_ups, pool.injected) == (1, 23)
+
+
+def test_daemon_fills_empty_loops():
+    pool = ChaffPool(plan(), StubLoops(10e-6))
+
+    asyncio.run(ChaffDaemon([pool], None, interval=.05).run(.5))
+
+    assert pool.backend.population == {144: {515: 40, 1048: 20}, 152: {1514: 30}}
+    assert pool.injected == 90
@@ -0,0 +1,74 @@
+import os
+import copy
+import json
+import math
+
+import pytest
+
+# (chaff_pool uses the shaping rates of table_delta)
+pytest.importorskip("numpy")
+
+from conftest import P4_DIR
+from chaff_pool import chaff_plan, check_plan, chaff_size, WIRE_OVERHEAD
+from queue_simulator import SHAPING_MARGIN
+
+
+@pytest.fixture
+def info():
+    with open(os.path.join(P4_DIR, "pd_rpc_info_tofino1.json")) as f:
+        return json.load(f)
+
+
+def test_chaff_size_is_the_largest_unpadded_frame_of_the_state():
+    pattern = [533, 1066, 1600]
+    assert [chaff_size(pattern, i, 18) for i in range(3)] == [515, 1048, 1514]
+    # frames above the largest frame of the interface
+    assert chaff_size([1600, 1700], 1, 18) is None
+
+
+def test_states_get_their_packets_per_loop_rtt(info):
+    plan = chaff_plan(info, loop_rtt=10e-6, headroom=.1)
+
+    pattern = info["config"]["pattern_sequence"]
+    assert [s["state"] for s in plan["states"]] == list(range(len(pattern)))
+    for s in plan["states"]:
+        rate = 100e9 / sum(pattern) * s["size"] * (1 - SHAPING_MARGIN)
+        assert s["pps"] == pytest.approx(rate / (8. * s["size"]))
+        assert s["packets"] == int(math.ceil(s["pps"] * 10e-6 * 1.1))
+        assert s["fake_port"] == info["ports_cloning"][s["state"]]
+    assert plan["device"] == "tofino1"
+    assert plan["packets"] == sum([s["packets"] for s in plan["states"]])
+
+
+def test_ports_carry_the_chaff_of_their_states(info):
+    plan = chaff_plan(info, loop_rtt=10e-6)
+
+    for p in plan["ports"]:
+        states = [s for s in plan["states"] if s["fake_port"] == p["fake_port"]]
+        assert p["packets"] == sum([s["packets"] for s in states])
+        assert p["chaff_gbps"] == pytest.approx(sum([s["packets"] * (s["chaff_size"] + WIRE_OVERHEAD) * 8. for s in states]) / 10e-6 / 1e9)
+    assert plan["rate_gbps"] == pytest.approx((100 - max([p["chaff_gbps"] for p in plan["ports"]])) * (1 - SHAPING_MARGIN))
+    assert check_plan(plan) == []
+
+
+def test_longer_loops_need_more_packets(info):
+    (short, long) = (chaff_plan(info, loop_rtt=10e-6), chaff_plan(info, loop_rtt=100e-6))
+
+    assert long["packets"] > 9 * short["packets"]
+    assert [p["chaff_gbps"] for p in long["ports"]] == pytest.approx([p["chaff_gbps"] for p in short["ports"]], rel=.05)
+
+
+def test_slow_fake_ports_are_reported(info):
+    plan = chaff_plan(info, loop_rtt=10e-6, port_speeds={144: 10})
+
+    assert len(check_plan(plan)) == 1 and "fake traffic port 144" in check_plan(plan)[0]
+    assert plan["rate_gbps"] == 0
+
+
+def test_states_above_the_largest_frame_get_no_chaff(info):
+    info = copy.deepcopy(info)
+    info["config"]["pattern_sequence"] = [533, 1600, 1700]
+
+    plan = chaff_plan(info, loop_rtt=10e-6)
+
+    assert [s["state"] for s in plan["states"]] == [0, 1]
@@ -0,0 +1,28 @@
+import pytest
+
+from raw_injector import chaff_frame, MIN_FRAME_SIZE
+
+
+def scapy_frame(size, fields):
+    """the packet of inject_chaff_packets.send_packet"""
+    scapy = pytest.importorskip("scapy.all")
+    payload = "x" * (size - 38 - 24 + 8)
+    pkt = scapy.Ether(src=fields.get("ETH_src", "11:01:02:03:04:05"), dst=fields.get("ETH_dst", "00:01:02:03:04:05")) \
+        / scapy.IP(src=fields.get("IP_src", "1.1.1.1"), dst=fields.get("IP_dst", "1.1.1.2")) \
+        / scapy.TCP(flags=fields.get("TCP_flags", 0)) \
+        / payload
+    return bytes(pkt)
+
+
+@pytest.mark.parametrize("size", [MIN_FRAME_SIZE, 64, 101, 1000, 1514])
+@pytest.mark.parametrize("fields", [{}, {"ETH_src": "2:0:0:0:0:3"}, {"ETH_src": "3:0:0:0:0:1", "IP_src": "10.0.0.1", "IP_dst": "10.0.0.2", "TCP_flags": 2}])
+def test_chaff_frame_is_the_scapy_frame(size, fields):
+    frame = chaff_frame(size, fields)
+
+    assert len(frame) == size
+    assert frame == scapy_frame(size, fields)
+
+
+def test_chaff_frame_needs_the_headers():
+    with pytest.raises(AssertionError):
+        chaff_frame(MIN_FRAME_SIZE - 1)
@@ -0,0 +1,84 @@
+import pytest
+
+from conftest import entry, require_numpy
+
+require_numpy()
+
+from table_delta import plan_update, apply_plan, stub_check, shaping_rates
+
+
+def info(pattern, ports):
+    return {
+        "config": {"pattern_sequence": pattern},
+        "constants": {"TARGET_BW": 100},
+        "state_index_to_port": {str(i): p for (i, p) in enumerate(ports)},
+    }
+
+
+OLD = [
+    entry("deobfuscation_determine_next_ethertype", {"custom_metadata_bytes_to_add": 10}, action="set_next_ethertype", etherType=0x801),
+    entry("assign_to_queue", {"padding_meta_origLen": (0, 500)}, 1, qid=0),
+    entry("assign_to_queue", {"padding_meta_origLen": (501, 1500)}, 1, qid=1),
+]
+NEW = [
+    entry("deobfuscation_determine_next_ethertype", {"custom_metadata_bytes_to_add": 20}, action="set_next_ethertype", etherType=0x802),
+    entry("assign_to_queue", {"padding_meta_origLen": (0, 700)}, 1, qid=0),
+    entry("assign_to_queue", {"padding_meta_origLen": (701, 1500)}, 1, qid=1),
+]
+
+
+def operations(plan, step):
+    return [o for s in plan["steps"] if s["name"] == step for o in s["operations"]]
+
+
+def test_changed_program_requires_a_restart():
+    plan = plan_update({"tofino1": {"old": OLD, "new": NEW, "program_changes": ["INGRESS"]}})
+
+    assert plan["restart_required"]
+    assert plan["reasons"] == ["tofino1: generated P4 code changed (INGRESS)"]
+    with pytest.raises(ValueError):
+        apply_plan(plan, {})
+
+
+def test_obfuscation_entries_change_in_one_transaction():
+    plan = plan_update({"tofino1": {"old": OLD, "new": NEW}})
+
+    assert not plan["restart_required"]
+    assert [(o["op"], o["entry"]["data"]) for o in operations(plan, "prepare")] == [("add", {"etherType": 0x802})]
+    assert [(o["op"], o["entry"]["data"]) for o in operations(plan, "cleanup")] == [("delete", {"etherType": 0x801})]
+    assert [o["op"] for o in operations(plan, "switch")] == ["begin_transaction", "delete", "delete", "add", "add", "commit_transaction"]
+
+
+def test_unchanged_entries_need_no_operations():
+    plan = plan_update({"tofino1": {"old": OLD, "new": list(OLD)}})
+
+    assert sum([len(s["operations"]) for s in plan["steps"]]) == 0
+
+
+def test_lower_shaping_rates_are_set_before_the_switch_and_higher_ones_after():
+    (old_info, new_info) = (info([500, 1000], [144, 152]), info([1000, 500], [144, 152]))
+    plan = plan_update({"tofino1": {"old": OLD, "new": NEW, "old_info": old_info, "new_info": new_info}})
+
+    switch = operations(plan, "switch")
+    rates = shaping_rates(new_info)
+    assert switch[0] == {"device": "tofino1", "op": "set_shaping_rate", "port": 152, "rate": rates[152]}
+    assert switch[-1] == {"device": "tofino1", "op": "set_shaping_rate", "port": 144, "rate": rates[144]}
+    assert rates[144] > shaping_rates(old_info)[144]
+
+
+def test_plan_applies_on_a_stub_switch():
+    plan = plan_update({"tofino1": {"old": OLD, "new": NEW}, "tofino2": {"old": OLD, "new": NEW}})
+
+    assert stub_check(plan, {"tofino1": OLD, "tofino2": OLD}, {"tofino1": NEW, "tofino2": NEW}) == []
+
+
+def test_overlapping_entries_without_transaction_are_rejected():
+    plan = plan_update({"tofino1": {"old": OLD, "new": NEW}})
+    switch = [s for s in plan["steps"] if s["name"] == "switch"][0]
+    switch["operations"] = [o for o in switch["operations"] if o["op"] not in ["begin_transaction", "commit_transaction"]]
+    # adds before deletes, like an update without transaction
+    switch["operations"].sort(key=lambda o: o["op"] != "add")
+
+    problems = stub_check(plan, {"tofino1": OLD}, {"tofino1": NEW})
+
+    assert len(problems) == 1 and "overlapping" in problems[0]
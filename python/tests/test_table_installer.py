@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+
+from conftest import entry, require_numpy
+
+require_numpy()
+
+from table_installer import StubServer, StubSession, TableInstaller, verify, overlap
+
+
+@pytest.fixture
+def session():
+    server = StubServer(("localhost", 0))
+    thread = threading.Thread(target=server.serve)
+    thread.start()
+    session = StubSession(server.listener.address)
+    yield session
+    session.close()
+    thread.join()
+
+
+def test_install_adds_every_entry_in_batches(session):
+    entries = [entry("traffic_type", {"ig_intr_md_ingress_port": p}, action="set_traffic_type", traffic_type=1) for p in range(5)] \
+        + [entry("assign_to_queue", {"padding_meta_origLen": (i * 100, i * 100 + 99)}, 1, qid=i) for i in range(3)]
+
+    report = TableInstaller(session, batch_size=2).install(entries)
+
+    assert [(r["table"], r["entries"], r["batches"]) for r in report] == [("traffic_type", 5, 3), ("assign_to_queue", 3, 2)]
+    assert verify(entries, session.installed_entries()) == []
+    assert session.call("calls")["begin_batch"] == 2
+
+
+def test_duplicate_and_missing_entries_are_rejected(session):
+    e = entry("traffic_type", {"ig_intr_md_ingress_port": 1}, action="set_traffic_type", traffic_type=1)
+    session.add(e)
+    with pytest.raises(RuntimeError, match="duplicate"):
+        session.add(e)
+    with pytest.raises(RuntimeError, match="no entry"):
+        session.delete(entry("traffic_type", {"ig_intr_md_ingress_port": 2}))
+    with pytest.raises(RuntimeError, match="no entry"):
+        session.modify(entry("traffic_type", {"ig_intr_md_ingress_port": 2}))
+
+
+def test_overlapping_entries_need_different_priorities(session):
+    session.add(entry("assign_to_queue", {"padding_meta_origLen": (0, 100)}, 1, qid=0))
+    session.add(entry("assign_to_queue", {"padding_meta_origLen": (101, 200)}, 1, qid=1))
+    session.add(entry("assign_to_queue", {"padding_meta_origLen": (50, 150)}, 2, qid=2))
+    with pytest.raises(RuntimeError, match="overlapping"):
+        session.add(entry("assign_to_queue", {"padding_meta_origLen": (150, 250)}, 1, qid=3))
+
+
+def test_transaction_replaces_overlapping_entries_at_once(session):
+    old = [entry("assign_to_queue", {"padding_meta_origLen": (0, 100)}, 1, qid=0)]
+    new = [entry("assign_to_queue", {"padding_meta_origLen": (0, 50)}, 1, qid=0),
+           entry("assign_to_queue", {"padding_meta_origLen": (51, 100)}, 1, qid=1)]
+    session.add(old[0])
+
+    session.begin_transaction()
+    for e in new:
+        session.add(e)
+    # nothing changes before the commit
+    assert verify(old, session.installed_entries()) == []
+    session.delete(old[0])
+    session.commit_transaction()
+
+    assert verify(new, session.installed_entries()) == []
+
+
+def test_failed_transaction_keeps_the_entries(session):
+    old = entry("assign_to_queue", {"padding_meta_origLen": (0, 100)}, 1, qid=0)
+    session.add(old)
+
+    session.begin_transaction()
+    session.add(entry("assign_to_queue", {"padding_meta_origLen": (0, 50)}, 1, qid=0))
+    with pytest.raises(RuntimeError, match="overlapping"):
+        session.commit_transaction()
+
+    assert verify([old], session.installed_entries()) == []
+
+
+def test_overlap():
+    assert overlap(5, 5)
+    assert not overlap(5, 6)
+    assert overlap((0, 10), 10)
+    assert not overlap((0, 10), (11, 20))
+    assert overlap((0, 10), None)